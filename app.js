@@ -391,6 +391,23 @@ function closeForm() {
 let isSubmitting = false;
 let formTimeoutId = null;
 
+// Idempotency-Key: one per form fill, reused by retries until the backend confirms.
+// A double click or a resend after a lost response returns the original lead instead of a new row.
+// The key is tied to the exact payload: editing a field after a failed submit is a new fill,
+// otherwise the backend would answer with the lead saved from the old values.
+let modalFormKey = null;
+
+function newIdempotencyKey() {
+  if (window.crypto && typeof window.crypto.randomUUID === 'function') {
+    return window.crypto.randomUUID();
+  }
+  return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2) + Math.random().toString(36).slice(2);
+}
+
+function idempotencyKeyFor(previous, body) {
+  return previous && previous.body === body ? previous : { body, key: newIdempotencyKey() };
+}
+
 function validateEmail(email) {
   const emailRegex = /^[^\s@]+@[^\s@]+\.[^\s@]+$/;
   return emailRegex.test(email);
@@ -433,22 +450,26 @@ async function handleFormSubmit(e) {
     formTimeoutId = null;
   }
 
+  const body = JSON.stringify({
+    name: data.name,
+    email: data.email,
+    budget: data.budget,
+    form_type: 'modal'
+  });
+  modalFormKey = idempotencyKeyFor(modalFormKey, body);
+
   try {
     // Enviar para backend
     const response = await fetch('/api/leads', {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({
-        name: data.name,
-        email: data.email,
-        budget: data.budget,
-        form_type: 'modal'
-      })
+      headers: { 'Content-Type': 'application/json', 'Idempotency-Key': modalFormKey.key },
+      body
     });
 
     if (!response.ok) {
       throw new Error('Erro ao enviar formulário');
     }
+    modalFormKey = null;
 
     // Check if modal is still open before updating UI
     const modal = document.getElementById('lead-form-modal');
@@ -687,30 +708,35 @@ document.addEventListener('DOMContentLoaded', () => {
   // --- NEW FORM LOGIC ---
   const inlineForm = document.getElementById('contact-form-inline');
   if (inlineForm) {
+    let inlineFormKey = null;
     inlineForm.addEventListener('submit', async function (e) {
       e.preventDefault();
 
       const btn = this.querySelector('button');
+      if (btn.disabled) return;
       const originalText = btn.innerText;
       btn.innerText = 'Enviando...';
       btn.disabled = true;
+      const body = JSON.stringify({
+        name: this.name.value,
+        contact: this.contact.value,
+        message: this.message.value,
+        form_type: 'inline'
+      });
+      inlineFormKey = idempotencyKeyFor(inlineFormKey, body);
 
       try {
         // Enviar para backend
         const response = await fetch('/api/leads', {
           method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({
-            name: this.name.value,
-            contact: this.contact.value,
-            message: this.message.value,
-            form_type: 'inline'
-          })
+          headers: { 'Content-Type': 'application/json', 'Idempotency-Key': inlineFormKey.key },
+          body
         });
 
         if (!response.ok) {
           throw new Error('Erro ao enviar formulário');
         }
+        inlineFormKey = null;
 
         // Hide form, Show success
         const formView = document.getElementById('form-view');
@@ -6,38 +6,1106 @@ Sem complexidade desnecessária, direto ao ponto.
 import sqlite3
 import os
 import logging
+import logging.handlers
 import time
-from flask import Flask, request, jsonify, render_template_string, session
+import atexit
+import json
+import base64
+import csv
+import io
+import re
+import zlib
+import gzip
+import shutil
+import hashlib
+import math
+import copy
+import random
+import bisect
+import fcntl
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal, ROUND_HALF_UP
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from collections import OrderedDict
+from contextlib import contextmanager
+import click
+from flask import (Blueprint, Flask, Response, current_app, g, has_app_context, jsonify, request,
+                   session, stream_with_context)
 from werkzeug.security import check_password_hash, generate_password_hash
 from functools import wraps
 
+# Brotli é opcional: sem o pacote o /admin sai só em gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 # Configurar logging (Grug ama logging!)
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# LOG_MODE=queue: o request só enfileira (put_nowait); uma thread escreve no stderr.
+# Fila cheia = registro descartado e contado, nunca request esperando o sink de log.
+# LOG_FORMAT=json: uma linha JSON por registro, com os campos de extra={...}.
+# LOG_SAMPLE_RATES="lead_created=0.1,leads_listed=0.05": amostra eventos de alto volume
+# (registros com extra={'event': ...}); evento fora da lista sai sempre.
+LOG_MODE = os.environ.get('LOG_MODE', 'sync')      # sync | queue
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')  # text | json
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+LOG_TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+def parse_sample_rates(value):
+    """'evento=taxa,evento=taxa' -> {evento: taxa}"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        event, _, rate = item.partition('=')
+        rates[event.strip()] = float(rate)
+    return rates
+
+LOG_SAMPLE_RATES = parse_sample_rates(os.environ.get('LOG_SAMPLE_RATES', ''))
+
+class JsonFormatter(logging.Formatter):
+    """Uma linha JSON: ts, level, logger, pid, msg + campos extras do registro"""
+    RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'pid': record.process,
+            'msg': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in self.RESERVED)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class SamplingFilter(logging.Filter):
+    """Deixa passar uma fração dos registros de cada evento amostrado"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        rate = self.rates.get(getattr(record, 'event', None))
+        return rate is None or random.random() < rate
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que nunca bloqueia: fila cheia descarta o registro"""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            get_metrics().inc('log_records_dropped_total')
+
+    def prepare(self, record):
+        # Mensagem e traceback viram texto aqui (args podem mudar depois); a formatação
+        # final (texto ou JSON) fica para a thread do listener
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+_log_listener = None
+
+def stop_log_listener():
+    """Escoa a fila de log no shutdown"""
+    global _log_listener
+    if _log_listener is not None:
+        try:
+            _log_listener.stop()
+        except queue.Full:
+            pass  # Sem espaço nem para o sentinela: thread é daemon, sai junto com o processo
+        _log_listener = None
+
+_logging_configured = False
+
+def configure_logging():
+    """Handlers do processo - uma vez só, por mais apps que create_app monte"""
+    global _log_listener, _logging_configured
+    if _logging_configured:
+        return
+    _logging_configured = True
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else logging.Formatter(LOG_TEXT_FORMAT))
+    if LOG_MODE == 'queue':
+        handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        _log_listener = logging.handlers.QueueListener(handler.queue, stream_handler)
+        _log_listener.start()
+        atexit.register(stop_log_listener)
+    else:
+        handler = stream_handler
+    # Amostragem antes da fila: registro descartado não custa nem o enqueue
+    handler.addFilter(SamplingFilter(LOG_SAMPLE_RATES))
+    logging.basicConfig(level=LOG_LEVEL, handlers=[handler])
+
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-app.secret_key = os.environ.get('SECRET_KEY', 'change-me-in-production-12345')
+SECRET_KEY = os.environ.get('SECRET_KEY', 'change-me-in-production-12345')
 DB_PATH = os.environ.get('DB_PATH', 'leads.db')
 
-# Garantir que o diretório do DB existe
-db_dir = os.path.dirname(DB_PATH)
-if db_dir and not os.path.exists(db_dir):
-    os.makedirs(db_dir, exist_ok=True)
+# Rotas e comandos num blueprint: create_app(config) monta quantas apps precisar (testes,
+# workers) e o import do módulo não faz I/O. cli_group=None: flask --app app init-db
+bp = Blueprint('leads', __name__, cli_group=None)
+
+def get_db_path():
+    """DB da app atual (create_app({'DB_PATH': ...})) ou, fora de uma app, o DB_PATH do processo"""
+    if has_app_context():
+        return current_app.config.get('DB_PATH') or DB_PATH
+    return DB_PATH
+
+# Métricas Prometheus (GET /metrics). Cada processo acumula em memória sob um lock.
+# Com METRICS_DIR (gunicorn.conf.py liga) cada worker grava um snapshot JSON a cada
+# METRICS_FLUSH_INTERVAL e o /metrics soma os snapshots de todos os workers.
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '5'))
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRIC_HELP = {
+    'http_requests_total': ('counter', 'HTTP requests by route, method and status'),
+    'http_request_duration_seconds': ('histogram', 'Handler latency by route (streams: until the first byte)'),
+    'http_request_db_seconds': ('histogram', 'Time spent in SQLite execute/commit per request'),
+    'db_lock_retries_total': ('counter', 'Writes retried after "database is locked"'),
+    'db_pool_exhausted_total': ('counter', 'Connection acquisitions that timed out on a full pool'),
+    'db_connection_open_seconds': ('histogram', 'Time to open and configure a new SQLite connection'),
+    'db_pool_wait_seconds': ('histogram', 'Time waiting for a pooled connection when the pool is full'),
+    'lead_ingest_queue_depth': ('gauge', 'Leads waiting for the batch writer thread'),
+    'log_records_dropped_total': ('counter', 'Log records dropped because the log queue was full'),
+    'lead_duplicates_total': ('counter', 'Repeated lead submissions answered without an INSERT, by source'),
+    'read_snapshot_refresh_seconds': ('histogram', 'Time to copy the DB into a new in-memory read snapshot'),
+    'read_snapshot_fallbacks_total': ('counter', 'Admin reads served from the DB because the snapshot was missing or too old'),
+    'backups_total': ('counter', 'Online backups by status'),
+    'backup_duration_seconds': ('histogram', 'Wall time of an online backup, compression and rotation included'),
+    'backup_lock_held_seconds': ('histogram', 'Time the backup held the source DB per step (the longest a writer could wait)'),
+    'backup_restarts_total': ('counter', 'Backup copies restarted because another connection wrote to the DB'),
+    'backup_restore_seconds': ('histogram', 'Time to restore the DB from a backup'),
+}
+
+def metric_key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+class Metrics:
+    """Contadores e histogramas do processo: dicts simples, um lock, nada de I/O no request"""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # um snapshot no disco por vez, sempre mais novo
+        self.archived = False  # snapshot final já somado no archive.json
+        self._counters = {}    # (nome, labels) -> valor
+        self._histograms = {}  # (nome, labels) -> [contagens por bucket (+Inf no fim), soma]
+
+    def inc(self, name, amount=1, **labels):
+        key = metric_key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = metric_key(name, labels)
+        index = bisect.bisect_left(LATENCY_BUCKETS, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0]
+            histogram[0][index] += 1
+            histogram[1] += value
+
+    def snapshot(self):
+        """Estado serializável em JSON (labels viram listas de pares)"""
+        with self._lock:
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, labels, list(counts), total]
+                               for (name, labels), (counts, total) in self._histograms.items()],
+            }
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+def get_metrics():
+    """Métricas do processo atual (um registro por pid, como o pool)"""
+    global _metrics
+    metrics = _metrics
+    if metrics is not None and metrics.pid == os.getpid():
+        return metrics
+    with _metrics_lock:
+        if _metrics is None or _metrics.pid != os.getpid():
+            _metrics = Metrics()
+            if METRICS_DIR:
+                threading.Thread(target=flush_metrics_loop, args=(_metrics,), daemon=True,
+                                 name='metrics-flush').start()
+        return _metrics
+
+def metrics_path(pid):
+    return os.path.join(METRICS_DIR, f'{pid}.json')
+
+@contextmanager
+def metrics_dir_lock(mode):
+    """flock no diretório de métricas: leitura compartilhada, arquivamento exclusivo"""
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    with open(os.path.join(METRICS_DIR, '.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, mode)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def write_json_atomic(path, data):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def write_metrics_snapshot(metrics, final=False):
+    """Grava o snapshot do worker. final=True (shutdown): soma contadores e histogramas
+    no archive.json dos workers encerrados e apaga o arquivo do pid."""
+    if not METRICS_DIR:
+        return
+    # Flush periódico e scrape gravam o mesmo arquivo: snapshot e replace sob o mesmo lock,
+    # senão um snapshot mais velho pode sobrescrever um mais novo (contador voltando)
+    with metrics._write_lock:
+        if metrics.archived:
+            return
+        if not final:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            write_json_atomic(metrics_path(metrics.pid),
+                              dict(metrics.snapshot(), pid=metrics.pid, gauges=metrics_gauges()))
+            return
+        archive_metrics_snapshot(metrics)
+        metrics.archived = True
+
+def archive_metrics_snapshot(metrics):
+    snapshot = dict(metrics.snapshot(), pid=metrics.pid, gauges=metrics_gauges())
+    archive_path = os.path.join(METRICS_DIR, 'archive.json')
+    with metrics_dir_lock(fcntl.LOCK_EX):
+        archive = read_metrics_file(archive_path) or {}
+        merged = merge_metric_snapshots([archive, snapshot])
+        write_json_atomic(archive_path, {
+            'counters': [[name, labels, value] for (name, labels), value in merged['counters'].items()],
+            'histograms': [[name, labels, counts, total]
+                           for (name, labels), (counts, total) in merged['histograms'].items()],
+        })
+        if os.path.exists(metrics_path(metrics.pid)):
+            os.remove(metrics_path(metrics.pid))
+
+def flush_metrics_loop(metrics):
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        if metrics.pid != os.getpid():
+            return
+        try:
+            write_metrics_snapshot(metrics)
+        except OSError as e:
+            logger.warning(f'Failed to write metrics snapshot: {e}')
+
+def flush_metrics():
+    """Snapshot final do processo (shutdown do worker)"""
+    metrics = _metrics
+    if metrics is not None and metrics.pid == os.getpid():
+        write_metrics_snapshot(metrics, final=True)
+
+def read_metrics_file(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def merge_metric_snapshots(snapshots):
+    """Soma snapshots (contadores, histogramas e gauges) por (nome, labels)"""
+    counters = {}
+    histograms = {}
+    gauges = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot.get('counters', ()):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, counts, total in snapshot.get('histograms', ()):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            if key in histograms:
+                merged_counts, merged_total = histograms[key]
+                histograms[key] = ([a + b for a, b in zip(merged_counts, counts)], merged_total + total)
+            else:
+                histograms[key] = (list(counts), total)
+        for name, value in snapshot.get('gauges', {}).items():
+            gauges[name] = gauges.get(name, 0) + value
+    return {'counters': counters, 'histograms': histograms, 'gauges': gauges}
+
+# Tempo de DB da thread atual: a conexão soma aqui, o after_request lê e zera
+_db_time = threading.local()
+
+class TimedConnection(sqlite3.Connection):
+    """Conexão que cronometra execute/executemany/commit (dois perf_counter por chamada)"""
+
+    def execute(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            _db_time.seconds = getattr(_db_time, 'seconds', 0.0) + time.perf_counter() - started
+
+    def executemany(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            _db_time.seconds = getattr(_db_time, 'seconds', 0.0) + time.perf_counter() - started
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            _db_time.seconds = getattr(_db_time, 'seconds', 0.0) + time.perf_counter() - started
 
 # SQLite thread-safe mode (Grug teme concorrência, mas precisa funcionar)
 # timeout=20.0 permite retry automático em caso de lock
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH, timeout=20.0)
+# WAL: leitores não bloqueiam o escritor (e vice-versa), inclusive entre processos
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '8'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+DB_STATEMENT_CACHE = int(os.environ.get('DB_STATEMENT_CACHE', '128'))
+
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',    # Seguro com WAL, sem fsync em todo commit
+    'PRAGMA cache_size=-16000',     # ~16 MB de page cache por conexão
+    'PRAGMA mmap_size=134217728',   # 128 MB via mmap
+    'PRAGMA temp_store=MEMORY',
+)
+
+def get_db_connection(path=None):
+    """Abre uma conexão nova já configurada (WAL, pragmas, cache de statements)"""
+    started = time.perf_counter()
+    # uri=True: o snapshot de leitura é um 'file:/...?vfs=memdb'; caminho comum segue igual
+    conn = sqlite3.connect(path or get_db_path(), timeout=20.0, check_same_thread=False, uri=True,
+                           cached_statements=DB_STATEMENT_CACHE, factory=TimedConnection)
     conn.row_factory = sqlite3.Row
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    get_metrics().observe('db_connection_open_seconds', time.perf_counter() - started)
     return conn
 
-# Inicializar DB se não existir
+class ConnectionPool:
+    """Pool limitado de conexões SQLite - cada conexão é usada por uma thread de cada vez"""
+
+    def __init__(self, path, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+        if can_create:
+            try:
+                return get_db_connection(self.path)
+            except Exception:
+                self._discard()
+                raise
+
+        # Pool cheio: esperar alguém devolver uma conexão
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            get_metrics().inc('db_pool_exhausted_total')
+            raise sqlite3.OperationalError('connection pool exhausted')
+        get_metrics().observe('db_pool_wait_seconds', time.perf_counter() - started)
+        return conn
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            self._discard()
+            return
+        if self._closed:
+            conn.close()
+            self._discard()
+            return
+        self._idle.put(conn)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            self._discard()
+
+    def _discard(self):
+        with self._lock:
+            self._created -= 1
+
+_pools = {}  # caminho do DB -> pool (uma entrada por app/DB em uso)
+_pool_lock = threading.Lock()
+
+def get_db_pool(path=None):
+    """Pool do processo atual para o DB - recriado após fork"""
+    path = path or get_db_path()
+    pool = _pools.get(path)
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+    with _pool_lock:
+        pool = _pools.get(path)
+        if pool is None or pool.pid != os.getpid():
+            # Conexões herdadas via fork não podem ser usadas (nem fechadas) no filho
+            pool = _pools[path] = ConnectionPool(path, DB_POOL_SIZE, DB_POOL_TIMEOUT)
+        return pool
+
+def close_db_pool():
+    """Fecha todas as conexões ociosas dos pools (shutdown, testes)"""
+    with _pool_lock:
+        for pool in _pools.values():
+            if pool.pid == os.getpid():
+                pool.close()
+        _pools.clear()
+
+@contextmanager
+def db_connection(path=None):
+    """Empresta uma conexão do pool; transação pendente é desfeita na devolução"""
+    pool = get_db_pool(path)
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+# Snapshot de leitura (opcional, READ_SNAPSHOT_INTERVAL > 0): lista, KPIs, busca e export do
+# admin leem uma cópia em memória do DB (VACUUM INTO para o VFS memdb) em vez do arquivo que o
+# create_lead escreve. A cada intervalo uma thread confere PRAGMA data_version e só copia de
+# novo se alguém escreveu. A idade do snapshot sai no header X-Snapshot-Age; snapshot velho
+# demais (refresh falhando) ou ainda não pronto = leitura direto no DB, como antes.
+# Cópia inteira por processo: só para DBs que cabem com folga na RAM de cada worker.
+READ_SNAPSHOT_INTERVAL = float(os.environ.get('READ_SNAPSHOT_INTERVAL', '0'))  # segundos; 0 = desligado
+READ_SNAPSHOT_MAX_AGE = float(os.environ.get('READ_SNAPSHOT_MAX_AGE', '30'))
+READ_SNAPSHOT_POOL_SIZE = int(os.environ.get('READ_SNAPSHOT_POOL_SIZE', '4'))
+
+class SnapshotGeneration:
+    """Uma cópia em memória. O memdb some quando a última conexão fecha, então o keeper
+    segura a cópia até ela ser substituída e o último leitor devolver a conexão."""
+
+    def __init__(self, uri, verified_at):
+        self.uri = uri
+        self.keeper = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self.pool = ConnectionPool(uri, READ_SNAPSHOT_POOL_SIZE, DB_POOL_TIMEOUT)
+        self.verified_at = verified_at  # último instante em que a cópia era igual ao DB
+        self.users = 0
+        self.retired = False
+
+    def close(self):
+        self.pool.close()
+        self.keeper.close()
+
+class ReadSnapshot:
+    """Snapshot em memória de um DB, renovado por uma thread do processo"""
+
+    def __init__(self, path, interval=READ_SNAPSHOT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.pid = os.getpid()
+        self._current = None
+        self._generation = 0
+        self._data_version = None
+        self._source = None  # conexão só do refresh: data_version muda quando OUTRA escreve
+        self._refresh_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='read-snapshot', daemon=True)
+        self._thread.start()
+
+    def refresh(self):
+        """Copia o DB se ele mudou desde a última cópia. Retorna True se trocou a cópia."""
+        with self._refresh_lock:
+            return self._refresh()
+
+    def _refresh(self):
+        if self._source is None:
+            self._source = sqlite3.connect(self.path, timeout=20.0, check_same_thread=False, uri=True)
+        # data_version e o instante antes da cópia: escrita durante o backup muda a versão
+        # e entra no próximo refresh; a idade nunca parece menor do que é
+        checked_at = time.monotonic()
+        version = self._source.execute('PRAGMA data_version').fetchone()[0]
+        if self._current is not None and version == self._data_version:
+            self._current.verified_at = checked_at
+            return False
+
+        started = time.perf_counter()
+        self._generation += 1
+        generation = SnapshotGeneration(
+            f'file:/leads-snapshot-{self.pid}-{id(self)}-{self._generation}?vfs=memdb', checked_at)
+        try:
+            # VACUUM INTO e não backup(): o backup copia o cabeçalho WAL da origem e o
+            # memdb não abre DB em WAL ("unable to open database file")
+            self._source.execute(f"VACUUM INTO '{generation.uri}'")
+        except Exception:
+            generation.close()
+            raise
+        with self._lock:
+            old, self._current = self._current, generation
+            self._data_version = version
+            close_old = old is not None and old.users == 0
+            if old is not None:
+                old.retired = True
+        if close_old:
+            old.close()
+        get_metrics().observe('read_snapshot_refresh_seconds', time.perf_counter() - started)
+        return True
+
+    def age(self):
+        """Idade da cópia que borrow() entregaria agora (None = leitura iria direto no DB)"""
+        generation = self._current
+        age = None if generation is None else time.monotonic() - generation.verified_at
+        return age if age is not None and age <= READ_SNAPSHOT_MAX_AGE else None
+
+    def wake(self):
+        """Pede um refresh agora (escrita do próprio admin: delete, import)"""
+        self._wake.set()
+
+    @contextmanager
+    def borrow(self):
+        """(conexão da cópia atual, idade em segundos), ou (None, None) sem cópia fresca"""
+        with self._lock:
+            generation = self._current
+            age = None if generation is None else time.monotonic() - generation.verified_at
+            if age is None or age > READ_SNAPSHOT_MAX_AGE:
+                generation = None
+            else:
+                generation.users += 1
+        if generation is None:
+            yield None, None
+            return
+        try:
+            conn = generation.pool.acquire()
+            try:
+                yield conn, age
+            finally:
+                generation.pool.release(conn)
+        finally:
+            with self._lock:
+                generation.users -= 1
+                close = generation.retired and generation.users == 0
+            if close:
+                generation.close()
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+        self._thread.join(5)
+        with self._refresh_lock, self._lock:
+            current, self._current = self._current, None
+            if current is not None:
+                current.retired = True
+                if current.users == 0:
+                    current.close()
+            if self._source is not None:
+                self._source.close()
+                self._source = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f'Read snapshot refresh failed for {self.path}: {e}')
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+_read_snapshots = {}  # caminho do DB -> snapshot
+_read_snapshot_lock = threading.Lock()
+
+def get_read_snapshot():
+    """Snapshot do DB atual neste processo (None se desligado). A thread nasce no primeiro uso."""
+    if READ_SNAPSHOT_INTERVAL <= 0:
+        return None
+    path = get_db_path()
+    snapshot = _read_snapshots.get(path)
+    if snapshot is not None and snapshot.pid == os.getpid():
+        return snapshot
+    with _read_snapshot_lock:
+        snapshot = _read_snapshots.get(path)
+        if snapshot is None or snapshot.pid != os.getpid():
+            snapshot = _read_snapshots[path] = ReadSnapshot(path, READ_SNAPSHOT_INTERVAL)
+        return snapshot
+
+def stop_read_snapshots():
+    with _read_snapshot_lock:
+        for snapshot in _read_snapshots.values():
+            if snapshot.pid == os.getpid():
+                snapshot.stop()
+        _read_snapshots.clear()
+
+def wake_read_snapshot():
+    """Escrita do admin neste processo: refresh sem esperar o intervalo (não cria snapshot)"""
+    snapshot = _read_snapshots.get(get_db_path())
+    if snapshot is not None and snapshot.pid == os.getpid():
+        snapshot.wake()
+
+@contextmanager
+def read_connection():
+    """Conexão para as leituras do admin: snapshot em memória se ligado e fresco, senão o DB.
+    Dentro de um request a idade do snapshot vai para g (header X-Snapshot-Age)."""
+    snapshot = get_read_snapshot()
+    if snapshot is not None:
+        with snapshot.borrow() as (conn, age):
+            if conn is not None:
+                if has_app_context():
+                    g.snapshot_age = age
+                yield conn
+                return
+        get_metrics().inc('read_snapshot_fallbacks_total')
+    with db_connection() as conn:
+        yield conn
+
+# Migrações versionadas (PRAGMA user_version)
+# Grug só adiciona no fim da lista. Nunca edita migração que já rodou em produção.
+def add_column(conn, table, column, declaration):
+    """ALTER TABLE ADD COLUMN idempotente (SQLite não tem IF NOT EXISTS para coluna)"""
+    existing = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+    if column not in existing:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {declaration}')
+
+# Orçamento -> centavos. O <select> do site manda valores fixos ('10k-50k', 'custom'), que
+# valem o piso da faixa. Texto livre usa o primeiro número: com sufixo k/mil a vírgula ou o
+# ponto é decimal ('1,5k'); sem sufixo ponto é milhar e a primeira vírgula é decimal
+# ('R$ 5.000,50'). Faixa '2 a 3 mil' herda o sufixo do fim e vale o piso.
+BUDGET_OPTIONS = {
+    '10k-50k': 1000000,
+    'custom': 5000000,
+}
+BUDGET_NUMBER_RE = re.compile(r'\d+(?:\.\d*)?|\.\d+')
+BUDGET_TOKEN_RE = re.compile(
+    r'(\d[\d.,]*)\s*(k|mil)?(?![a-z])(?:\s*(?:-|–|a|até)\s*\d[\d.,]*\s*(k|mil)(?![a-z]))?',
+    re.IGNORECASE)
+
+def parse_budget_cents(budget):
+    """'R$ 5.000,50' -> 500050, '10k-50k' -> 1000000. Sem número reconhecível -> 0."""
+    if not budget:
+        return 0
+    option = BUDGET_OPTIONS.get(budget.strip().lower())
+    if option is not None:
+        return option
+    token = BUDGET_TOKEN_RE.search(budget)
+    if not token:
+        return 0
+    number, suffix = token.group(1), token.group(2) or token.group(3)
+    if suffix:
+        number = number.replace(',', '.')
+    else:
+        number = number.replace('.', '').replace(',', '.', 1)
+    match = BUDGET_NUMBER_RE.match(number)
+    if not match:
+        return 0
+    value = Decimal(match.group()) * (1000 if suffix else 1)
+    return int((value * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+def bump_counters(conn, **deltas):
+    """Soma deltas nos contadores dentro da transação atual"""
+    conn.executemany('UPDATE counters SET value = value + ? WHERE name = ?',
+                     [(delta, name) for name, delta in deltas.items() if delta])
+
+# Lead arquivado (retenção) continua nas rollups (a série temporal é histórico): o reparo
+# delas soma o arquivo junto, via a tabela TEMP archived_src. Os KPIs contam só leads.
+def load_archived_leads(conn):
+    """Copia os leads do arquivo para temp.archived_src (orçamento reparseado com a regra
+    atual). Quem ainda está em leads (rodada de arquivamento interrompida) fica de fora."""
+    conn.execute('DROP TABLE IF EXISTS temp.archived_src')
+    conn.execute('''
+        CREATE TEMP TABLE archived_src (
+            id INTEGER PRIMARY KEY, form_type TEXT, created_at TIMESTAMP, budget_cents INTEGER
+        )
+    ''')
+    path = get_archive_db_path()
+    if not os.path.exists(path):
+        return
+    archive = sqlite3.connect(f'file:{path}?mode=ro', uri=True, timeout=20.0)
+    try:
+        if not archive.execute("SELECT 1 FROM sqlite_master WHERE name = 'archived_leads'").fetchone():
+            return
+        cursor = archive.execute('SELECT id, form_type, created_at, budget FROM archived_leads')
+        while rows := cursor.fetchmany(1000):
+            conn.executemany('INSERT OR IGNORE INTO temp.archived_src VALUES (?, ?, ?, ?)', [
+                (lead_id, form_type, created_at, parse_budget_cents(budget))
+                for lead_id, form_type, created_at, budget in rows
+            ])
+    finally:
+        archive.close()
+    conn.execute('DELETE FROM temp.archived_src WHERE id IN (SELECT id FROM main.leads)')
+
+def backfill_lead_counters(conn):
+    """Recalcula contagem e valor total a partir das linhas (migração e reparo)"""
+    count = 0
+    cents = 0
+    for (budget,) in conn.execute('SELECT budget FROM leads'):
+        count += 1
+        cents += parse_budget_cents(budget)
+    conn.executemany('INSERT OR REPLACE INTO counters (name, value) VALUES (?, ?)',
+                     [('lead_count', count), ('budget_cents', cents)])
+
+# Rollups da série temporal: leads e valor por (bucket, form_type), mantidos por triggers no
+# mesmo commit do INSERT/DELETE. O gráfico lê um bucket por linha em vez de varrer leads.
+# (tabela, bucket em SQL a partir de created_at, mesmo bucket em strftime, passo)
+LEAD_ROLLUPS = {
+    'hour': ('lead_rollup_hourly', "strftime('%Y-%m-%d %H:00:00', {})", '%Y-%m-%d %H:00:00', timedelta(hours=1)),
+    'day': ('lead_rollup_daily', 'date({})', '%Y-%m-%d', timedelta(days=1)),
+}
+
+def rollup_add_sql(table, bucket_sql, row, sign):
+    """Soma (sign=1) ou desconta (sign=-1) a linha NEW/OLD no bucket dela"""
+    bucket = bucket_sql.format(f'{row}.created_at')
+    form_type = f"COALESCE({row}.form_type, '')"
+    if sign > 0:
+        # SELECT ... WHERE: created_at inválido (bucket NULL) fica fora da rollup
+        return f'''
+            INSERT INTO {table} (bucket, form_type, lead_count, budget_cents)
+            SELECT {bucket}, {form_type}, 1, {row}.budget_cents WHERE {bucket} IS NOT NULL
+            ON CONFLICT (bucket, form_type) DO UPDATE SET
+                lead_count = lead_count + 1, budget_cents = budget_cents + excluded.budget_cents;'''
+    return f'''
+            UPDATE {table} SET lead_count = lead_count - 1, budget_cents = budget_cents - {row}.budget_cents
+            WHERE bucket = {bucket} AND form_type = {form_type};
+            DELETE FROM {table} WHERE bucket = {bucket} AND form_type = {form_type} AND lead_count <= 0;'''
+
+def create_lead_rollups(conn):
+    """Tabelas e triggers das rollups (migração 10)"""
+    for name, (table, bucket_sql, _, _) in LEAD_ROLLUPS.items():
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                bucket TEXT NOT NULL,
+                form_type TEXT NOT NULL,
+                lead_count INTEGER NOT NULL DEFAULT 0,
+                budget_cents INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (bucket, form_type)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_leads_rollup_{name}_insert AFTER INSERT ON leads BEGIN
+            {rollup_add_sql(table, bucket_sql, 'NEW', 1)}
+        END''')
+        conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_leads_rollup_{name}_delete AFTER DELETE ON leads BEGIN
+            {rollup_add_sql(table, bucket_sql, 'OLD', -1)}
+        END''')
+        conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_leads_rollup_{name}_update
+            AFTER UPDATE OF created_at, form_type, budget_cents ON leads BEGIN
+            {rollup_add_sql(table, bucket_sql, 'OLD', -1)}
+            {rollup_add_sql(table, bucket_sql, 'NEW', 1)}
+        END''')
+
+def add_lead_rollups(conn, where_sql='1', params=(), source='leads'):
+    """Soma nas rollups as linhas de source que passam no filtro, agregadas num INSERT só"""
+    for table, bucket_sql, _, _ in LEAD_ROLLUPS.values():
+        bucket = bucket_sql.format('created_at')
+        conn.execute(f'''
+            INSERT INTO {table} (bucket, form_type, lead_count, budget_cents)
+            SELECT {bucket}, COALESCE(form_type, ''), COUNT(*), SUM(budget_cents)
+            FROM {source} WHERE {where_sql} AND {bucket} IS NOT NULL
+            GROUP BY 1, 2
+            ON CONFLICT (bucket, form_type) DO UPDATE SET
+                lead_count = lead_count + excluded.lead_count,
+                budget_cents = budget_cents + excluded.budget_cents
+        ''', params)
+
+def rebuild_lead_rollups(conn):
+    """Recalcula as rollups a partir das linhas e do arquivo (migração e reparo)"""
+    for table, _, _, _ in LEAD_ROLLUPS.values():
+        conn.execute(f'DELETE FROM {table}')
+    add_lead_rollups(conn)
+    load_archived_leads(conn)
+    add_lead_rollups(conn, source='temp.archived_src')
+    conn.execute('DROP TABLE temp.archived_src')
+
+# Importação em massa: o trabalho dos triggers de INSERT (FTS, rollups, contador de mudanças,
+# evento do SSE) linha a linha custa ~3x o INSERT. bulk_insert_leads desliga esses triggers com uma linha em
+# trigger_bypass e refaz tudo com um INSERT ... SELECT por lote. A linha é gravada e apagada
+# dentro da transação do lote: nenhuma outra conexão chega a vê-la.
+BULK_INSERT_WHEN = "WHEN NOT EXISTS (SELECT 1 FROM trigger_bypass WHERE mode = 'bulk_insert')"
+
+def defer_bulk_insert_triggers(conn):
+    """Triggers de INSERT com o WHEN de BULK_INSERT_WHEN (migração 11)"""
+    conn.execute('CREATE TABLE IF NOT EXISTS trigger_bypass (mode TEXT PRIMARY KEY)')
+    for name in ('changes', 'fts', *(f'rollup_{bucket}' for bucket in LEAD_ROLLUPS)):
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_leads_{name}_insert')
+    conn.execute(f'''CREATE TRIGGER trg_leads_changes_insert AFTER INSERT ON leads {BULK_INSERT_WHEN} BEGIN
+        UPDATE counters SET value = value + 1 WHERE name = 'lead_changes';
+    END''')
+    conn.execute(f'''CREATE TRIGGER trg_leads_fts_insert AFTER INSERT ON leads {BULK_INSERT_WHEN} BEGIN
+        INSERT INTO leads_fts (rowid, name, email, contact, message)
+        VALUES (NEW.id, NEW.name, NEW.email, NEW.contact, NEW.message);
+    END''')
+    for bucket, (table, bucket_sql, _, _) in LEAD_ROLLUPS.items():
+        conn.execute(f'''CREATE TRIGGER trg_leads_rollup_{bucket}_insert AFTER INSERT ON leads {BULK_INSERT_WHEN} BEGIN
+            {rollup_add_sql(table, bucket_sql, 'NEW', 1)}
+        END''')
+
+def defer_bulk_insert_events(conn):
+    """Evento 'created' e poda de lead_events com BULK_INSERT_WHEN (migração 16): lote importado
+    vira um evento 'bulk_import' só, gravado por bulk_insert_leads"""
+    conn.execute('DROP TRIGGER IF EXISTS trg_leads_event_insert')
+    conn.execute('DROP TRIGGER IF EXISTS trg_lead_events_prune')
+    conn.execute(f'''CREATE TRIGGER trg_leads_event_insert AFTER INSERT ON leads {BULK_INSERT_WHEN} BEGIN
+        INSERT INTO lead_events (type, lead_id) VALUES ('created', NEW.id);
+    END''')
+    conn.execute(f'''CREATE TRIGGER trg_lead_events_prune AFTER INSERT ON lead_events {BULK_INSERT_WHEN} BEGIN
+        DELETE FROM lead_events WHERE id <= NEW.id - 10000;
+    END''')
+
+# Arquivamento (retenção) não é exclusão: com a linha 'archive' em trigger_bypass o DELETE
+# do lote não desconta as rollups nem vira evento 'deleted' no SSE. FTS e o contador de
+# mudanças (ETag da lista) continuam: o lead sai mesmo da lista.
+ARCHIVE_DELETE_WHEN = "WHEN NOT EXISTS (SELECT 1 FROM trigger_bypass WHERE mode = 'archive')"
+
+def skip_archive_delete_triggers(conn):
+    """Triggers de DELETE das rollups e do log de eventos com ARCHIVE_DELETE_WHEN (migração 14)"""
+    for name in ('event', *(f'rollup_{bucket}' for bucket in LEAD_ROLLUPS)):
+        conn.execute(f'DROP TRIGGER IF EXISTS trg_leads_{name}_delete')
+    conn.execute(f'''CREATE TRIGGER trg_leads_event_delete AFTER DELETE ON leads {ARCHIVE_DELETE_WHEN} BEGIN
+        INSERT INTO lead_events (type, lead_id) VALUES ('deleted', OLD.id);
+    END''')
+    for bucket, (table, bucket_sql, _, _) in LEAD_ROLLUPS.items():
+        conn.execute(f'''CREATE TRIGGER trg_leads_rollup_{bucket}_delete AFTER DELETE ON leads {ARCHIVE_DELETE_WHEN} BEGIN
+            {rollup_add_sql(table, bucket_sql, 'OLD', -1)}
+        END''')
+
+# Telefone normalizado: tira a formatação e pega 10-15 dígitos (como o regex do dashboard)
+PHONE_RE = re.compile(r'\d{10,15}')
+PHONE_FORMATTING_RE = re.compile(r'[\s().+\-]')
+
+def normalize_phone(*values):
+    """'+55 (11) 99999-9999' -> '5511999999999'. Primeiro valor com telefone ganha."""
+    for value in values:
+        if not value:
+            continue
+        match = PHONE_RE.search(PHONE_FORMATTING_RE.sub('', value))
+        if match:
+            return match.group()
+    return None
+
+def backfill_budget_and_phone(conn, batch_size=1000):
+    """Preenche budget_cents e phone das linhas antigas, em lotes por id"""
+    last_id = 0
+    while True:
+        rows = conn.execute('''
+            SELECT id, budget, contact, email FROM leads WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        # Só reescreve o que mudou: rodar de novo (regra nova de orçamento) não toca o resto
+        conn.executemany('''
+            UPDATE leads SET budget_cents = ?1, phone = ?2
+            WHERE id = ?3 AND (budget_cents IS NOT ?1 OR phone IS NOT ?2)
+        ''', [
+            (parse_budget_cents(budget), normalize_phone(contact, email), lead_id)
+            for lead_id, budget, contact, email in rows
+        ])
+        last_id = rows[-1][0]
+
+MIGRATIONS = [
+    # (versão, descrição, passos: SQL ou função que recebe a conexão)
+    (1, 'index leads by (created_at, id) for the admin list', [
+        '''CREATE INDEX IF NOT EXISTS idx_leads_created_at_id
+           ON leads (created_at DESC, id DESC)''',
+    ]),
+    (2, 'index leads by form_type for filtered lists', [
+        '''CREATE INDEX IF NOT EXISTS idx_leads_form_type_created_at
+           ON leads (form_type, created_at DESC, id DESC)''',
+    ]),
+    (3, 'covering index for KPI queries over recent leads', [
+        '''CREATE INDEX IF NOT EXISTS idx_leads_created_at_budget
+           ON leads (created_at, budget)''',
+    ]),
+    (4, 'change counter maintained by triggers (list ETag)', [
+        '''CREATE TABLE IF NOT EXISTS counters (
+               name TEXT PRIMARY KEY,
+               value INTEGER NOT NULL DEFAULT 0
+           )''',
+        "INSERT OR IGNORE INTO counters (name, value) VALUES ('lead_changes', 0)",
+        '''CREATE TRIGGER IF NOT EXISTS trg_leads_changes_insert AFTER INSERT ON leads BEGIN
+               UPDATE counters SET value = value + 1 WHERE name = 'lead_changes';
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_leads_changes_update AFTER UPDATE ON leads BEGIN
+               UPDATE counters SET value = value + 1 WHERE name = 'lead_changes';
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_leads_changes_delete AFTER DELETE ON leads BEGIN
+               UPDATE counters SET value = value + 1 WHERE name = 'lead_changes';
+           END''',
+    ]),
+    (5, 'lead count and pipeline value counters for KPIs', [
+        backfill_lead_counters,
+    ]),
+    (6, 'precomputed budget_cents and phone columns with filter indexes', [
+        lambda conn: add_column(conn, 'leads', 'budget_cents', 'INTEGER NOT NULL DEFAULT 0'),
+        lambda conn: add_column(conn, 'leads', 'phone', 'TEXT'),
+        backfill_budget_and_phone,
+        'DROP INDEX IF EXISTS idx_leads_created_at_budget',
+        '''CREATE INDEX IF NOT EXISTS idx_leads_created_at_budget_cents
+           ON leads (created_at, budget_cents)''',
+        '''CREATE INDEX IF NOT EXISTS idx_leads_phone_created_at
+           ON leads (created_at DESC, id DESC) WHERE phone IS NOT NULL''',
+        '''CREATE INDEX IF NOT EXISTS idx_leads_budget_cents
+           ON leads (budget_cents)''',
+    ]),
+    (7, 'lead event log for the SSE stream (written by triggers, pruned to the last 10k)', [
+        '''CREATE TABLE IF NOT EXISTS lead_events (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               type TEXT NOT NULL,
+               lead_id INTEGER NOT NULL,
+               created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+           )''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_leads_event_insert AFTER INSERT ON leads BEGIN
+               INSERT INTO lead_events (type, lead_id) VALUES ('created', NEW.id);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_leads_event_delete AFTER DELETE ON leads BEGIN
+               INSERT INTO lead_events (type, lead_id) VALUES ('deleted', OLD.id);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_lead_events_prune AFTER INSERT ON lead_events BEGIN
+               DELETE FROM lead_events WHERE id <= NEW.id - 10000;
+           END''',
+    ]),
+    (8, 'full-text index over name, email, contact and message (accent-insensitive)', [
+        # External content: o texto fica só em leads, o FTS guarda o índice invertido.
+        # remove_diacritics 2: "joao" acha "João"; prefix '2 3' acelera buscas por prefixo curto.
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS leads_fts USING fts5(
+               name, email, contact, message,
+               content='leads', content_rowid='id',
+               tokenize='unicode61 remove_diacritics 2',
+               prefix='2 3'
+           )''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_leads_fts_insert AFTER INSERT ON leads BEGIN
+               INSERT INTO leads_fts (rowid, name, email, contact, message)
+               VALUES (NEW.id, NEW.name, NEW.email, NEW.contact, NEW.message);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_leads_fts_delete AFTER DELETE ON leads BEGIN
+               INSERT INTO leads_fts (leads_fts, rowid, name, email, contact, message)
+               VALUES ('delete', OLD.id, OLD.name, OLD.email, OLD.contact, OLD.message);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_leads_fts_update AFTER UPDATE OF name, email, contact, message ON leads BEGIN
+               INSERT INTO leads_fts (leads_fts, rowid, name, email, contact, message)
+               VALUES ('delete', OLD.id, OLD.name, OLD.email, OLD.contact, OLD.message);
+               INSERT INTO leads_fts (rowid, name, email, contact, message)
+               VALUES (NEW.id, NEW.name, NEW.email, NEW.contact, NEW.message);
+           END''',
+        # Backfill das linhas que já existiam
+        "INSERT INTO leads_fts (leads_fts) VALUES ('rebuild')",
+    ]),
+    (9, 'idempotency key per lead (unique, only when set)', [
+        lambda conn: add_column(conn, 'leads', 'idempotency_key', 'TEXT'),
+        '''CREATE UNIQUE INDEX IF NOT EXISTS idx_leads_idempotency_key
+           ON leads (idempotency_key) WHERE idempotency_key IS NOT NULL''',
+    ]),
+    (10, 'hourly and daily lead rollups by form_type for the timeseries endpoint', [
+        create_lead_rollups,
+        rebuild_lead_rollups,
+    ]),
+    (11, 'insert triggers skippable inside a bulk import transaction (done per chunk instead)', [
+        defer_bulk_insert_triggers,
+    ]),
+    (12, 'reparse budgets from the site <select> values (10k-50k, custom) and refresh aggregates', [
+        backfill_budget_and_phone,
+        backfill_lead_counters,
+        rebuild_lead_rollups,
+    ]),
+    (13, 'admin password version bumped by triggers (cross-worker admin cache invalidation)', [
+        "INSERT OR IGNORE INTO counters (name, value) VALUES ('admin_password_version', 0)",
+        '''CREATE TRIGGER IF NOT EXISTS trg_admin_users_version_insert AFTER INSERT ON admin_users BEGIN
+               UPDATE counters SET value = value + 1 WHERE name = 'admin_password_version';
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_admin_users_version_update AFTER UPDATE ON admin_users BEGIN
+               UPDATE counters SET value = value + 1 WHERE name = 'admin_password_version';
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_admin_users_version_delete AFTER DELETE ON admin_users BEGIN
+               UPDATE counters SET value = value + 1 WHERE name = 'admin_password_version';
+           END''',
+    ]),
+    (14, 'archive moves keep rollups and skip SSE delete events', [
+        skip_archive_delete_triggers,
+    ]),
+    (15, 'drop the admin password version triggers (admin cache uses a short TTL instead)', [
+        'DROP TRIGGER IF EXISTS trg_admin_users_version_insert',
+        'DROP TRIGGER IF EXISTS trg_admin_users_version_update',
+        'DROP TRIGGER IF EXISTS trg_admin_users_version_delete',
+        "DELETE FROM counters WHERE name = 'admin_password_version'",
+    ]),
+    (16, 'bulk import writes one lead event per chunk instead of one per row', [
+        defer_bulk_insert_events,
+    ]),
+    (17, 'KPI counters count only leads in the main DB (archived leads left out)', [
+        backfill_lead_counters,
+    ]),
+]
+
+def get_schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def run_migrations(conn):
+    """Aplica migrações pendentes, uma transação por versão. Seguro com vários workers."""
+    applied = 0
+    for version, description, steps in MIGRATIONS:
+        if get_schema_version(conn) >= version:
+            continue
+        # BEGIN IMMEDIATE pega o lock de escrita: outro worker espera e depois pula
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if get_schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f'PRAGMA user_version = {int(version)}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied += 1
+        logger.info(f'Migration {version} applied: {description}')
+
+    if applied:
+        # Estatísticas novas para o query planner escolher os índices de leads.
+        # Só leads: ANALYZE nas tabelas internas do FTS5 (leads_fts_data) faz cada INSERT
+        # no índice ficar mais lento conforme ele cresce (quadrático numa importação).
+        conn.execute('ANALYZE leads')
+        conn.execute("DELETE FROM sqlite_stat1 WHERE tbl LIKE 'leads\\_fts\\_%' ESCAPE '\\'")
+        conn.commit()
+    return applied
+
+# Inicializar DB se não existir. Não roda no import: flask --app app init-db (deploy, cron)
+# ou o gunicorn.conf.py antes do fork dos workers; testes chamam direto.
 def init_db():
-    conn = get_db_connection()
+    path = get_db_path()
+    db_dir = os.path.dirname(path)
+    if db_dir:
+        os.makedirs(db_dir, exist_ok=True)
+    conn = get_db_connection(path)
     try:
+        # Vários workers podem subir juntos: schema base + admin padrão numa transação só
+        conn.execute('BEGIN IMMEDIATE')
         conn.execute('''
             CREATE TABLE IF NOT EXISTS leads (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -65,11 +1133,17 @@ def init_db():
                         ('admin', default_hash))
             logger.info('Admin user created (default: admin/admin123)')
         conn.commit()
+        applied = run_migrations(conn)
     finally:
         conn.close()
+    logger.info(f'Database initialized: {path} (schema version {MIGRATIONS[-1][0]})')
+    return applied
 
-init_db()
-logger.info('Database initialized')
+@bp.cli.command('init-db')
+def init_db_command():
+    """Cria o schema e aplica migrações pendentes: flask --app app init-db"""
+    applied = init_db()
+    click.echo(f'Database ready at {get_db_path()} ({applied} migrations applied)')
 
 # Decorator para rotas protegidas
 def login_required(f):
@@ -80,6 +1154,75 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# Rate limit por IP (token bucket) - barra flood antes de qualquer trabalho de DB ou hash.
+# Formato: "requests/segundos". Estado é por processo: com N workers o teto efetivo é N vezes.
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '10000'))
+RATE_LIMITS = {
+    'create_lead': os.environ.get('RATE_LIMIT_LEADS', '20/60'),
+    'login': os.environ.get('RATE_LIMIT_LOGIN', '5/60'),
+}
+
+class RateLimiter:
+    """Token bucket por chave num LRU de tamanho fixo.
+    Chave expulsa do LRU volta com o balde cheio - troca justa por memória limitada."""
+
+    def __init__(self, spec, max_keys=RATE_LIMIT_MAX_KEYS):
+        requests, seconds = (float(part) for part in spec.split('/'))
+        self.capacity = requests
+        self.refill_rate = requests / seconds
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # chave -> (tokens, último update)
+        self._lock = threading.Lock()
+
+    def hit(self, key, now=None):
+        """Consome um token. Retorna 0 se passou, senão quantos segundos esperar."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.refill_rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / self.refill_rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def __len__(self):
+        return len(self._buckets)
+
+_rate_limiters = {}
+
+def get_rate_limiter(name):
+    limiter = _rate_limiters.get(name)
+    if limiter is None:
+        limiter = _rate_limiters.setdefault(name, RateLimiter(RATE_LIMITS[name]))
+    return limiter
+
+def client_ip():
+    """IP real do cliente: nginx manda X-Real-IP (o backend não fica exposto direto)"""
+    return request.headers.get('X-Real-IP') or request.remote_addr or 'unknown'
+
+def rate_limited(name):
+    """Decorator: 429 + Retry-After quando o IP estoura o balde da rota"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if RATE_LIMIT_ENABLED:
+                ip = client_ip()
+                wait = get_rate_limiter(name).hit(ip)
+                if wait > 0:
+                    logger.warning(f'Rate limit exceeded: route={name} ip={ip}')
+                    return jsonify({'error': 'Too many requests'}), 429, {
+                        'Retry-After': str(math.ceil(wait))
+                    }
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
 # Validação básica de input (Grug-approved: simples, direto)
 def validate_lead_data(name, email, contact, message):
     """Validação básica - sem complexidade desnecessária"""
@@ -95,8 +1238,350 @@ def validate_lead_data(name, email, contact, message):
         return 'Message too long (max 2000 chars)'
     return None
 
+# Idempotência do POST /api/leads: clique duplo, rede móvel instável e retry não viram
+# lead repetido. Com o header Idempotency-Key (app.js gera um por preenchimento) a chave
+# vale para sempre; sem ele a chave é o hash de name/contact/email e vale por
+# IDEMPOTENCY_WINDOW segundos. A chave fica em leads.idempotency_key (índice único) e o
+# id do lead original num LRU por processo: repetição responde de lá, sem chegar no INSERT.
+# No LRU a chave do header também vence (IDEMPOTENCY_KEY_TTL): depois disso quem responde é
+# o índice, e um id que sumiu do DB (restore, delete) não fica preso no processo.
+IDEMPOTENCY_WINDOW = int(os.environ.get('IDEMPOTENCY_WINDOW', '600'))
+IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', '3600'))
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', '10000'))
+IDEMPOTENCY_KEY_RE = re.compile(r'[\x21-\x7e]{1,128}')
+
+def idempotency_key(header, name, contact, email, now=None):
+    """Chave gravada no lead: a do header ou hash do conteúdo + janela de tempo atual"""
+    if header:
+        return f'key:{header}'
+    normalized = '\x1f'.join(' '.join(value.lower().split()) for value in (name, contact, email))
+    digest = hashlib.sha256(normalized.encode()).hexdigest()
+    window = int((time.time() if now is None else now) // IDEMPOTENCY_WINDOW)
+    return f'hash:{digest}:{window}'
+
+def idempotency_lookup_keys(key):
+    """Chaves que contam como repetição. Hash também olha a janela anterior
+    (quem clica de novo logo depois da virada da janela ainda é o mesmo envio)."""
+    if not key.startswith('hash:'):
+        return (key,)
+    prefix, window = key.rsplit(':', 1)
+    return (key, f'{prefix}:{int(window) - 1}')
+
+def find_idempotent_lead(conn, key):
+    """Id do lead já gravado com esta chave, ou None"""
+    keys = idempotency_lookup_keys(key)
+    if len(keys) == 1:
+        row = conn.execute('SELECT id FROM leads WHERE idempotency_key = ?', keys).fetchone()
+    else:
+        row = conn.execute('''
+            SELECT id FROM leads
+            WHERE idempotency_key IN (?, ?) AND created_at >= datetime('now', ?)
+            ORDER BY id LIMIT 1
+        ''', (*keys, f'-{IDEMPOTENCY_WINDOW} seconds')).fetchone()
+    return row[0] if row else None
+
+class IdempotencyCache:
+    """LRU de chave -> (id do lead, expira_em). Só entra lead já commitado."""
+
+    def __init__(self, max_keys=IDEMPOTENCY_CACHE_SIZE):
+        self.max_keys = max_keys
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            for candidate in idempotency_lookup_keys(key):
+                entry = self._entries.get(candidate)
+                if entry is None:
+                    continue
+                lead_id, expires = entry
+                if expires <= now:
+                    del self._entries[candidate]
+                    continue
+                self._entries.move_to_end(candidate)
+                return lead_id
+            return None
+
+    def put(self, key, lead_id, now=None):
+        now = time.monotonic() if now is None else now
+        expires = now + (IDEMPOTENCY_WINDOW if key.startswith('hash:') else IDEMPOTENCY_KEY_TTL)
+        with self._lock:
+            self._entries[key] = (lead_id, expires)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+_idempotency_caches = {}  # caminho do DB -> cache (ids só valem no DB de onde vieram)
+_idempotency_caches_lock = threading.Lock()
+
+def get_idempotency_cache():
+    path = get_db_path()
+    cache = _idempotency_caches.get(path)
+    if cache is None:
+        with _idempotency_caches_lock:
+            cache = _idempotency_caches.setdefault(path, IdempotencyCache())
+    return cache
+
+def insert_lead(conn, lead):
+    """INSERT de um lead na transação atual (quem chama faz o commit).
+    Contadores dos KPIs são atualizados junto, no mesmo commit.
+    Retorna (id, criado): lead com idempotency_key já gravada devolve o id original e False."""
+    key = lead.get('idempotency_key')
+    if key:
+        existing = find_idempotent_lead(conn, key)
+        if existing is not None:
+            return existing, False
+    budget_cents = parse_budget_cents(lead['budget'])
+    # Corrida com outro worker entre o SELECT e o INSERT: o índice único segura
+    cursor = conn.execute('''
+        INSERT INTO leads (name, email, contact, message, budget, form_type, budget_cents, phone,
+                           idempotency_key)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (idempotency_key) WHERE idempotency_key IS NOT NULL DO NOTHING
+    ''', (lead['name'], lead['email'], lead['contact'], lead['message'],
+          lead['budget'], lead['form_type'], budget_cents,
+          normalize_phone(lead['contact'], lead['email']), key))
+    if cursor.rowcount == 0:
+        return find_idempotent_lead(conn, key), False
+    bump_counters(conn, lead_count=1, budget_cents=budget_cents)
+    return cursor.lastrowid, True
+
+def insert_leads(conn, leads):
+    """INSERT em lote (executemany) na transação atual, com os contadores somados uma vez.
+    created_at opcional por lead (importação de planilha antiga); sem ele vale o agora."""
+    rows = []
+    total_cents = 0
+    for lead in leads:
+        budget_cents = parse_budget_cents(lead['budget'])
+        total_cents += budget_cents
+        rows.append((lead['name'], lead['email'], lead['contact'], lead['message'],
+                     lead['budget'], lead['form_type'], budget_cents,
+                     normalize_phone(lead['contact'], lead['email']), lead.get('created_at')))
+    conn.executemany('''
+        INSERT INTO leads (name, email, contact, message, budget, form_type, budget_cents, phone, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+    ''', rows)
+    bump_counters(conn, lead_count=len(rows), budget_cents=total_cents)
+    return len(rows)
+
+def bulk_insert_leads(conn, leads):
+    """insert_leads da importação em massa: FTS, rollups, contador de mudanças e evento do
+    lote num INSERT cada, em vez de um trigger por linha. Quem chama abre a transação com
+    BEGIN IMMEDIATE - com o lock de escrita, os ids a partir de first_id são só deste lote."""
+    first_id = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM leads').fetchone()[0]
+    conn.execute("INSERT INTO trigger_bypass (mode) VALUES ('bulk_insert')")
+    try:
+        count = insert_leads(conn, leads)
+    finally:
+        conn.execute("DELETE FROM trigger_bypass WHERE mode = 'bulk_insert'")
+    conn.execute('''
+        INSERT INTO leads_fts (rowid, name, email, contact, message)
+        SELECT id, name, email, contact, message FROM leads WHERE id >= ?
+    ''', (first_id,))
+    add_lead_rollups(conn, 'id >= ?', (first_id,))
+    bump_counters(conn, lead_changes=count)
+    if count:
+        # Um evento pelo lote (o SSE manda 'reset' e o painel recarrega), não um por linha
+        conn.execute("INSERT INTO lead_events (type, lead_id) VALUES ('bulk_import', ?)", (first_id,))
+    return count
+
+def delete_leads_where(conn, where_sql, params):
+    """DELETE por predicado na transação atual descontando os contadores. Retorna quantos saíram.
+    Quem chama abre a transação com BEGIN IMMEDIATE (SELECT + DELETE atômicos)."""
+    count, cents = conn.execute(
+        f'SELECT COUNT(*), COALESCE(SUM(budget_cents), 0) FROM leads WHERE {where_sql}', params
+    ).fetchone()
+    if not count:
+        return 0
+    conn.execute(f'DELETE FROM leads WHERE {where_sql}', params)
+    bump_counters(conn, lead_count=-count, budget_cents=-cents)
+    return count
+
+def delete_leads(conn, lead_ids):
+    """DELETE por ids (mesmas regras de delete_leads_where)"""
+    placeholders = ','.join('?' * len(lead_ids))
+    return delete_leads_where(conn, f'id IN ({placeholders})', list(lead_ids))
+
+# Streams SSE deste processo acordam aqui logo depois de um commit.
+# Commits de outros workers aparecem no próximo poll de lead_events (SSE_POLL_INTERVAL).
+lead_events_changed = threading.Condition()
+
+def notify_lead_events():
+    with lead_events_changed:
+        lead_events_changed.notify_all()
+
+# Ingestão em lote (group commit): LEAD_INGEST_MODE=batch
+# Uma thread escritora drena a fila e faz um commit por lote em vez de um por request.
+# O request só espera o lote dele ser confirmado.
+LEAD_INGEST_MODE = os.environ.get('LEAD_INGEST_MODE', 'direct')
+LEAD_BATCH_SIZE = int(os.environ.get('LEAD_BATCH_SIZE', '64'))
+LEAD_BATCH_WAIT = float(os.environ.get('LEAD_BATCH_WAIT_MS', '5')) / 1000
+LEAD_QUEUE_SIZE = int(os.environ.get('LEAD_QUEUE_SIZE', '1000'))
+LEAD_ACK_TIMEOUT = float(os.environ.get('LEAD_ACK_TIMEOUT', '10'))
+
+class PendingLead:
+    """Lead na fila esperando o commit do lote"""
+    __slots__ = ('lead', 'lead_id', 'created', 'error', 'done')
+
+    def __init__(self, lead):
+        self.lead = lead
+        self.lead_id = None
+        self.created = False
+        self.error = None
+        self.done = threading.Event()
+
+class LeadWriter:
+    """Thread única que grava leads em lote - flush por tamanho ou depois de poucos ms"""
+
+    def __init__(self, batch_size=LEAD_BATCH_SIZE, batch_wait=LEAD_BATCH_WAIT,
+                 queue_size=LEAD_QUEUE_SIZE, db_path=None):
+        self.db_path = db_path or get_db_path()  # a thread não tem app: o DB é fixado na criação
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.pid = os.getpid()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='lead-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, lead, timeout=LEAD_ACK_TIMEOUT):
+        """Enfileira o lead e espera o commit. Fila cheia falha na hora (sem segurar a thread).
+        Retorna (id, criado) como insert_lead."""
+        if self._stopping.is_set():
+            raise sqlite3.OperationalError('lead writer is shutting down')
+        pending = PendingLead(lead)
+        try:
+            self._queue.put_nowait(pending)
+        except queue.Full:
+            raise sqlite3.OperationalError('ingest queue full')
+        if not pending.done.wait(timeout):
+            raise sqlite3.OperationalError('ingest acknowledgement timed out')
+        if pending.error is not None:
+            raise pending.error
+        return pending.lead_id, pending.created
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def stop(self, timeout=10.0):
+        """Para de aceitar leads e espera a fila esvaziar"""
+        self._stopping.set()
+        self._thread.join(timeout)
+        # Quem entrou na fila no instante do stop recebe erro em vez de esperar para sempre
+        while True:
+            try:
+                pending = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            pending.error = sqlite3.OperationalError('lead writer is shutting down')
+            pending.done.set()
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return
+                continue
+            batch = [first]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._commit(batch)
+
+    def _commit(self, batch):
+        # Retry fica aqui na thread escritora, não nas threads de request
+        max_retries = 5
+        for attempt in range(max_retries):
+            try:
+                with db_connection(self.db_path) as conn:
+                    results = [insert_lead(conn, pending.lead) for pending in batch]
+                    conn.commit()
+                notify_lead_events()
+                for pending, (lead_id, created) in zip(batch, results):
+                    pending.lead_id = lead_id
+                    pending.created = created
+                break
+            except sqlite3.OperationalError as e:
+                if 'database is locked' in str(e).lower() and attempt < max_retries - 1:
+                    wait_time = 0.05 * (attempt + 1)
+                    get_metrics().inc('db_lock_retries_total', path='batch')
+                    logger.warning(f'Database locked, retrying batch of {len(batch)} in {wait_time}s '
+                                   f'(attempt {attempt + 1}/{max_retries})')
+                    time.sleep(wait_time)
+                    continue
+                logger.error(f'Database operational error writing lead batch: {e}')
+                self._fail(batch, e)
+                break
+            except Exception as e:
+                logger.error(f'Unexpected error writing lead batch: {e}', exc_info=True)
+                self._fail(batch, e)
+                break
+        for pending in batch:
+            pending.done.set()
+
+    def _fail(self, batch, error):
+        for pending in batch:
+            pending.error = error
+
+_lead_writers = {}  # caminho do DB -> escritor
+_lead_writer_lock = threading.Lock()
+
+def get_lead_writer():
+    """Escritor do processo atual para o DB - threads não sobrevivem ao fork, então um por pid"""
+    path = get_db_path()
+    writer = _lead_writers.get(path)
+    if writer is not None and writer.pid == os.getpid():
+        return writer
+    with _lead_writer_lock:
+        writer = _lead_writers.get(path)
+        if writer is None or writer.pid != os.getpid():
+            writer = _lead_writers[path] = LeadWriter(LEAD_BATCH_SIZE, LEAD_BATCH_WAIT, LEAD_QUEUE_SIZE, path)
+        return writer
+
+def stop_lead_writer():
+    """Drena as filas no shutdown"""
+    with _lead_writer_lock:
+        for writer in _lead_writers.values():
+            if writer.pid == os.getpid():
+                writer.stop()
+        _lead_writers.clear()
+
+atexit.register(stop_lead_writer)
+
+def lead_created_response(lead_id, created, lead=None, source='db'):
+    """Resposta do POST /api/leads - a mesma para o envio original e para as repetições"""
+    if lead is not None:
+        get_idempotency_cache().put(lead['idempotency_key'], lead_id)
+    response = jsonify({'success': True, 'id': lead_id})
+    if created:
+        logger.info(f'Lead created: ID={lead_id}, Type={lead["form_type"]}',
+                    extra={'event': 'lead_created', 'lead_id': lead_id, 'form_type': lead['form_type']})
+    else:
+        get_metrics().inc('lead_duplicates_total', source=source)
+        logger.info(f'Duplicate lead submission: ID={lead_id}, Source={source}',
+                    extra={'event': 'lead_duplicate', 'lead_id': lead_id, 'source': source})
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response, 201
+
 # API: Receber lead do formulário
-@app.route('/api/leads', methods=['POST'])
+@bp.route('/api/leads', methods=['POST'])
+@rate_limited('create_lead')
 def create_lead():
     data = request.get_json()
     
@@ -116,95 +1601,845 @@ def create_lead():
     if validation_error:
         logger.warning(f'Create lead: Validation failed - {validation_error}')
         return jsonify({'error': validation_error}), 400
+
+    header_key = request.headers.get('Idempotency-Key')
+    if header_key is not None and not IDEMPOTENCY_KEY_RE.fullmatch(header_key):
+        logger.warning('Create lead: Invalid Idempotency-Key')
+        return jsonify({'error': 'Invalid Idempotency-Key'}), 400
+
+    lead = {'name': name, 'email': email, 'contact': contact, 'message': message,
+            'budget': budget, 'form_type': form_type,
+            'idempotency_key': idempotency_key(header_key, name, contact, email)}
+
+    # Repetição recente deste processo: nem abre conexão
+    lead_id = get_idempotency_cache().get(lead['idempotency_key'])
+    if lead_id is not None:
+        return lead_created_response(lead_id, created=False, source='cache')
+
+    if LEAD_INGEST_MODE == 'batch':
+        try:
+            lead_id, created = get_lead_writer().submit(lead)
+            return lead_created_response(lead_id, created, lead=lead)
+        except sqlite3.OperationalError as e:
+            logger.error(f'Database operational error creating lead: {e}')
+            return jsonify({'error': 'Database temporarily unavailable'}), 503
+        except sqlite3.Error as e:
+            logger.error(f'Database error creating lead: {e}')
+            return jsonify({'error': 'Database error'}), 500
+        except Exception as e:
+            logger.error(f'Unexpected error creating lead: {e}', exc_info=True)
+            return jsonify({'error': 'Internal server error'}), 500
     
     # Retry logic para concorrência (Grug teme concorrência, mas precisa funcionar)
     max_retries = 3
     for attempt in range(max_retries):
         try:
-            conn = get_db_connection()
-            try:
-                cursor = conn.execute('''
-                    INSERT INTO leads (name, email, contact, message, budget, form_type)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (name, email, contact, message, budget, form_type))
+            with db_connection() as conn:
+                lead_id, created = insert_lead(conn, lead)
                 conn.commit()
-                lead_id = cursor.lastrowid
-                logger.info(f'Lead created: ID={lead_id}, Name={name}, Type={form_type}')
-                return jsonify({'success': True, 'id': lead_id}), 201
-            finally:
-                conn.close()
+                if created:
+                    notify_lead_events()
+                return lead_created_response(lead_id, created, lead=lead)
         except sqlite3.OperationalError as e:
             if 'database is locked' in str(e).lower() and attempt < max_retries - 1:
                 wait_time = 0.1 * (attempt + 1)  # Backoff simples
+                get_metrics().inc('db_lock_retries_total', path='create_lead')
                 logger.warning(f'Database locked, retrying in {wait_time}s (attempt {attempt + 1}/{max_retries})')
                 time.sleep(wait_time)
                 continue
-            logger.error(f'Database operational error creating lead: {e}')
-            return jsonify({'error': 'Database temporarily unavailable'}), 503
-        except sqlite3.Error as e:
-            logger.error(f'Database error creating lead: {e}')
-            return jsonify({'error': 'Database error'}), 500
-        except Exception as e:
-            logger.error(f'Unexpected error creating lead: {e}', exc_info=True)
-            return jsonify({'error': 'Internal server error'}), 500
-    
-    logger.error('Failed to create lead after all retries')
-    return jsonify({'error': 'Database temporarily unavailable'}), 503
+            logger.error(f'Database operational error creating lead: {e}')
+            return jsonify({'error': 'Database temporarily unavailable'}), 503
+        except sqlite3.Error as e:
+            logger.error(f'Database error creating lead: {e}')
+            return jsonify({'error': 'Database error'}), 500
+        except Exception as e:
+            logger.error(f'Unexpected error creating lead: {e}', exc_info=True)
+            return jsonify({'error': 'Internal server error'}), 500
+    
+    logger.error('Failed to create lead after all retries')
+    return jsonify({'error': 'Database temporarily unavailable'}), 503
+
+# API: Importação em massa (protegido) - corpo NDJSON ou CSV lido em streaming,
+# gravado em lotes de BULK_CHUNK_SIZE com executemany (um commit por lote). Lote de 5000 segura
+# o lock de escrita por ~0,2s (create_lead espera no busy timeout); lote menor = mais commits,
+# e cada commit reescreve as páginas internas dos índices
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', '5000'))
+BULK_MAX_ERRORS = int(os.environ.get('BULK_MAX_ERRORS', '1000'))  # erros detalhados na resposta
+BULK_FIELDS = ('name', 'email', 'contact', 'message', 'budget', 'form_type', 'created_at')
+# Cabeçalhos do export CSV também valem: o que sai do export volta pela importação
+BULK_CSV_ALIASES = {
+    'nome': 'name', 'contato': 'contact', 'mensagem': 'message', 'orçamento': 'budget',
+    'orcamento': 'budget', 'tipo': 'form_type', 'data': 'created_at',
+}
+BULK_DEFAULT_FORM_TYPE = 'import'
+
+def bulk_field(record, field):
+    value = record.get(field)
+    return '' if value is None else str(value).strip()
+
+def parse_bulk_record(record):
+    """Registro cru (dict do JSON ou do CSV) -> (lead, None) ou (None, erro)"""
+    if not isinstance(record, dict):
+        return None, 'Row must be a JSON object'
+    lead = {field: bulk_field(record, field) for field in BULK_FIELDS}
+    validation_error = validate_lead_data(lead['name'], lead['email'], lead['contact'], lead['message'])
+    if validation_error:
+        return None, validation_error
+    lead['form_type'] = lead['form_type'] or BULK_DEFAULT_FORM_TYPE
+    if lead['created_at']:
+        try:
+            created_at = datetime.fromisoformat(lead['created_at'])
+        except ValueError:
+            return None, f'Invalid created_at: {lead["created_at"]}'
+        if created_at.tzinfo is not None:
+            created_at = created_at.astimezone(timezone.utc)  # created_at do SQLite é UTC
+        lead['created_at'] = created_at.strftime('%Y-%m-%d %H:%M:%S')
+    else:
+        lead['created_at'] = None
+    return lead, None
+
+def iter_ndjson_records(stream):
+    """(número da linha, registro ou None se o JSON é inválido) - linhas vazias são puladas"""
+    for number, line in enumerate(io.TextIOWrapper(stream, encoding='utf-8-sig'), start=1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, None
+
+def iter_csv_records(stream):
+    """(número do registro, dict) com cabeçalhos normalizados (export em português aceito)"""
+    reader = csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = [BULK_CSV_ALIASES.get(name.strip().lower(), name.strip().lower()) for name in header]
+    for number, values in enumerate(reader, start=1):
+        if not any(values):
+            continue
+        yield number, dict(zip(columns, values))
+
+def bulk_import_format():
+    """?format= tem prioridade; senão o Content-Type decide (NDJSON é o default)"""
+    requested = request.args.get('format')
+    if requested:
+        return requested
+    return 'csv' if request.mimetype in ('text/csv', 'application/csv') else 'ndjson'
+
+@bp.route('/api/leads/bulk', methods=['POST'])
+@login_required
+def bulk_import_leads():
+    import_format = bulk_import_format()
+    if import_format not in ('csv', 'ndjson'):
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+    records = iter_csv_records(request.stream) if import_format == 'csv' else iter_ndjson_records(request.stream)
+
+    imported = 0
+    failed = 0
+    errors = []
+    chunk = []
+
+    def flush(conn):
+        nonlocal imported
+        conn.execute('BEGIN IMMEDIATE')
+        bulk_insert_leads(conn, chunk)
+        conn.commit()
+        imported += len(chunk)
+        chunk.clear()
+        notify_lead_events()
+        wake_read_snapshot()
+
+    started = time.perf_counter()
+    try:
+        with db_connection() as conn:
+            for number, record in records:
+                lead, error = parse_bulk_record(record) if record is not None else (None, 'Invalid JSON')
+                if error:
+                    failed += 1
+                    if len(errors) < BULK_MAX_ERRORS:
+                        errors.append({'row': number, 'error': error})
+                    continue
+                chunk.append(lead)
+                if len(chunk) >= BULK_CHUNK_SIZE:
+                    flush(conn)
+            if chunk:
+                flush(conn)
+    except UnicodeDecodeError as e:
+        logger.warning(f'Bulk import: invalid encoding after {imported} rows - {e}')
+        return jsonify({'error': 'Body must be UTF-8', 'imported': imported}), 400
+    except csv.Error as e:
+        logger.warning(f'Bulk import: malformed CSV after {imported} rows - {e}')
+        return jsonify({'error': f'Malformed CSV: {e}', 'imported': imported}), 400
+    # Lotes já confirmados ficam: 'imported' diz de onde o cliente retoma
+    except sqlite3.OperationalError as e:
+        logger.error(f'Database operational error during bulk import after {imported} rows: {e}')
+        return jsonify({'error': 'Database temporarily unavailable', 'imported': imported}), 503
+    except sqlite3.Error as e:
+        logger.error(f'Database error during bulk import after {imported} rows: {e}')
+        return jsonify({'error': 'Database error', 'imported': imported}), 500
+    except Exception as e:
+        logger.error(f'Unexpected error during bulk import after {imported} rows: {e}', exc_info=True)
+        return jsonify({'error': 'Internal server error', 'imported': imported}), 500
+
+    logger.info(f'Bulk import ({import_format}): {imported} imported, {failed} failed in '
+                f'{time.perf_counter() - started:.2f}s by user {session.get("username")}')
+    return jsonify({'imported': imported, 'failed': failed, 'errors': errors,
+                    'errors_truncated': failed > len(errors)}), 200
+
+# Colunas de um lead na API (lista, stream)
+LEAD_COLUMNS = ('id', 'name', 'email', 'contact', 'message', 'budget', 'form_type', 'created_at',
+                'budget_cents', 'phone')
+
+# Projeção: ?fields=id,name,... ou ?view=summary (só o que a tabela do admin mostra).
+# message (até 2000 chars) fica para GET /api/leads/<id>, pedido quando o drawer abre.
+LEAD_VIEWS = {
+    'full': LEAD_COLUMNS,
+    'summary': ('id', 'name', 'form_type', 'budget', 'created_at', 'phone'),
+}
+
+def row_to_lead(row, columns=LEAD_COLUMNS):
+    return dict(zip(columns, row))
+
+def parse_lead_fields(args):
+    """?fields= (tem precedência) ou ?view= -> colunas do SELECT, na ordem de LEAD_COLUMNS.
+    id e created_at sempre vêm: o cursor da página precisa deles."""
+    fields_arg = args.get('fields')
+    if fields_arg:
+        fields = {field.strip() for field in fields_arg.split(',') if field.strip()}
+        unknown = sorted(fields - set(LEAD_COLUMNS))
+        if unknown:
+            raise ValueError(f'unknown fields: {", ".join(unknown)}')
+    else:
+        view = args.get('view') or 'full'
+        if view not in LEAD_VIEWS:
+            raise ValueError(f'view must be one of: {", ".join(LEAD_VIEWS)}')
+        fields = set(LEAD_VIEWS[view])
+    fields |= {'id', 'created_at'}
+    return tuple(column for column in LEAD_COLUMNS if column in fields)
+
+# Paginação keyset em (created_at, id) - Grug não usa OFFSET, OFFSET fica lento no fundo
+LEADS_PAGE_DEFAULT = 50
+LEADS_PAGE_MAX = 200
+
+def encode_cursor(created_at, lead_id):
+    """Cursor opaco para o cliente: posição (created_at, id) do último lead da página"""
+    raw = json.dumps([created_at, lead_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Inverso de encode_cursor - ValueError se o cursor for inválido"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, lead_id = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError('Invalid cursor') from e
+    if not isinstance(created_at, str) or not isinstance(lead_id, int):
+        raise ValueError('Invalid cursor')
+    return created_at, lead_id
+
+def parse_page_limit(value):
+    """Limite da página com default e teto - ValueError se não for inteiro positivo"""
+    if value is None or value == '':
+        return LEADS_PAGE_DEFAULT
+    limit = int(value)
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return min(limit, LEADS_PAGE_MAX)
+
+# Filtros do admin como predicados SQL indexados (antes eram scans no browser)
+LEAD_FILTERS = {
+    'all': (None, ()),
+    'hoje': ("created_at >= datetime('now', ?)", ('-24 hours',)),
+    'quentes': ("created_at >= datetime('now', ?)", ('-2 hours',)),
+    'whatsapp': ('phone IS NOT NULL', ()),
+}
+
+def parse_lead_filters(args):
+    """?filter=, ?form_type= e ?min_value= (reais) -> (cláusulas WHERE, parâmetros)"""
+    where = []
+    params = []
+    filter_name = args.get('filter') or 'all'
+    if filter_name not in LEAD_FILTERS:
+        raise ValueError(f'filter must be one of: {", ".join(LEAD_FILTERS)}')
+    clause, clause_params = LEAD_FILTERS[filter_name]
+    if clause:
+        where.append(clause)
+        params.extend(clause_params)
+    form_type = args.get('form_type')
+    if form_type:
+        where.append('form_type = ?')
+        params.append(form_type)
+    min_value = args.get('min_value')
+    if min_value:
+        where.append('budget_cents >= ?')
+        params.append(int(Decimal(min_value) * 100))
+    return where, params
+
+def get_leads_version(conn):
+    """(max id, contador de mudanças) - validador barato: MAX(id) é O(log n), contador é uma linha"""
+    row = conn.execute('''
+        SELECT (SELECT MAX(id) FROM leads),
+               (SELECT value FROM counters WHERE name = 'lead_changes')
+    ''').fetchone()
+    return row[0] or 0, row[1] or 0
+
+def make_etag(max_id, changes, variant=''):
+    """ETag muda quando os dados mudam ou quando a query (página, filtro) é outra"""
+    return f'{max_id}.{changes}.{zlib.crc32(variant.encode()):08x}'
+
+# Página normal: limit faz parte da variante (ETag de ?limit=1 não vale para ?limit=50).
+# Delta (since_id): since_id e limit ficam de fora - com a mesma versão dos dados o delta é
+# vazio de qualquer jeito, e o poller reaproveita o ETag do poll anterior a cada intervalo
+ETAG_DELTA_IGNORED_ARGS = ('since_id', 'limit')
+
+def list_etag_variant(args):
+    """Query da lista normalizada (ordem dos parâmetros não importa) para o ETag"""
+    ignored = ETAG_DELTA_IGNORED_ARGS if args.get('since_id') else ()
+    return '&'.join(f'{key}={value}' for key, value in sorted(args.items(multi=True))
+                    if key not in ignored)
+
+# API: Listar leads (protegido)
+# Suporta If-None-Match (304 sem rodar a query) e ?since_id= para o delta do polling.
+# Delta vem por id (faixa da chave primária, custo do tamanho do delta); a página normal,
+# por (created_at, id) no índice.
+@bp.route('/api/leads', methods=['GET'])
+@login_required
+def list_leads():
+    try:
+        limit = parse_page_limit(request.args.get('limit'))
+        cursor_arg = request.args.get('cursor')
+        after = decode_cursor(cursor_arg) if cursor_arg else None
+        since_id = int(request.args.get('since_id', 0))
+        if since_id and after:
+            raise ValueError('cursor and since_id cannot be combined')
+        where, params = parse_lead_filters(request.args)
+        columns = parse_lead_fields(request.args)
+    except (ValueError, ArithmeticError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        with read_connection() as conn:
+            # Validador e página na mesma transação de leitura: snapshot consistente
+            conn.execute('BEGIN')
+            max_id, changes = get_leads_version(conn)
+            etag = make_etag(max_id, changes, list_etag_variant(request.args))
+            # Comparação fraca (RFC 9110): o gzip do nginx devolve o ETag como W/"..."
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+
+            if since_id:
+                where.append('id > ?')
+                params.append(since_id)
+            if after:
+                where.append('(created_at, id) < (?, ?)')
+                params.extend(after)
+            where_sql = f"WHERE {' AND '.join(where)}" if where else ''
+            # Busca limit + 1 para saber se existe próxima página sem COUNT(*)
+            cursor = conn.execute(f'''
+                SELECT {', '.join(columns)}
+                FROM leads
+                {where_sql}
+                ORDER BY {'id DESC' if since_id else 'created_at DESC, id DESC'}
+                LIMIT ?
+            ''', (*params, limit + 1))
+            leads = [row_to_lead(row, columns) for row in cursor.fetchall()]
+            next_cursor = None
+            if len(leads) > limit:
+                leads = leads[:limit]
+                next_cursor = encode_cursor(leads[-1]['created_at'], leads[-1]['id'])
+            logger.info(f'Leads listed: {len(leads)} leads by user {session.get("username")}',
+                        extra={'event': 'leads_listed', 'count': len(leads)})
+            response = jsonify({'leads': leads, 'next_cursor': next_cursor,
+                                'max_id': max_id, 'changes': changes})
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response, 200
+    except sqlite3.OperationalError as e:
+        logger.error(f'Database operational error listing leads: {e}')
+        return jsonify({'error': 'Database temporarily unavailable'}), 503
+    except sqlite3.Error as e:
+        logger.error(f'Database error listing leads: {e}')
+        return jsonify({'error': 'Database error'}), 500
+    except Exception as e:
+        logger.error(f'Unexpected error listing leads: {e}', exc_info=True)
+        return jsonify({'error': 'Internal server error'}), 500
+
+# API: Busca full-text (protegido) - FTS5 ranqueado por bm25, paginado por keyset em (score, id)
+SEARCH_MAX_TERMS = 10
+SEARCH_TERM_RE = re.compile(r'\w+')
+# Pesos do bm25 por coluna (name, email, contact, message): nome vale mais que o briefing
+SEARCH_WEIGHTS = (10.0, 5.0, 5.0, 1.0)
+
+def build_fts_query(text):
+    """Texto livre -> query FTS5 segura: cada palavra vira prefixo entre aspas, todas obrigatórias.
+    Pontuação (aspas, NEAR, parênteses) nunca chega ao parser do FTS5."""
+    terms = SEARCH_TERM_RE.findall(text or '')[:SEARCH_MAX_TERMS]
+    if not terms:
+        raise ValueError('q is required')
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def encode_search_cursor(score, lead_id):
+    raw = json.dumps([score, lead_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_search_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        score, lead_id = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError('Invalid cursor') from e
+    if not isinstance(score, (int, float)) or not isinstance(lead_id, int):
+        raise ValueError('Invalid cursor')
+    return score, lead_id
+
+@bp.route('/api/leads/search', methods=['GET'])
+@login_required
+def search_leads():
+    try:
+        fts_query = build_fts_query(request.args.get('q'))
+        limit = parse_page_limit(request.args.get('limit'))
+        cursor_arg = request.args.get('cursor')
+        after = decode_search_cursor(cursor_arg) if cursor_arg else None
+        where, params = parse_lead_filters(request.args)
+        columns = parse_lead_fields(request.args)
+    except (ValueError, ArithmeticError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    score_sql = f"bm25(leads_fts, {', '.join(str(w) for w in SEARCH_WEIGHTS)})"
+    where.insert(0, 'leads_fts MATCH ?')
+    params.insert(0, fts_query)
+    if after:
+        where.append(f'({score_sql}, leads.id) > (?, ?)')
+        params.extend(after)
+
+    try:
+        with read_connection() as conn:
+            # bm25 é negativo: menor = mais relevante
+            cursor = conn.execute(f'''
+                SELECT {', '.join(f'leads.{column}' for column in columns)}, {score_sql} AS score
+                FROM leads_fts
+                JOIN leads ON leads.id = leads_fts.rowid
+                WHERE {' AND '.join(where)}
+                ORDER BY score, leads.id
+                LIMIT ?
+            ''', (*params, limit + 1))
+            rows = cursor.fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_search_cursor(rows[-1]['score'], rows[-1]['id'])
+        leads = [row_to_lead(row, columns) for row in rows]
+        logger.info(f'Leads search: {len(leads)} results by user {session.get("username")}',
+                    extra={'event': 'leads_searched', 'count': len(leads)})
+        return jsonify({'leads': leads, 'next_cursor': next_cursor}), 200
+    except sqlite3.OperationalError as e:
+        logger.error(f'Database operational error searching leads: {e}')
+        return jsonify({'error': 'Database temporarily unavailable'}), 503
+    except sqlite3.Error as e:
+        logger.error(f'Database error searching leads: {e}')
+        return jsonify({'error': 'Database error'}), 500
+    except Exception as e:
+        logger.error(f'Unexpected error searching leads: {e}', exc_info=True)
+        return jsonify({'error': 'Internal server error'}), 500
+
+# Export em streaming: linhas saem do cursor direto para a resposta, memória constante
+EXPORT_FETCH_SIZE = 500
+EXPORT_COLUMNS = ('id', 'name', 'email', 'contact', 'message', 'budget', 'form_type', 'created_at')
+EXPORT_CSV_HEADERS = ('ID', 'Nome', 'Email', 'Contato', 'Mensagem', 'Orçamento', 'Tipo', 'Data')
+
+def parse_date_bound(value, end=False):
+    """'YYYY-MM-DD' ou timestamp ISO -> string comparável com created_at (UTC do SQLite).
+    Data sem hora no limite final inclui o dia inteiro."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError as e:
+        raise ValueError(f'Invalid date: {value}') from e
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc)  # created_at do SQLite é UTC
+    return parsed.strftime('%Y-%m-%d %H:%M:%S')
+
+def iter_export_rows(date_from, date_to):
+    """Gera linhas de leads em lotes de EXPORT_FETCH_SIZE (conexão fica presa só durante o stream)"""
+    where = []
+    params = []
+    if date_from:
+        where.append('created_at >= ?')
+        params.append(date_from)
+    if date_to:
+        where.append('created_at < ?')
+        params.append(date_to)
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ''
+    with read_connection() as conn:
+        cursor = conn.execute(f'''
+            SELECT {', '.join(EXPORT_COLUMNS)}
+            FROM leads
+            {where_sql}
+            ORDER BY created_at DESC, id DESC
+        ''', params)
+        while True:
+            rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                break
+            yield rows
+
+def generate_csv(date_from, date_to):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM para o Excel abrir acentos direito
+    buffer.write('\ufeff')
+    writer.writerow(EXPORT_CSV_HEADERS)
+    for rows in iter_export_rows(date_from, date_to):
+        writer.writerows(tuple(row) for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()  # Só o cabeçalho: nenhum lead no período
+
+def generate_ndjson(date_from, date_to):
+    for rows in iter_export_rows(date_from, date_to):
+        yield ''.join(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + '\n'
+                      for row in rows)
+
+def logged_stream(chunks, what):
+    """Depois do primeiro byte não dá mais para mudar o status - Grug só loga o erro"""
+    count = 0
+    try:
+        for chunk in chunks:
+            count += 1
+            yield chunk
+    except sqlite3.Error as e:
+        logger.error(f'Database error during {what} after {count} chunks: {e}')
+        raise
+    logger.info(f'{what} finished: {count} chunks')
+
+# API: Exportar leads em CSV ou NDJSON (protegido)
+@bp.route('/api/leads/export', methods=['GET'])
+@login_required
+def export_leads():
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+    try:
+        date_from = parse_date_bound(request.args.get('from'))
+        date_to = parse_date_bound(request.args.get('to'), end=True)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    logger.info(f'Leads export started: format={export_format} from={date_from} to={date_to} '
+                f'by user {session.get("username")}')
+    stamp = datetime.now().strftime('%Y-%m-%d')
+    if export_format == 'csv':
+        body = generate_csv(date_from, date_to)
+        mimetype = 'text/csv; charset=utf-8'
+    else:
+        body = generate_ndjson(date_from, date_to)
+        mimetype = 'application/x-ndjson'
+    headers = {
+        'Content-Disposition': f'attachment; filename="leads-gui-{stamp}.{export_format}"',
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no',  # nginx não segura o stream em buffer
+    }
+    # O stream lê depois do after_request: a idade do snapshot vai no header já aqui
+    snapshot = get_read_snapshot()
+    snapshot_age = snapshot.age() if snapshot is not None else None
+    if snapshot_age is not None:
+        headers['X-Snapshot-Age'] = f'{snapshot_age:.3f}'
+    # stream_with_context: o gerador roda depois da view e ainda precisa saber o DB da app
+    return Response(stream_with_context(logged_stream(body, 'Leads export')), mimetype=mimetype,
+                    headers=headers)
+
+# API: KPIs do dashboard direto do SQL (protegido)
+URGENT_WINDOW = '-2 hours'
+
+@bp.route('/api/leads/stats', methods=['GET'])
+@login_required
+def lead_stats():
+    try:
+        where, params = parse_lead_filters(request.args)
+    except (ValueError, ArithmeticError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        with read_connection() as conn:
+            conn.execute('BEGIN')
+            if where:
+                # Totais de um filtro: agregação sobre índice em vez dos contadores globais
+                row = conn.execute(f'''
+                    SELECT COUNT(*), COALESCE(SUM(budget_cents), 0)
+                    FROM leads WHERE {' AND '.join(where)}
+                ''', params).fetchone()
+                counters = {'lead_count': row[0], 'budget_cents': row[1]}
+            else:
+                counters = dict(conn.execute(
+                    "SELECT name, value FROM counters WHERE name IN ('lead_count', 'budget_cents')"
+                ).fetchall())
+            # Janela de tempo não cabe em contador; o índice em created_at deixa isso barato.
+            # Mesmo filtro dos totais: urgentes do recorte que o admin está vendo
+            urgent = conn.execute(f'''
+                SELECT COUNT(*) FROM leads
+                WHERE {' AND '.join(["created_at >= datetime('now', ?)", *where])}
+            ''', (URGENT_WINDOW, *params)).fetchone()[0]
+        total_cents = counters.get('budget_cents', 0)
+        return jsonify({
+            'total_leads': counters.get('lead_count', 0),
+            'total_value_cents': total_cents,
+            'total_value': total_cents / 100,
+            'urgent_leads': urgent
+        }), 200
+    except sqlite3.OperationalError as e:
+        logger.error(f'Database operational error computing stats: {e}')
+        return jsonify({'error': 'Database temporarily unavailable'}), 503
+    except sqlite3.Error as e:
+        logger.error(f'Database error computing stats: {e}')
+        return jsonify({'error': 'Database error'}), 500
+    except Exception as e:
+        logger.error(f'Unexpected error computing stats: {e}', exc_info=True)
+        return jsonify({'error': 'Internal server error'}), 500
+
+# API: Série temporal de leads por hora/dia e form_type (protegido)
+# Lê as rollups: custo proporcional ao número de buckets pedidos, não ao tamanho de leads
+TIMESERIES_MAX_BUCKETS = int(os.environ.get('TIMESERIES_MAX_BUCKETS', '1000'))
+TIMESERIES_DEFAULT_BUCKETS = {'hour': 24, 'day': 30}
+
+def parse_timeseries_range(args, bucket_name):
+    """?from=&to= -> lista de buckets (strings, do mais velho ao mais novo).
+    Sem `to`: até o bucket atual. Sem `from`: os últimos TIMESERIES_DEFAULT_BUCKETS."""
+    _, _, bucket_format, step = LEAD_ROLLUPS[bucket_name]
+    floor = lambda moment: datetime.strptime(moment.strftime(bucket_format), bucket_format)
+    date_to = parse_date_bound(args.get('to'), end=True)
+    date_from = parse_date_bound(args.get('from'))
+    if date_to:
+        end = datetime.strptime(date_to, '%Y-%m-%d %H:%M:%S')  # exclusivo
+    else:
+        end = floor(datetime.now(timezone.utc).replace(tzinfo=None)) + step
+    if date_from:
+        start = floor(datetime.strptime(date_from, '%Y-%m-%d %H:%M:%S'))
+    else:
+        start = floor(end - step * TIMESERIES_DEFAULT_BUCKETS[bucket_name])
+    if start >= end:
+        raise ValueError('from must be before to')
+    count = math.ceil((end - start) / step)
+    if count > TIMESERIES_MAX_BUCKETS:
+        raise ValueError(f'Too many buckets: {count} (max {TIMESERIES_MAX_BUCKETS})')
+    return [(start + step * i).strftime(bucket_format) for i in range(count)]
+
+@bp.route('/api/leads/timeseries', methods=['GET'])
+@login_required
+def lead_timeseries():
+    bucket_name = request.args.get('bucket', 'day')
+    if bucket_name not in LEAD_ROLLUPS:
+        return jsonify({'error': 'bucket must be hour or day'}), 400
+    try:
+        buckets = parse_timeseries_range(request.args, bucket_name)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        with read_connection() as conn:
+            rows = conn.execute(f'''
+                SELECT bucket, form_type, lead_count, budget_cents FROM {LEAD_ROLLUPS[bucket_name][0]}
+                WHERE bucket BETWEEN ? AND ?
+            ''', (buckets[0], buckets[-1])).fetchall()
+        # Bucket sem lead sai com zero: o gráfico não precisa completar buracos
+        series = {bucket: {'bucket': bucket, 'total_leads': 0, 'total_value_cents': 0, 'by_form_type': {}}
+                  for bucket in buckets}
+        form_types = set()
+        for bucket, form_type, lead_count, budget_cents in rows:
+            point = series[bucket]
+            point['total_leads'] += lead_count
+            point['total_value_cents'] += budget_cents
+            point['by_form_type'][form_type] = lead_count
+            form_types.add(form_type)
+        response = jsonify({
+            'bucket': bucket_name,
+            'from': buckets[0],
+            'to': buckets[-1],
+            'form_types': sorted(form_types),
+            'series': list(series.values()),
+        })
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response, 200
+    except sqlite3.OperationalError as e:
+        logger.error(f'Database operational error computing timeseries: {e}')
+        return jsonify({'error': 'Database temporarily unavailable'}), 503
+    except sqlite3.Error as e:
+        logger.error(f'Database error computing timeseries: {e}')
+        return jsonify({'error': 'Database error'}), 500
+    except Exception as e:
+        logger.error(f'Unexpected error computing timeseries: {e}', exc_info=True)
+        return jsonify({'error': 'Internal server error'}), 500
+
+@bp.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recalcula as rollups da série temporal a partir dos leads: flask --app app rebuild-rollups"""
+    with db_connection() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        rebuild_lead_rollups(conn)
+        conn.commit()
+        counts = [conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table, *_ in LEAD_ROLLUPS.values()]
+    wake_read_snapshot()
+    click.echo(f'Rollups rebuilt ({counts[0]} hourly, {counts[1]} daily rows)')
+
+# Push de leads novos/deletados via Server-Sent Events
+# Cada stream segura uma thread do servidor, então o número de assinantes tem teto.
+SSE_MAX_SUBSCRIBERS = int(os.environ.get('SSE_MAX_SUBSCRIBERS', '20'))
+SSE_HEARTBEAT = float(os.environ.get('SSE_HEARTBEAT', '15'))
+SSE_POLL_INTERVAL = float(os.environ.get('SSE_POLL_INTERVAL', '1'))
+SSE_MAX_DURATION = float(os.environ.get('SSE_MAX_DURATION', '300'))  # Cliente reconecta sozinho
+SSE_EVENT_BATCH = 100
+SSE_RESET_THRESHOLD = 500  # Atraso maior que isso: manda 'reset' e o cliente recarrega a lista
+
+_sse_subscribers = 0
+_sse_lock = threading.Lock()
+
+def acquire_sse_slot():
+    global _sse_subscribers
+    with _sse_lock:
+        if _sse_subscribers >= SSE_MAX_SUBSCRIBERS:
+            return False
+        _sse_subscribers += 1
+        return True
+
+def release_sse_slot():
+    global _sse_subscribers
+    with _sse_lock:
+        _sse_subscribers -= 1
+
+def format_sse(event_id, event, data):
+    return f'id: {event_id}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+def read_lead_events(last_id):
+    """Eventos depois de last_id, já formatados. Conexão do pool só durante a leitura.
+    Retorna (novo last_id, chunks)."""
+    chunks = []
+    with db_connection() as conn:
+        conn.execute('BEGIN')
+        oldest, newest = conn.execute('SELECT MIN(id), MAX(id) FROM lead_events').fetchone()
+        newest = newest or 0
+        if last_id is None:
+            return newest, chunks
+        # Cliente perdeu eventos que já foram podados, ou está muito atrás: recarregar é mais barato
+        if newest - last_id > SSE_RESET_THRESHOLD or (oldest is not None and last_id < oldest - 1):
+            chunks.append(format_sse(newest, 'reset', {}))
+            return newest, chunks
+        rows = conn.execute(f'''
+            SELECT e.id, e.type, e.lead_id, {', '.join('l.' + c for c in LEAD_COLUMNS)}
+            FROM lead_events e
+            LEFT JOIN leads l ON l.id = e.lead_id AND e.type = 'created'
+            WHERE e.id > ?
+            ORDER BY e.id
+            LIMIT ?
+        ''', (last_id, SSE_EVENT_BATCH)).fetchall()
+    for row in rows:
+        event_id, event_type, lead_id = row[0], row[1], row[2]
+        if event_type == 'created' and row[3] is not None:
+            chunks.append(format_sse(event_id, 'lead_created', row_to_lead(row[3:])))
+        elif event_type == 'created':
+            # Criado e já removido: o 'deleted' vem logo depois, nada a mandar aqui
+            chunks.append(f'id: {event_id}\n\n')
+        elif event_type == 'bulk_import':
+            chunks.append(format_sse(event_id, 'reset', {'reason': 'bulk_import', 'first_id': lead_id}))
+        else:
+            chunks.append(format_sse(event_id, 'lead_deleted', {'id': lead_id}))
+        last_id = event_id
+    return last_id, chunks
+
+def stream_lead_events(last_id):
+    """Gerador do stream: eventos assim que chegam, heartbeat para manter a conexão viva"""
+    yield 'retry: 3000\n\n'
+    started = last_sent = time.monotonic()
+    while time.monotonic() - started < SSE_MAX_DURATION:
+        last_id, chunks = read_lead_events(last_id)
+        if chunks:
+            yield ''.join(chunks)
+            last_sent = time.monotonic()
+            if len(chunks) >= SSE_EVENT_BATCH:
+                continue
+        elif time.monotonic() - last_sent >= SSE_HEARTBEAT:
+            yield ': ping\n\n'
+            last_sent = time.monotonic()
+        with lead_events_changed:
+            lead_events_changed.wait(SSE_POLL_INTERVAL)
 
-# API: Listar leads (protegido)
-@app.route('/api/leads', methods=['GET'])
+# API: Stream de eventos de leads (protegido)
+@bp.route('/api/leads/stream', methods=['GET'])
 @login_required
-def list_leads():
+def stream_leads():
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
     try:
-        conn = get_db_connection()
-        try:
-            cursor = conn.execute('''
-                SELECT id, name, email, contact, message, budget, form_type, created_at
-                FROM leads
-                ORDER BY created_at DESC
-            ''')
-            leads = []
-            for row in cursor.fetchall():
-                leads.append({
-                    'id': row[0],
-                    'name': row[1],
-                    'email': row[2],
-                    'contact': row[3],
-                    'message': row[4],
-                    'budget': row[5],
-                    'form_type': row[6],
-                    'created_at': row[7]
-                })
-            logger.info(f'Leads listed: {len(leads)} leads by user {session.get("username")}')
-            return jsonify({'leads': leads}), 200
-        finally:
-            conn.close()
+        last_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return jsonify({'error': 'Invalid Last-Event-ID'}), 400
+
+    if not acquire_sse_slot():
+        logger.warning('Lead stream rejected: too many subscribers')
+        return jsonify({'error': 'Too many subscribers'}), 503, {'Retry-After': '30'}
+
+    logger.info(f'Lead stream opened by user {session.get("username")} (last_event_id={last_id})')
+    response = Response(stream_with_context(stream_lead_events(last_id)), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no',
+    })
+    # call_on_close roda mesmo se o gerador nunca começar (cliente caiu antes)
+    response.call_on_close(release_sse_slot)
+    return response
+
+# API: Um lead completo (protegido) - o drawer do admin pede ao abrir (a lista vem em summary)
+@bp.route('/api/leads/<int:lead_id>', methods=['GET'])
+@login_required
+def get_lead(lead_id):
+    try:
+        columns = parse_lead_fields(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    sql = f'SELECT {", ".join(columns)} FROM leads WHERE id = ?'
+    try:
+        with read_connection() as conn:
+            row = conn.execute(sql, (lead_id,)).fetchone()
+        if row is None and g.pop('snapshot_age', None) is not None:
+            # Lead mais novo que o snapshot (o SSE avisa na hora): confere no DB
+            with db_connection() as conn:
+                row = conn.execute(sql, (lead_id,)).fetchone()
+        if row is None:
+            return jsonify({'error': 'Lead not found'}), 404
+        response = jsonify(row_to_lead(row, columns))
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response, 200
     except sqlite3.OperationalError as e:
-        logger.error(f'Database operational error listing leads: {e}')
+        logger.error(f'Database operational error reading lead {lead_id}: {e}')
         return jsonify({'error': 'Database temporarily unavailable'}), 503
     except sqlite3.Error as e:
-        logger.error(f'Database error listing leads: {e}')
+        logger.error(f'Database error reading lead {lead_id}: {e}')
         return jsonify({'error': 'Database error'}), 500
     except Exception as e:
-        logger.error(f'Unexpected error listing leads: {e}', exc_info=True)
+        logger.error(f'Unexpected error reading lead {lead_id}: {e}', exc_info=True)
         return jsonify({'error': 'Internal server error'}), 500
 
 # API: Deletar lead (protegido)
-@app.route('/api/leads/<int:lead_id>', methods=['DELETE'])
+@bp.route('/api/leads/<int:lead_id>', methods=['DELETE'])
 @login_required
 def delete_lead(lead_id):
     try:
-        conn = get_db_connection()
-        try:
-            cursor = conn.execute('DELETE FROM leads WHERE id = ?', (lead_id,))
+        with db_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            deleted = delete_leads(conn, [lead_id])
             conn.commit()
-            if cursor.rowcount == 0:
+            notify_lead_events()
+            wake_read_snapshot()
+            if deleted == 0:
                 logger.warning(f'Lead not found for deletion: ID={lead_id}')
                 return jsonify({'error': 'Lead not found'}), 404
             logger.info(f'Lead deleted: ID={lead_id} by user {session.get("username")}')
             return jsonify({'success': True}), 200
-        finally:
-            conn.close()
     except sqlite3.OperationalError as e:
         logger.error(f'Database operational error deleting lead {lead_id}: {e}')
         return jsonify({'error': 'Database temporarily unavailable'}), 503
@@ -215,8 +2450,596 @@ def delete_lead(lead_id):
         logger.error(f'Unexpected error deleting lead {lead_id}: {e}', exc_info=True)
         return jsonify({'error': 'Internal server error'}), 500
 
+# API: Deletar vários leads numa transação (protegido) - lista de ids ou filtro
+BULK_DELETE_MAX_IDS = int(os.environ.get('BULK_DELETE_MAX_IDS', '5000'))
+BULK_DELETE_ID_CHUNK = 500  # ids por IN (...), longe do limite de variáveis do SQLite
+
+def parse_bulk_delete_filter(criteria):
+    """{'filter', 'form_type', 'min_value', 'before', 'q'} -> (cláusulas WHERE, parâmetros).
+    Filtro vazio (que pegaria a tabela inteira) é recusado."""
+    if not isinstance(criteria, dict):
+        raise ValueError('filter must be an object')
+    # JSON aceita qualquer tipo: o que parse_lead_filters lê da query string tem que ser texto
+    for field in ('filter', 'form_type', 'before', 'q'):
+        if criteria.get(field) is not None and not isinstance(criteria[field], str):
+            raise ValueError(f'filter.{field} must be a string')
+    min_value = criteria.get('min_value')
+    if min_value is not None and (isinstance(min_value, bool) or not isinstance(min_value, (str, int, float))):
+        raise ValueError('filter.min_value must be a number or a string')
+    where, params = parse_lead_filters(criteria)
+    before = parse_date_bound(criteria.get('before'))
+    if before:
+        where.append('created_at < ?')
+        params.append(before)
+    if criteria.get('q'):
+        where.append('id IN (SELECT rowid FROM leads_fts WHERE leads_fts MATCH ?)')
+        params.append(build_fts_query(criteria['q']))
+    if not where:
+        raise ValueError('filter matches every lead')
+    return where, params
+
+@bp.route('/api/leads/bulk-delete', methods=['POST'])
+@login_required
+def bulk_delete_leads():
+    data = request.get_json(silent=True)
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Body must be a JSON object'}), 400
+    ids = data.get('ids')
+    criteria = data.get('filter')
+    try:
+        if (ids is None) == (criteria is None):
+            raise ValueError('Provide either ids or filter')
+        if ids is not None:
+            if not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+                raise ValueError('ids must be a list of integers')
+            if len(ids) > BULK_DELETE_MAX_IDS:
+                raise ValueError(f'Too many ids (max {BULK_DELETE_MAX_IDS})')
+            ids = sorted(set(ids))
+        else:
+            where, params = parse_bulk_delete_filter(criteria)
+    except (ValueError, ArithmeticError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        with db_connection() as conn:
+            # Uma transação: ou sai tudo, ou nada
+            conn.execute('BEGIN IMMEDIATE')
+            if ids is not None:
+                deleted = sum(delete_leads(conn, ids[i:i + BULK_DELETE_ID_CHUNK])
+                              for i in range(0, len(ids), BULK_DELETE_ID_CHUNK))
+            else:
+                deleted = delete_leads_where(conn, ' AND '.join(where), params)
+            conn.commit()
+        notify_lead_events()
+        wake_read_snapshot()
+        logger.info(f'Leads bulk deleted: {deleted} by user {session.get("username")}')
+        return jsonify({'success': True, 'deleted': deleted}), 200
+    except sqlite3.OperationalError as e:
+        logger.error(f'Database operational error during bulk delete: {e}')
+        return jsonify({'error': 'Database temporarily unavailable'}), 503
+    except sqlite3.Error as e:
+        logger.error(f'Database error during bulk delete: {e}')
+        return jsonify({'error': 'Database error'}), 500
+    except Exception as e:
+        logger.error(f'Unexpected error during bulk delete: {e}', exc_info=True)
+        return jsonify({'error': 'Internal server error'}), 500
+
+# Retenção: leads mais velhos que RETENTION_DAYS vão para um arquivo SQLite separado
+# (ARCHIVE_DB_PATH), em lotes pequenos - o lock de escrita do DB principal fica preso só
+# pelo DELETE de um lote. Roda fora do request: flask --app app archive-leads (cron).
+# Arquivado sai da lista e dos KPIs (com ou sem filtro, a mesma regra: só o DB principal) e
+# continua na série temporal.
+RETENTION_DAYS = int(os.environ.get('RETENTION_DAYS', '365'))
+RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', '500'))
+RETENTION_PAUSE = float(os.environ.get('RETENTION_PAUSE_MS', '50')) / 1000
+ARCHIVE_DB_PATH = os.environ.get('ARCHIVE_DB_PATH')  # default: <DB_PATH sem extensão>-archive.db
+ARCHIVE_COLUMNS = ('id', 'name', 'email', 'contact', 'message', 'budget', 'form_type', 'created_at',
+                   'budget_cents', 'phone')
+
+def get_archive_db_path():
+    return ARCHIVE_DB_PATH or os.path.splitext(get_db_path())[0] + '-archive.db'
+
+def open_archive_db(path):
+    conn = sqlite3.connect(path, timeout=20.0)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS archived_leads (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            email TEXT,
+            contact TEXT,
+            message TEXT,
+            budget TEXT,
+            form_type TEXT,
+            created_at TIMESTAMP,
+            budget_cents INTEGER NOT NULL DEFAULT 0,
+            phone TEXT,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_archived_leads_created_at ON archived_leads (created_at)')
+    conn.commit()
+    return conn
+
+def archive_old_leads(days=None, batch_size=None, pause=None, archive_path=None, max_batches=None):
+    """Move leads com created_at anterior a agora - days para o arquivo. Retorna quantos moveu.
+
+    Cada lote: copia para o arquivo e commita lá; depois apaga do principal (BEGIN IMMEDIATE
+    curto). Se cair no meio, o lote fica nos dois lados e a próxima rodada termina o serviço
+    (INSERT OR IGNORE pelo id) - lead nunca some."""
+    days = RETENTION_DAYS if days is None else days
+    batch_size = batch_size or RETENTION_BATCH_SIZE
+    pause = RETENTION_PAUSE if pause is None else pause
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+    moved = 0
+    batches = 0
+    archive = open_archive_db(archive_path or get_archive_db_path())
+    try:
+        while max_batches is None or batches < max_batches:
+            with db_connection() as conn:
+                rows = conn.execute(f'''
+                    SELECT {', '.join(ARCHIVE_COLUMNS)} FROM leads
+                    WHERE created_at < ?
+                    ORDER BY created_at, id
+                    LIMIT ?
+                ''', (cutoff, batch_size)).fetchall()
+                if not rows:
+                    break
+                archive.executemany(f'''
+                    INSERT OR IGNORE INTO archived_leads ({', '.join(ARCHIVE_COLUMNS)})
+                    VALUES ({', '.join('?' * len(ARCHIVE_COLUMNS))})
+                ''', [tuple(row) for row in rows])
+                archive.commit()
+
+                # Contadores dos KPIs descontam (como os totais filtrados, contam só leads);
+                # rollups e SSE não (ARCHIVE_DELETE_WHEN). Erro no meio: a devolução ao pool
+                # desfaz a transação, linha de bypass junto.
+                conn.execute('BEGIN IMMEDIATE')
+                conn.execute("INSERT INTO trigger_bypass (mode) VALUES ('archive')")
+                moved += delete_leads(conn, [row['id'] for row in rows])
+                conn.execute("DELETE FROM trigger_bypass WHERE mode = 'archive'")
+                conn.commit()
+            batches += 1
+            if pause:
+                time.sleep(pause)  # Deixa os requests de escrita passarem entre lotes
+    finally:
+        archive.close()
+    logger.info(f'Retention: {moved} leads older than {days} days archived in {batches} batches')
+    return moved
+
+@bp.cli.command('archive-leads')
+@click.option('--days', type=int, default=None, help='Idade mínima em dias (default: RETENTION_DAYS)')
+@click.option('--batch-size', type=int, default=None, help='Leads por lote (default: RETENTION_BATCH_SIZE)')
+def archive_leads_command(days, batch_size):
+    """Move leads antigos para o DB de arquivo: flask --app app archive-leads --days 365"""
+    moved = archive_old_leads(days=days, batch_size=batch_size)
+    click.echo(f'{moved} leads archived to {get_archive_db_path()}')
+
+# Backup online: a API de backup do SQLite copia BACKUP_PAGES_PER_STEP páginas por passo e
+# solta o DB entre passos - lead continua entrando durante a cópia. Cada backup vira um
+# .db.gz em BACKUP_DIR; ficam os BACKUP_KEEP mais novos. Agendado pelo master do gunicorn
+# (BACKUP_INTERVAL em gunicorn.conf.py), na mão: flask --app app backup-db / POST /api/backups.
+BACKUP_DIR = os.environ.get('BACKUP_DIR')  # default: backups/ ao lado do DB
+BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', '7'))
+BACKUP_PAGES_PER_STEP = int(os.environ.get('BACKUP_PAGES_PER_STEP', '256'))
+BACKUP_STEP_PAUSE = float(os.environ.get('BACKUP_STEP_PAUSE_MS', '5')) / 1000
+BACKUP_MAX_RESTARTS = int(os.environ.get('BACKUP_MAX_RESTARTS', '3'))
+BACKUP_STAMP_RE = r'\d{8}-\d{6}-\d{6}\.db\.gz'  # <nome do DB>-AAAAMMDD-HHMMSS-micro.db.gz (UTC)
+
+class BackupInProgress(Exception):
+    pass
+
+class BackupRestarted(Exception):
+    """Escrita de outra conexão reiniciou a cópia passo a passo vezes demais"""
+
+def get_backup_dir():
+    return BACKUP_DIR or os.path.join(os.path.dirname(os.path.abspath(get_db_path())), 'backups')
+
+def is_backup_name(name):
+    """Backup deste DB (leads-archive-... não é backup de leads.db)"""
+    prefix = os.path.splitext(os.path.basename(get_db_path()))[0] + '-'
+    return re.fullmatch(re.escape(prefix) + BACKUP_STAMP_RE, name) is not None
+
+@contextmanager
+def backup_dir_lock(backup_dir):
+    """flock no diretório: um backup/restore por vez entre workers, CLI e agendador"""
+    os.makedirs(backup_dir, exist_ok=True)
+    with open(os.path.join(backup_dir, '.lock'), 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise BackupInProgress('Backup already running') from None
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def list_backups(backup_dir=None):
+    """Backups do DB atual, mais novo primeiro (o nome carrega o instante em UTC)"""
+    backup_dir = backup_dir or get_backup_dir()
+    try:
+        names = os.listdir(backup_dir)
+    except FileNotFoundError:
+        return []
+    backups = []
+    for name in sorted(names, reverse=True):
+        if not is_backup_name(name):
+            continue
+        stat = os.stat(os.path.join(backup_dir, name))
+        archive_name = archive_backup_name(name)
+        backups.append({
+            'name': name,
+            'archive': archive_name if os.path.exists(os.path.join(backup_dir, archive_name)) else None,
+            'size': stat.st_size,
+            'created_at': datetime.fromtimestamp(stat.st_mtime, timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+        })
+    return backups
+
+def copy_db_online(source, dest, pages, pause):
+    """source.backup(dest) em passos de `pages` páginas com `pause` entre eles.
+    Retorna passos, reinícios, maior passo e soma dos passos. Passo = tempo em que o backup
+    segura o DB de origem (em WAL é só um snapshot de leitura e o escritor nem espera)."""
+    stats = {'steps': 0, 'restarts': 0, 'lock_max': 0.0, 'lock_total': 0.0, 'remaining': None}
+    step_started = time.perf_counter()
+
+    def progress(status, remaining, total):
+        nonlocal step_started
+        held = time.perf_counter() - step_started
+        stats['steps'] += 1
+        stats['lock_max'] = max(stats['lock_max'], held)
+        stats['lock_total'] += held
+        get_metrics().observe('backup_lock_held_seconds', held)
+        # Outra conexão escreveu: o SQLite recomeça a cópia do zero e o restante não diminui
+        if stats['remaining'] is not None and remaining and remaining >= stats['remaining']:
+            stats['restarts'] += 1
+            get_metrics().inc('backup_restarts_total')
+            if stats['restarts'] > BACKUP_MAX_RESTARTS:
+                raise BackupRestarted()
+        stats['remaining'] = remaining
+        if remaining and pause:
+            time.sleep(pause)
+        step_started = time.perf_counter()
+
+    try:
+        source.backup(dest, pages=pages, progress=progress)
+    except BackupRestarted:
+        # Escrita contínua: termina num passo só (em WAL continua sem travar escritor)
+        step_started = time.perf_counter()
+        source.backup(dest)
+        held = time.perf_counter() - step_started
+        stats['steps'] += 1
+        stats['lock_max'] = max(stats['lock_max'], held)
+        stats['lock_total'] += held
+        get_metrics().observe('backup_lock_held_seconds', held)
+    return stats
+
+def archive_backup_name(name):
+    """Backup do arquivo de retenção que acompanha um backup do DB (mesmo instante)"""
+    return name[:-len('.db.gz')] + '.archive.db.gz'
+
+def write_db_backup(source_path, backup_dir, name):
+    """Cópia online de source_path para backup_dir/name (.db.gz, com quick_check). Retorna os
+    números de copy_db_online."""
+    raw_path = os.path.join(backup_dir, f'.{name}.db')
+    gz_path = os.path.join(backup_dir, f'.{name}.tmp')
+    try:
+        source = sqlite3.connect(source_path, timeout=20.0)
+        dest = sqlite3.connect(raw_path)
+        try:
+            stats = copy_db_online(source, dest, BACKUP_PAGES_PER_STEP, BACKUP_STEP_PAUSE)
+            # Arquivo autossuficiente: sem -wal ao lado, restaurável com qualquer sqlite3
+            dest.execute('PRAGMA journal_mode=DELETE')
+            check = dest.execute('PRAGMA quick_check').fetchone()[0]
+            if check != 'ok':
+                raise sqlite3.DatabaseError(f'backup failed quick_check: {check}')
+        finally:
+            dest.close()
+            source.close()
+        with open(raw_path, 'rb') as raw, gzip.open(gz_path, 'wb', compresslevel=6) as gz:
+            shutil.copyfileobj(raw, gz, 1024 * 1024)
+        os.replace(gz_path, os.path.join(backup_dir, name))
+    finally:
+        for path in (raw_path, gz_path):
+            if os.path.exists(path):
+                os.remove(path)
+    return stats
+
+def restore_db_backup(backup_dir, name, dest_path):
+    """Descompacta backup_dir/name, confere e copia para dentro de dest_path num passo só"""
+    raw_path = os.path.join(backup_dir, f'.{name}.restore')
+    try:
+        with gzip.open(os.path.join(backup_dir, name), 'rb') as gz, open(raw_path, 'wb') as raw:
+            shutil.copyfileobj(gz, raw, 1024 * 1024)
+        source = sqlite3.connect(raw_path)
+        try:
+            check = source.execute('PRAGMA quick_check').fetchone()[0]
+            if check != 'ok':
+                raise sqlite3.DatabaseError(f'backup failed quick_check: {check}')
+            dest = sqlite3.connect(dest_path, timeout=20.0)
+            try:
+                source.backup(dest)
+            finally:
+                dest.close()
+        finally:
+            source.close()
+    finally:
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+
+def backup_db(backup_dir=None, keep=None):
+    """Backup online do DB atual para BACKUP_DIR (.db.gz) + rotação. Retorna o resumo.
+
+    O arquivo de retenção (única cópia dos leads arquivados) vai junto, em
+    <nome>.archive.db.gz. Ordem: principal e depois arquivo. Um lote arquivado entre as duas
+    cópias aparece nos dois lados (a próxima rodada de retenção resolve), nunca em nenhum."""
+    backup_dir = backup_dir or get_backup_dir()
+    keep = BACKUP_KEEP if keep is None else keep
+    stem = os.path.splitext(os.path.basename(get_db_path()))[0]
+    name = f'{stem}-{datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S-%f")}.db.gz'
+    archive_name = None
+    started = time.perf_counter()
+    try:
+        with backup_dir_lock(backup_dir):
+            stats = write_db_backup(get_db_path(), backup_dir, name)
+            if os.path.exists(get_archive_db_path()):
+                archive_name = archive_backup_name(name)
+                try:
+                    write_db_backup(get_archive_db_path(), backup_dir, archive_name)
+                except BaseException:
+                    os.remove(os.path.join(backup_dir, name))  # Sem par não é backup
+                    raise
+            removed = [b['name'] for b in list_backups(backup_dir)[max(keep, 1):]]
+            for old in removed:
+                os.remove(os.path.join(backup_dir, old))
+                if os.path.exists(os.path.join(backup_dir, archive_backup_name(old))):
+                    os.remove(os.path.join(backup_dir, archive_backup_name(old)))
+    except BackupInProgress:
+        raise
+    except Exception:
+        get_metrics().inc('backups_total', status='error')
+        raise
+
+    duration = time.perf_counter() - started
+    metrics = get_metrics()
+    metrics.inc('backups_total', status='ok')
+    metrics.observe('backup_duration_seconds', duration)
+    result = {
+        'name': name,
+        'archive': archive_name,
+        'size': os.path.getsize(os.path.join(backup_dir, name)),
+        'duration': round(duration, 3),
+        'steps': stats['steps'],
+        'restarts': stats['restarts'],
+        'lock_held_max': round(stats['lock_max'], 4),
+        'lock_held_total': round(stats['lock_total'], 4),
+        'removed': removed,
+    }
+    logger.info(f'Backup {name} written in {duration:.2f}s ({stats["steps"]} steps, '
+                f'{stats["restarts"]} restarts, longest step {stats["lock_max"] * 1000:.1f}ms, '
+                f'archive {"included" if archive_name else "absent"}, {len(removed)} old backups removed)')
+    return result
+
+def restore_db(name, backup_dir=None):
+    """Troca o conteúdo do DB (e do arquivo de retenção) pelo de um backup. Antes faz um
+    backup do estado atual.
+
+    A cópia volta pela mesma API de backup, num passo só, para dentro do arquivo vivo: os
+    workers não precisam reabrir conexões (WAL e page size do DB atual ficam). Backup de um
+    schema antigo sai migrado (init_db). Backup sem .archive.db.gz é de quando não havia
+    arquivo: o arquivo atual fica vazio (o conteúdo dele está no backup de segurança).
+    Roda na CLI, fora dos workers: o hash do admin e o snapshot de leitura percebem a troca
+    pelo próprio DB, mas o LRU de idempotência e o stream SSE de cada worker só zeram
+    reiniciando os workers (kill -HUP no master do gunicorn)."""
+    backup_dir = backup_dir or get_backup_dir()
+    if not is_backup_name(name) or not os.path.exists(os.path.join(backup_dir, name)):
+        raise FileNotFoundError(f'Backup not found: {name}')
+    # Sem rotação aqui: o backup a restaurar pode ser justamente o mais velho
+    safety = backup_db(backup_dir, keep=len(list_backups(backup_dir)) + 1)
+    started = time.perf_counter()
+    archive_name = archive_backup_name(name)
+    with backup_dir_lock(backup_dir):
+        restore_db_backup(backup_dir, name, get_db_path())
+        if os.path.exists(os.path.join(backup_dir, archive_name)):
+            restore_db_backup(backup_dir, archive_name, get_archive_db_path())
+        elif os.path.exists(get_archive_db_path()):
+            archive = open_archive_db(get_archive_db_path())
+            try:
+                archive.execute('DELETE FROM archived_leads')
+                archive.commit()
+            finally:
+                archive.close()
+    init_db()
+    get_metrics().observe('backup_restore_seconds', time.perf_counter() - started)
+    logger.info(f'Database restored from {name} in {time.perf_counter() - started:.2f}s '
+                f'(previous state saved as {safety["name"]})')
+    return {'restored': name, 'safety_backup': safety['name']}
+
+@bp.cli.command('backup-db')
+@click.option('--keep', type=int, default=None, help='Backups mantidos (default: BACKUP_KEEP)')
+def backup_db_command(keep):
+    """Backup online do DB para BACKUP_DIR: flask --app app backup-db"""
+    try:
+        result = backup_db(keep=keep)
+    finally:
+        flush_metrics()  # Agendador roda isto num subprocesso: métricas vão pro /metrics
+    click.echo(f'{result["name"]} written to {get_backup_dir()} in {result["duration"]:.2f}s '
+               f'(longest step {result["lock_held_max"] * 1000:.1f}ms, {len(result["removed"])} rotated out)')
+
+@bp.cli.command('list-backups')
+def list_backups_command():
+    """Lista os backups do DB: flask --app app list-backups"""
+    for backup in list_backups():
+        click.echo(f'{backup["name"]}  {backup["size"]:>12}  {backup["created_at"]}'
+                   f'{"  +archive" if backup["archive"] else ""}')
+
+@bp.cli.command('restore-db')
+@click.argument('name')
+@click.confirmation_option(prompt='Replace the current database with this backup?')
+def restore_db_command(name):
+    """Restaura um backup (nome do list-backups): flask --app app restore-db NOME"""
+    result = restore_db(name)
+    click.echo(f'Restored {result["restored"]} (previous state saved as {result["safety_backup"]})')
+    click.echo('Restart the workers to drop their in-memory caches: kill -HUP <gunicorn master pid>')
+
+# API: Backups (protegido) - listar e disparar. Restore só pela CLI: troca o DB inteiro.
+@bp.route('/api/backups', methods=['GET'])
+@login_required
+def get_backups():
+    try:
+        return jsonify({'backups': list_backups()}), 200
+    except OSError as e:
+        logger.error(f'Failed to list backups: {e}')
+        return jsonify({'error': 'Internal server error'}), 500
+
+@bp.route('/api/backups', methods=['POST'])
+@login_required
+def create_backup():
+    try:
+        result = backup_db()
+        logger.info(f'Backup requested by user {session.get("username")}')
+        return jsonify(dict(result, success=True)), 201
+    except BackupInProgress as e:
+        return jsonify({'error': str(e)}), 409
+    except sqlite3.OperationalError as e:
+        logger.error(f'Database operational error during backup: {e}')
+        return jsonify({'error': 'Database temporarily unavailable'}), 503
+    except sqlite3.Error as e:
+        logger.error(f'Database error during backup: {e}')
+        return jsonify({'error': 'Database error'}), 500
+    except Exception as e:
+        logger.error(f'Unexpected error during backup: {e}', exc_info=True)
+        return jsonify({'error': 'Internal server error'}), 500
+
+# Verificação de senha fora da thread do request.
+# PBKDF2 segura o GIL por dezenas de ms: num pool de processos uma rajada de logins
+# não trava o create_lead. Pool limitado + fila curta; cheio = 503 na hora.
+PASSWORD_EXECUTOR = os.environ.get('PASSWORD_EXECUTOR', 'process')  # process | thread
+PASSWORD_WORKERS = int(os.environ.get('PASSWORD_WORKERS', '2'))
+PASSWORD_MAX_PENDING = int(os.environ.get('PASSWORD_MAX_PENDING', '8'))
+PASSWORD_TIMEOUT = float(os.environ.get('PASSWORD_TIMEOUT', '5'))
+ADMIN_CACHE_TTL = float(os.environ.get('ADMIN_CACHE_TTL', '5'))
+
+class PasswordVerifierBusy(Exception):
+    """Pool de verificação saturado"""
+
+class PasswordVerifier:
+    """check_password_hash num executor com no máximo max_pending verificações em voo"""
+
+    def __init__(self, kind, workers, max_pending):
+        if kind == 'process':
+            # spawn: fork de processo com threads (pool, writer, SSE) pode herdar lock travado
+            self._executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+        else:
+            self._executor = ThreadPoolExecutor(workers, thread_name_prefix='password')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self.pid = os.getpid()
+        self.broken = False
+
+    def verify(self, password_hash, password, timeout):
+        """Retorna True/False; PasswordVerifierBusy se não há vaga (ou o pool quebrou)"""
+        if not self._slots.acquire(blocking=False):
+            raise PasswordVerifierBusy()
+        try:
+            future = self._executor.submit(check_password_hash, password_hash, password)
+        except BrokenExecutor as e:
+            self._slots.release()
+            raise self._mark_broken(e) from e
+        except BaseException:
+            self._slots.release()
+            raise
+        # Vaga só volta quando o worker termina, mesmo que o request desista antes
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=timeout)
+        except BrokenExecutor as e:
+            raise self._mark_broken(e) from e
+
+    def _mark_broken(self, error):
+        """Processo do pool morreu (OOM, kill): o executor não se recupera, o próximo login cria outro"""
+        logger.error(f'Password verifier pool broken, recreating: {error}')
+        self.broken = True
+        return PasswordVerifierBusy()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+_password_verifier = None
+_password_verifier_lock = threading.Lock()
+
+def get_password_verifier():
+    """Executor do processo atual (um por pid, como o pool e o writer)"""
+    global _password_verifier
+    verifier = _password_verifier
+    if verifier is not None and verifier.pid == os.getpid() and not verifier.broken:
+        return verifier
+    with _password_verifier_lock:
+        if _password_verifier is None or _password_verifier.pid != os.getpid() or _password_verifier.broken:
+            if _password_verifier is not None and _password_verifier.pid == os.getpid():
+                _password_verifier.shutdown()
+            _password_verifier = PasswordVerifier(PASSWORD_EXECUTOR, PASSWORD_WORKERS, PASSWORD_MAX_PENDING)
+        return _password_verifier
+
+def stop_password_verifier():
+    global _password_verifier
+    with _password_verifier_lock:
+        if _password_verifier is not None and _password_verifier.pid == os.getpid():
+            _password_verifier.shutdown()
+        _password_verifier = None
+
+atexit.register(stop_password_verifier)
+
+# Cache de admin_users: (DB, username) -> (hash, expira_em). Só usuários que existem entram
+# (username aleatório não enche o cache). Acerto não toca o DB. Troca de senha neste processo
+# invalida na hora; nos outros workers o hash antigo vale no máximo ADMIN_CACHE_TTL segundos.
+_admin_cache = {}
+_admin_cache_lock = threading.Lock()
+
+def get_admin_password_hash(conn, username):
+    now = time.monotonic()
+    key = (get_db_path(), username)
+    with _admin_cache_lock:
+        cached = _admin_cache.get(key)
+    if cached and cached[1] > now:
+        return cached[0]
+    row = conn.execute('SELECT password_hash FROM admin_users WHERE username = ?', (username,)).fetchone()
+    if row is None:
+        return None
+    with _admin_cache_lock:
+        _admin_cache[key] = (row[0], now + ADMIN_CACHE_TTL)
+    return row[0]
+
+def invalidate_admin_cache(username=None):
+    with _admin_cache_lock:
+        if username is None:
+            _admin_cache.clear()
+        else:
+            _admin_cache.pop((get_db_path(), username), None)
+
+def set_admin_password(conn, username, password):
+    """Cria ou troca a senha de um admin e invalida o cache deste processo"""
+    conn.execute(
+        'INSERT INTO admin_users (username, password_hash) VALUES (?, ?) '
+        'ON CONFLICT(username) DO UPDATE SET password_hash = excluded.password_hash',
+        (username, generate_password_hash(password))
+    )
+    conn.commit()
+    invalidate_admin_cache(username)
+
+@bp.cli.command('set-password')
+@click.argument('username')
+@click.password_option()
+def set_password_command(username, password):
+    """Cria ou troca a senha de um admin: flask --app app set-password USERNAME"""
+    with db_connection() as conn:
+        set_admin_password(conn, username, password)
+    click.echo(f'Password updated for {username}')
+
 # Login
-@app.route('/api/login', methods=['POST'])
+@bp.route('/api/login', methods=['POST'])
+@rate_limited('login')
 def login():
     data = request.get_json()
     username = data.get('username', '').strip()
@@ -227,21 +3050,21 @@ def login():
         return jsonify({'error': 'Username and password required'}), 400
     
     try:
-        conn = get_db_connection()
-        try:
-            cursor = conn.execute('SELECT password_hash FROM admin_users WHERE username = ?', (username,))
-            row = cursor.fetchone()
-            
-            if row and check_password_hash(row[0], password):
-                session['logged_in'] = True
-                session['username'] = username
-                logger.info(f'Login successful: {username}')
-                return jsonify({'success': True}), 200
-            else:
-                logger.warning(f'Login failed: Invalid credentials for {username}')
-                return jsonify({'error': 'Invalid credentials'}), 401
-        finally:
-            conn.close()
+        with db_connection() as conn:
+            password_hash = get_admin_password_hash(conn, username)
+
+        # Conexão já devolvida ao pool: o hash roda sem segurar recurso do DB
+        if password_hash and get_password_verifier().verify(password_hash, password, PASSWORD_TIMEOUT):
+            session['logged_in'] = True
+            session['username'] = username
+            logger.info(f'Login successful: {username}')
+            return jsonify({'success': True}), 200
+        else:
+            logger.warning(f'Login failed: Invalid credentials for {username}')
+            return jsonify({'error': 'Invalid credentials'}), 401
+    except (PasswordVerifierBusy, FutureTimeout):
+        logger.warning(f'Login rejected: password verifier saturated ({username})')
+        return jsonify({'error': 'Too many login attempts, try again'}), 503, {'Retry-After': '1'}
     except sqlite3.OperationalError as e:
         logger.error(f'Database operational error during login: {e}')
         return jsonify({'error': 'Database temporarily unavailable'}), 503
@@ -253,7 +3076,7 @@ def login():
         return jsonify({'error': 'Internal server error'}), 500
 
 # Logout
-@app.route('/api/logout', methods=['POST'])
+@bp.route('/api/logout', methods=['POST'])
 @login_required
 def logout():
     username = session.get('username', 'unknown')
@@ -261,8 +3084,108 @@ def logout():
     logger.info(f'Logout: {username}')
     return jsonify({'success': True}), 200
 
+# Métricas por request: rota (regra do Flask, não a URL - cardinalidade fixa), status,
+# latência do handler e tempo gasto no SQLite
+@bp.before_app_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    _db_time.seconds = 0.0
+
+@bp.after_app_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics = get_metrics()
+        metrics.inc('http_requests_total', method=request.method, route=route,
+                    status=str(response.status_code))
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - started,
+                        method=request.method, route=route)
+        metrics.observe('http_request_db_seconds', getattr(_db_time, 'seconds', 0.0), route=route)
+    # Leitura servida pelo snapshot em memória: cliente sabe quão velhos podem estar os dados
+    snapshot_age = g.get('snapshot_age')
+    if snapshot_age is not None:
+        response.headers['X-Snapshot-Age'] = f'{snapshot_age:.3f}'
+    return response
+
+def metrics_gauges():
+    depth = sum(writer.depth() for writer in list(_lead_writers.values()) if writer.pid == os.getpid())
+    return {'lead_ingest_queue_depth': depth}
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def collect_metric_snapshots():
+    """Com METRICS_DIR: grava o snapshot deste worker e soma só os arquivos (dele, dos outros
+    workers e dos encerrados). Ao vivo + arquivo dos outros não serve: scrapes seguidos caem em
+    workers diferentes e a soma podia diminuir (o Prometheus vê um reset falso). Cada arquivo
+    só anda para frente, então a soma dos arquivos nunca diminui."""
+    metrics = get_metrics()
+    if not METRICS_DIR:
+        return [dict(metrics.snapshot(), gauges=metrics_gauges())]
+    write_metrics_snapshot(metrics)
+    snapshots = []
+    with metrics_dir_lock(fcntl.LOCK_SH):
+        for filename in os.listdir(METRICS_DIR):
+            if not filename.endswith('.json'):
+                continue
+            snapshot = read_metrics_file(os.path.join(METRICS_DIR, filename))
+            if snapshot is None:
+                continue
+            # Worker morto sem shutdown (SIGKILL): contadores valem, gauge não
+            if 'pid' in snapshot and not pid_alive(snapshot['pid']):
+                snapshot.pop('gauges', None)
+            snapshots.append(snapshot)
+    return snapshots
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{escape_label(value)}"' for key, value in pairs) + '}'
+
+def render_metrics(merged):
+    """Formato texto do Prometheus (exposition format 0.0.4)"""
+    series = {}
+    for (name, labels), value in sorted(merged['counters'].items()):
+        series.setdefault(name, []).append(f'{name}{format_labels(labels)} {value}')
+    for (name, labels), (counts, total) in sorted(merged['histograms'].items()):
+        lines = series.setdefault(name, [])
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{format_labels(labels, [("le", bound)])} {cumulative}')
+        lines.append(f'{name}_sum{format_labels(labels)} {total}')
+        lines.append(f'{name}_count{format_labels(labels)} {cumulative}')
+    for name, value in merged['gauges'].items():
+        series.setdefault(name, []).append(f'{name} {value}')
+
+    output = []
+    for name in sorted(series):
+        metric_type, help_text = METRIC_HELP.get(name, ('untyped', name))
+        output.append(f'# HELP {name} {help_text}')
+        output.append(f'# TYPE {name} {metric_type}')
+        output.extend(series[name])
+    return '\n'.join(output) + '\n'
+
+# Métricas Prometheus - sem login (scraper), e o nginx não expõe: só /api e /admin passam
+@bp.route('/metrics')
+def metrics_endpoint():
+    body = render_metrics(merge_metric_snapshots(collect_metric_snapshots()))
+    return Response(body, mimetype='text/plain; version=0.0.4; charset=utf-8',
+                    headers={'Cache-Control': 'no-store'})
+
 # Healthcheck
-@app.route('/health')
+@bp.route('/health')
 def health():
     logger.debug('Health check')
     return jsonify({'status': 'ok'}), 200
@@ -583,9 +3506,14 @@ ADMIN_HTML = '''<!DOCTYPE html>
                             Leads Recentes <span id="leads-count-badge"
                                 class="text-sm font-inter font-normal text-gray-400 bg-[#1a1a1a] px-2 py-0.5 rounded-full">0</span>
                         </h2>
-                        <button onclick="app.setFilter('all')"
-                            class="text-xs font-bold text-gray-400 hover:text-white px-3 py-1.5 rounded-full hover:bg-[#1a1a1a] transition-colors">Ver
-                            todos</button>
+                        <div class="flex items-center gap-2">
+                            <input id="lead-search" type="search" placeholder="Buscar nome, email, mensagem..."
+                                oninput="app.onSearch(this.value)"
+                                class="bg-[#1a1a1a] text-sm text-white placeholder-gray-500 px-4 py-1.5 rounded-full border border-white/5 focus:border-[#d4af37]/40 outline-none w-64">
+                            <button onclick="app.setFilter('all')"
+                                class="text-xs font-bold text-gray-400 hover:text-white px-3 py-1.5 rounded-full hover:bg-[#1a1a1a] transition-colors">Ver
+                                todos</button>
+                        </div>
                     </div>
 
                     <div class="bg-[#141414] rounded-[2rem] overflow-hidden border border-white/5">
@@ -604,6 +3532,11 @@ ADMIN_HTML = '''<!DOCTYPE html>
                             </tbody>
                         </table>
                     </div>
+                    <div class="flex justify-center">
+                        <button id="load-more" onclick="app.loadMore()"
+                            class="hidden text-xs font-bold text-gray-400 hover:text-white px-4 py-2 rounded-full bg-[#1a1a1a] hover:bg-[#252525] transition-colors">Carregar
+                            mais</button>
+                    </div>
                 </div>
             </div>
 
@@ -625,8 +3558,19 @@ ADMIN_HTML = '''<!DOCTYPE html>
         // --- GRUG STATE ---
         const state = {
             leads: [],
+            nextCursor: null,
+            loadingMore: false,
+            maxId: 0,
+            changes: 0,
+            etag: null,
+            stats: null,
+            stream: null,
+            pollTimer: null,
             filter: 'hoje',
-            activeLead: null
+            query: '',
+            searchTimer: null,
+            activeLead: null,
+            details: new Map() // id -> lead completo (GET /api/leads/<id>), preenchido pelo drawer
         };
 
         // --- GRUG APP LOGIC ---
@@ -658,7 +3602,9 @@ ADMIN_HTML = '''<!DOCTYPE html>
                 }
                 
                 app.loadLeads();
-                setInterval(app.loadLeads, 30000); // Atualizar a cada 30s
+                app.loadStats();
+                app.connectStream(); // Push via SSE; polling só se o stream cair
+                setInterval(app.loadStats, 30000);
             },
 
             injectCalendly: () => {
@@ -673,8 +3619,12 @@ ADMIN_HTML = '''<!DOCTYPE html>
                 head.appendChild(css);
             },
 
+            // Valores fixos do <select> do site: mostra a faixa, não um número inventado
+            budgetLabels: { '10k-50k': 'R$ 10k - 50k', 'custom': 'Projeto Especial +50k' },
+
             formatCurrency: (val) => {
                 if (!val || val === '-') return '-';
+                if (app.budgetLabels[val]) return app.budgetLabels[val];
                 if (typeof val === 'number') {
                     return new Intl.NumberFormat('pt-BR', { style: 'currency', currency: 'BRL' }).format(val);
                 }
@@ -702,12 +3652,12 @@ ADMIN_HTML = '''<!DOCTYPE html>
                         btn.classList.remove('bg-[#1a1a1a]');
                     }
                 });
-                app.render();
+                // Filtro roda no servidor (SQL indexado), então recarrega a lista
+                app.loadLeads();
             },
 
             openWhatsApp: (lead) => {
-                const phoneMatch = String(lead.contact || lead.email || '').match(/([0-9]{10,15})/);
-                const phone = phoneMatch ? phoneMatch[1] : '';
+                const phone = lead.phone || '';
                 if (!phone) {
                     app.showToast('Telefone não encontrado', 'error');
                     return;
@@ -733,46 +3683,17 @@ ADMIN_HTML = '''<!DOCTYPE html>
                 }, 500);
             },
 
+            // Export gerado no servidor em streaming (mês atual), não a partir de state.leads
             exportCSV: () => {
-                if (state.leads.length === 0) {
-                    app.showToast('Nenhum lead para exportar', 'error');
-                    return;
-                }
-                
-                function escapeCSV(val) {
-                    if (!val) return '';
-                    const str = String(val);
-                    if (str.includes(',') || str.includes('"') || str.includes('\n')) {
-                        return '"' + str.replace(/"/g, '""') + '"';
-                    }
-                    return str;
-                }
-                
-                const headers = ['ID', 'Nome', 'Email', 'Contato', 'Mensagem', 'Orçamento', 'Tipo', 'Data'];
-                const rows = state.leads.map(l => [
-                    l.id,
-                    escapeCSV(l.name),
-                    escapeCSV(l.email || ''),
-                    escapeCSV(l.contact || ''),
-                    escapeCSV(l.message || ''),
-                    escapeCSV(l.budget || ''),
-                    escapeCSV(l.form_type || ''),
-                    new Date(l.created_at).toLocaleDateString('pt-BR')
-                ]);
-                
-                const csvContent = [headers.map(escapeCSV), ...rows].map(row => row.join(',')).join('\n');
-                const blob = new Blob(['\ufeff' + csvContent], { type: 'text/csv;charset=utf-8;' });
+                const now = new Date();
+                const from = `${now.getFullYear()}-${String(now.getMonth() + 1).padStart(2, '0')}-01`;
                 const link = document.createElement('a');
-                const url = URL.createObjectURL(blob);
-                link.setAttribute('href', url);
-                link.setAttribute('download', `leads-gui-${new Date().toISOString().split('T')[0]}.csv`);
+                link.setAttribute('href', `/api/leads/export?format=csv&from=${from}`);
                 link.style.visibility = 'hidden';
                 document.body.appendChild(link);
                 link.click();
                 document.body.removeChild(link);
-                URL.revokeObjectURL(url);
-                
-                app.showToast('CSV exportado com sucesso!', 'success');
+                app.showToast('Exportação iniciada!', 'success');
             },
 
             showToast: (msg, type) => {
@@ -802,10 +3723,10 @@ ADMIN_HTML = '''<!DOCTYPE html>
                 drawer.classList.remove('translate-x-full');
                 backdrop.classList.remove('hidden');
 
-                const phoneMatch = String(lead.contact || lead.email || '').match(/([0-9]{10,15})/);
-                const phone = phoneMatch ? phoneMatch[1] : '';
+                const phone = lead.phone || '';
                 const value = lead.budget ? app.formatCurrency(lead.budget) : 'A definir';
-                const notes = lead.message || 'Sem observações.';
+                // Lead do resumo ainda sem message: openLead redesenha quando o completo chegar
+                const notes = lead.message === undefined ? 'Carregando briefing...' : (lead.message || 'Sem observações.');
 
                 content.innerHTML = `
                     <div class="p-8 flex items-center justify-between border-b border-white/5">
@@ -820,10 +3741,10 @@ ADMIN_HTML = '''<!DOCTYPE html>
                           <p class="text-gray-500 text-xs uppercase tracking-widest mb-2">Valor do Projeto</p>
                           <h3 class="text-5xl font-syne font-bold text-[#d4af37] mb-6">${value}</h3>
                           <div class="grid grid-cols-1 gap-3">
-                            ${phone ? `<button onclick='app.openWhatsApp(${JSON.stringify(lead)})' class="w-full py-4 bg-[#25D366] text-black font-bold rounded-xl flex items-center justify-center gap-3 hover:scale-[1.02] transition-transform shadow-lg shadow-green-900/20">
+                            ${phone ? `<button onclick="app.openWhatsApp(state.activeLead)" class="w-full py-4 bg-[#25D366] text-black font-bold rounded-xl flex items-center justify-center gap-3 hover:scale-[1.02] transition-transform shadow-lg shadow-green-900/20">
                                <i data-lucide="message-circle" class="w-5 h-5"></i> Conversar no WhatsApp
                             </button>` : ''}
-                            <button onclick='app.openCalendly(${JSON.stringify(lead)})' class="w-full py-4 bg-[#1a1a1a] text-white border border-white/10 font-bold rounded-xl flex items-center justify-center gap-3 hover:bg-[#252525] transition-colors">
+                            <button onclick="app.openCalendly(state.activeLead)" class="w-full py-4 bg-[#1a1a1a] text-white border border-white/10 font-bold rounded-xl flex items-center justify-center gap-3 hover:bg-[#252525] transition-colors">
                                <i data-lucide="calendar-days" class="w-5 h-5"></i> Marcar Reunião Agora
                             </button>
                           </div>
@@ -837,6 +3758,34 @@ ADMIN_HTML = '''<!DOCTYPE html>
                 if (window.initLucide) window.initLucide();
             },
 
+            findLead: (id) => state.leads.find(l => l.id === id),
+
+            // A lista vem em summary (sem message): o drawer abre na hora com o resumo e o
+            // lead completo chega de GET /api/leads/<id> - uma vez por lead, depois sai do cache
+            openLead: async (id) => {
+                const lead = state.details.get(id) || app.findLead(id);
+                if (!lead) return;
+                app.openDrawer(lead);
+                if (state.details.has(id)) return;
+                try {
+                    const res = await fetch(`/api/leads/${id}`, { cache: 'no-store' });
+                    if (!res.ok) {
+                        if (res.status === 401) window.location.reload();
+                        if (res.status === 404) {
+                            app.closeDrawer();
+                            app.showToast('Lead não encontrado', 'error');
+                        }
+                        return;
+                    }
+                    const full = app.normalizeLead(await res.json());
+                    state.details.set(id, full);
+                    // Drawer pode ter sido fechado (ou trocado de lead) enquanto carregava
+                    if (state.activeLead && state.activeLead.id === id) app.openDrawer(full);
+                } catch (error) {
+                    console.error('Erro ao carregar lead:', error);
+                }
+            },
+
             closeDrawer: () => {
                 state.activeLead = null;
                 document.getElementById('drawer').classList.add('translate-x-full');
@@ -850,9 +3799,69 @@ ADMIN_HTML = '''<!DOCTYPE html>
                 return div.innerHTML;
             },
 
+            normalizeLead: (lead) => ({
+                ...lead,
+                timestamp: new Date(lead.created_at).getTime(),
+                source: lead.form_type === 'modal' ? 'form' : (lead.form_type || 'form'),
+                phone: lead.phone || '',
+                value: (lead.budget_cents || 0) / 100,
+                notes: lead.message || '',
+                contacted: false
+            }),
+
+            // Query da lista com o filtro ativo
+            listParams: (extra) => {
+                const params = new URLSearchParams(extra);
+                params.set('view', 'summary'); // Só as colunas da tabela; detalhe vem por lead
+                if (state.filter !== 'all') params.set('filter', state.filter);
+                return params;
+            },
+
+            // Com busca ativa a lista vem do índice full-text (ranqueada), senão da lista cronológica
+            listUrl: (params) => {
+                if (!state.query) return `/api/leads?${params}`;
+                params.set('q', state.query);
+                return `/api/leads/search?${params}`;
+            },
+
+            // Busca no servidor com debounce (Grug não dispara request a cada tecla)
+            onSearch: (value) => {
+                clearTimeout(state.searchTimer);
+                state.searchTimer = setTimeout(() => {
+                    const query = value.trim();
+                    if (query === state.query) return;
+                    state.query = query;
+                    app.loadLeads();
+                }, 300);
+            },
+
+            // Uma página de leads; cursor = null busca a primeira
+            fetchPage: async (cursor) => {
+                const params = app.listParams({ limit: '50' });
+                if (cursor) params.set('cursor', cursor);
+                const res = await fetch(app.listUrl(params), { cache: 'no-store' });
+                if (!res.ok) {
+                    if (res.status === 401) {
+                        window.location.reload();
+                        return null;
+                    }
+                    app.showToast('Erro ao carregar leads', 'error');
+                    return null;
+                }
+                return res.json();
+            },
+
+            // Guarda o validador da lista para o polling condicional
+            trackVersion: (data, res) => {
+                state.maxId = data.max_id;
+                state.changes = data.changes;
+                state.etag = res.headers.get('ETag');
+            },
+
             loadLeads: async () => {
                 try {
-                    const res = await fetch('/api/leads');
+                    const params = app.listParams({ limit: '50' });
+                    const res = await fetch(app.listUrl(params), { cache: 'no-store' });
                     if (!res.ok) {
                         if (res.status === 401) {
                             window.location.reload();
@@ -862,15 +3871,12 @@ ADMIN_HTML = '''<!DOCTYPE html>
                         return;
                     }
                     const data = await res.json();
-                    state.leads = (data.leads || []).map(lead => ({
-                        ...lead,
-                        timestamp: new Date(lead.created_at).getTime(),
-                        source: lead.form_type === 'modal' ? 'form' : (lead.form_type || 'form'),
-                        phone: lead.contact || lead.email || '',
-                        value: lead.budget ? parseFloat(String(lead.budget).replace(/[^0-9,]/g, '').replace(',', '.')) || 0 : 0,
-                        notes: lead.message || '',
-                        contacted: false
-                    }));
+                    state.leads = (data.leads || []).map(app.normalizeLead);
+                    state.details.clear();
+                    state.nextCursor = data.next_cursor;
+                    // Resultado de busca não tem validador de versão: polling espera a busca acabar
+                    if (state.query) state.etag = null;
+                    else app.trackVersion(data, res);
                     app.render();
                 } catch (error) {
                     console.error('Erro ao carregar leads:', error);
@@ -878,30 +3884,155 @@ ADMIN_HTML = '''<!DOCTYPE html>
                 }
             },
 
-            render: () => {
-                // Filtra Leads
-                const filtered = state.leads.filter(l => {
-                    const diff = Date.now() - l.timestamp;
-                    if (state.filter === 'hoje') return diff < 86400000;
-                    if (state.filter === 'quentes') return diff < 7200000; // 2h
-                    if (state.filter === 'whatsapp') {
-                        const phoneMatch = String(l.contact || l.email || '').match(/([0-9]{10,15})/);
-                        return phoneMatch !== null;
+            // KPIs agregados no servidor - não dependem de quantos leads foram baixados
+            loadStats: async () => {
+                try {
+                    const res = await fetch('/api/leads/stats', { cache: 'no-store' });
+                    if (!res.ok) return;
+                    state.stats = await res.json();
+                    app.renderStats();
+                    app.loadTrend();
+                } catch (error) {
+                    console.error('Erro ao carregar KPIs:', error);
+                }
+            },
+
+            // Tendência do faturamento: últimos 30 dias vs os 30 anteriores (rollups diárias)
+            loadTrend: async () => {
+                const from = new Date(Date.now() - 59 * 86400000).toISOString().slice(0, 10);
+                try {
+                    const res = await fetch(`/api/leads/timeseries?bucket=day&from=${from}`, { cache: 'no-store' });
+                    if (!res.ok) return;
+                    const { series } = await res.json();
+                    const sum = (points) => points.reduce((total, p) => total + p.total_value_cents, 0);
+                    const current = sum(series.slice(-30));
+                    const previous = sum(series.slice(0, -30));
+                    const el = document.getElementById('kpi-trend');
+                    if (!previous) {
+                        el.innerText = current ? 'novo' : '+0%';
+                        return;
+                    }
+                    const change = Math.round((current - previous) / previous * 100);
+                    el.innerText = `${change >= 0 ? '+' : ''}${change}%`;
+                } catch (error) {
+                    console.error('Erro ao carregar tendência:', error);
+                }
+            },
+
+            renderStats: () => {
+                const stats = state.stats || { total_value: 0, total_leads: 0, urgent_leads: 0 };
+                document.getElementById('kpi-total').innerText = app.formatCurrency(stats.total_value);
+                document.getElementById('kpi-count').innerText = stats.total_leads;
+                document.getElementById('kpi-urgent').innerText = `${stats.urgent_leads} urgentes`;
+            },
+
+            // Stream SSE: lead novo/deletado chega na hora. EventSource reenvia Last-Event-ID sozinho.
+            connectStream: () => {
+                if (!window.EventSource) return app.startPolling();
+                const stream = new EventSource('/api/leads/stream');
+                state.stream = stream;
+                stream.onopen = () => app.stopPolling();
+                stream.onerror = () => {
+                    // CONNECTING = reconexão automática em andamento; CLOSED = desistiu (ex: 503)
+                    if (stream.readyState === EventSource.CLOSED) {
+                        app.startPolling();
+                        setTimeout(app.connectStream, 60000);
+                    }
+                };
+                stream.addEventListener('lead_created', (e) => {
+                    const lead = JSON.parse(e.data);
+                    // Com busca ativa a lista é ranqueada: lead novo só entra na próxima busca
+                    if (state.filter === 'all' && !state.query) {
+                        if (!state.leads.some(l => l.id === lead.id)) {
+                            state.leads.unshift(app.normalizeLead(lead));
+                            app.render();
+                        }
+                    } else {
+                        app.pollLeads(); // Filtro roda no servidor
                     }
-                    return true;
+                    app.showToast(`Novo lead: ${app.escapeHtml(lead.name)}`, 'success');
+                    app.loadStats();
                 });
+                stream.addEventListener('lead_deleted', (e) => {
+                    const { id } = JSON.parse(e.data);
+                    state.leads = state.leads.filter(l => l.id !== id);
+                    state.details.delete(id);
+                    app.render();
+                    app.loadStats();
+                });
+                stream.addEventListener('reset', () => {
+                    app.loadLeads();
+                    app.loadStats();
+                });
+            },
 
-                // Atualiza KPIs
-                const totalValue = state.leads.reduce((acc, l) => acc + (l.value || 0), 0);
-                const quentesCount = state.leads.filter(l => {
-                    const diff = Date.now() - l.timestamp;
-                    return diff < 7200000; // 2h
-                }).length;
-                
-                document.getElementById('kpi-total').innerText = app.formatCurrency(totalValue);
-                document.getElementById('kpi-count').innerText = state.leads.length;
-                document.getElementById('kpi-urgent').innerText = `${quentesCount} urgentes`;
+            startPolling: () => {
+                if (!state.pollTimer) state.pollTimer = setInterval(app.pollLeads, 30000);
+            },
+
+            stopPolling: () => {
+                if (state.pollTimer) clearInterval(state.pollTimer);
+                state.pollTimer = null;
+            },
+
+            // Polling: 304 se nada mudou; senão só os leads novos (since_id) entram em state.leads
+            pollLeads: async () => {
+                if (state.query) return;
+                if (!state.etag) return app.loadLeads();
+                try {
+                    const params = app.listParams({ since_id: String(state.maxId), limit: '200' });
+                    const res = await fetch(`/api/leads?${params}`, {
+                        cache: 'no-store',
+                        headers: { 'If-None-Match': state.etag }
+                    });
+                    if (res.status === 304) return;
+                    if (!res.ok) {
+                        if (res.status === 401) window.location.reload();
+                        return;
+                    }
+                    const data = await res.json();
+                    const fresh = (data.leads || []).map(app.normalizeLead);
+                    // Mudança que não é lead novo (ex: delete) ou delta grande demais: recarrega
+                    if (data.next_cursor || data.changes !== state.changes + fresh.length) {
+                        return app.loadLeads();
+                    }
+                    if (fresh.length > 0) {
+                        const known = new Set(state.leads.map(l => l.id));
+                        state.leads = fresh.filter(l => !known.has(l.id)).concat(state.leads);
+                        app.render();
+                    }
+                    app.trackVersion(data, res);
+                } catch (error) {
+                    console.error('Erro ao atualizar leads:', error);
+                }
+            },
+
+            // Próxima página só quando o usuário pede (Grug não baixa tudo)
+            loadMore: async () => {
+                if (!state.nextCursor || state.loadingMore) return;
+                state.loadingMore = true;
+                try {
+                    const data = await app.fetchPage(state.nextCursor);
+                    if (!data) return;
+                    state.leads = state.leads.concat((data.leads || []).map(app.normalizeLead));
+                    state.nextCursor = data.next_cursor;
+                    app.render();
+                } catch (error) {
+                    console.error('Erro ao carregar leads:', error);
+                    app.showToast('Erro ao carregar leads', 'error');
+                } finally {
+                    state.loadingMore = false;
+                }
+            },
+
+            render: () => {
+                // Leads já vêm filtrados do servidor (?filter=)
+                const filtered = state.leads;
+
+                // Atualiza KPIs (vêm prontos de /api/leads/stats)
+                app.renderStats();
                 document.getElementById('leads-count-badge').innerText = filtered.length;
+                document.getElementById('load-more').classList.toggle('hidden', !state.nextCursor);
 
                 // Renderiza Tabela (O jeito Grug: innerHTML limpo)
                 const tbody = document.getElementById('leads-table-body');
@@ -910,10 +4041,9 @@ ADMIN_HTML = '''<!DOCTYPE html>
                 } else {
                     tbody.innerHTML = filtered.map(lead => {
                         const temp = app.getTemperature(lead.created_at);
-                        const phoneMatch = String(lead.contact || lead.email || '').match(/([0-9]{10,15})/);
-                        const hasPhone = phoneMatch !== null;
+                        const hasPhone = Boolean(lead.phone);
                         return `
-                            <tr class="group cursor-pointer hover:bg-white/[0.02] transition-colors border-b border-white/5 last:border-0" onclick='app.openDrawer(${JSON.stringify(lead)})'>
+                            <tr class="group cursor-pointer hover:bg-white/[0.02] transition-colors border-b border-white/5 last:border-0" onclick="app.openLead(${lead.id})">
                                 <td class="p-6 pl-8">
                                     <div class="flex items-center gap-3">
                                         <div class="w-10 h-10 rounded-full flex items-center justify-center font-bold text-xs relative bg-neon-pink-10 text-neon-pink">
@@ -937,7 +4067,7 @@ ADMIN_HTML = '''<!DOCTYPE html>
                                 </td>
                                 <td class="p-6 font-mono text-gray-300">${lead.budget ? app.formatCurrency(lead.budget) : '-'}</td>
                                 <td class="p-6 text-right pr-8">
-                                    ${hasPhone ? `<button onclick='event.stopPropagation(); app.openWhatsApp(${JSON.stringify(lead)})' class="w-10 h-10 rounded-full border border-white/10 flex items-center justify-center text-gray-400 hover:text-neon-green hover:border-neon-green hover:bg-neon-green-10 transition-all ml-auto">
+                                    ${hasPhone ? `<button onclick="event.stopPropagation(); app.openWhatsApp(app.findLead(${lead.id}))" class="w-10 h-10 rounded-full border border-white/10 flex items-center justify-center text-gray-400 hover:text-neon-green hover:border-neon-green hover:bg-neon-green-10 transition-all ml-auto">
                                         <i data-lucide="message-circle" class="w-4 h-4"></i>
                                     </button>` : '<span class="text-gray-500 text-xs">-</span>'}
                                 </td>
@@ -957,14 +4087,105 @@ ADMIN_HTML = '''<!DOCTYPE html>
 </body>
 
 </html>'''
+# Páginas inline renderizadas uma vez: bytes, ETag forte e variantes gzip/brotli ficam em memória.
+# O HTML não muda entre requests, então Jinja compilar 30 KB a cada hit é desperdício.
+class CachedPage:
+    """Template renderizado + variantes comprimidas, prontos para servir"""
+
+    def __init__(self, html):
+        body = current_app.jinja_env.from_string(html).render().encode('utf-8')
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.variants = {'identity': (body, digest)}
+        self.variants['gzip'] = (gzip.compress(body, compresslevel=9, mtime=0), f'{digest}-gz')
+        if brotli is not None:
+            self.variants['br'] = (brotli.compress(body, quality=11), f'{digest}-br')
+
+    def pick(self, accept_encodings):
+        """Melhor encoding que o cliente aceita: br > gzip > sem compressão"""
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and accept_encodings[encoding]:
+                return encoding
+        return 'identity'
+
+_cached_pages = {}
+_cached_pages_lock = threading.Lock()
+
+def get_cached_page(name, html):
+    page = _cached_pages.get(name)
+    if page is None:
+        with _cached_pages_lock:
+            page = _cached_pages.get(name)
+            if page is None:
+                page = _cached_pages[name] = CachedPage(html)
+    return page
+
+def serve_cached_page(name, html):
+    page = get_cached_page(name, html)
+    encoding = page.pick(request.accept_encodings)
+    body, etag = page.variants[encoding]
+    if request.if_none_match.contains_weak(etag):  # nginx pode ter enfraquecido (W/"...")
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='text/html')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    # Mesma URL serve login ou painel conforme a sessão: cache só privado e sempre revalidado
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.headers['Vary'] = 'Accept-Encoding, Cookie'
+    return response
+
 # Painel admin (HTML/CSS/JS vanilla - Grug-approved)
-@app.route('/admin')
+@bp.route('/admin')
 def admin():
     if 'logged_in' not in session:
-        return render_template_string(LOGIN_HTML), 200
-    return render_template_string(ADMIN_HTML), 200
+        return serve_cached_page('login', LOGIN_HTML)
+    return serve_cached_page('admin', ADMIN_HTML)
+
+# Factory WSGI para produção: gunicorn -c gunicorn.conf.py 'app:create_app()'
+# Cada worker tem seu pool de conexões e seu LeadWriter (ambos recriados por pid).
+# Testes montam apps isoladas: create_app({'TESTING': True, 'DB_PATH': ...})
+def create_app(config=None):
+    """App nova sem I/O: o DB já foi inicializado antes (init-db ou gunicorn.conf.py).
+    config sobrescreve app.config - DB_PATH aponta a app para outro arquivo."""
+    configure_logging()
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = SECRET_KEY
+    app.config.update(config or {})
+    app.register_blueprint(bp)
+    if not app.testing:
+        # Renderiza e comprime as páginas antes do primeiro request (uma vez por processo)
+        with app.app_context():
+            get_cached_page('login', LOGIN_HTML)
+            get_cached_page('admin', ADMIN_HTML)
+    return app
+
+# `from app import app` e flask --app app: app padrão criada no primeiro acesso (PEP 562),
+# não no import - importar o módulo continua barato
+_default_app = None
+_default_app_lock = threading.Lock()
+
+def __getattr__(name):
+    global _default_app
+    if name != 'app':
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    with _default_app_lock:
+        if _default_app is None:
+            _default_app = create_app()
+        return _default_app
+
+def shutdown_app():
+    """Shutdown gracioso do worker: drena a fila de ingestão e fecha as conexões"""
+    stop_lead_writer()
+    stop_read_snapshots()
+    stop_password_verifier()
+    close_db_pool()
+    flush_metrics()
+    stop_log_listener()
 
+# Dev server (Werkzeug, um processo). Em produção usar gunicorn (ver gunicorn.conf.py).
 if __name__ == '__main__':
     debug_mode = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
-    app.run(host='0.0.0.0', port=5000, debug=debug_mode)
+    init_db()
+    create_app().run(host='0.0.0.0', port=5000, debug=debug_mode)
 
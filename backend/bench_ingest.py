@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Benchmark de ingestão - Grug mede antes de acreditar
+Compara leads/s do caminho direto (um commit por request) com o modo batch
+(group commit). Roda tudo em processo com o test client do Flask.
+
+Uso: python bench_ingest.py [--threads 16] [--leads 4000] [--synchronous FULL]
+
+Com synchronous=FULL cada commit faz fsync e a diferença do group commit aparece
+mais; com o default (NORMAL + WAL) o ganho vem de menos disputa pelo lock.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import app as app_module
+
+
+def run(mode, threads, total):
+    """Posta `total` leads com `threads` clientes concorrentes e devolve leads/s"""
+    with tempfile.TemporaryDirectory() as tmp:
+        app_module.stop_lead_writer()
+        app_module.close_db_pool()
+        app_module.DB_PATH = os.path.join(tmp, 'bench.db')
+        app_module.LEAD_INGEST_MODE = mode
+        app_module.DB_POOL_SIZE = max(app_module.DB_POOL_SIZE, threads)
+        app_module.init_db()
+
+        per_thread = total // threads
+        errors = []
+
+        def worker(n):
+            with app_module.app.test_client() as client:
+                for i in range(per_thread):
+                    response = client.post('/api/leads', json={
+                        'name': f'Bench {n}-{i}',
+                        'email': f'bench{n}-{i}@test.com',
+                        'message': 'Lead sintético do benchmark',
+                        'budget': 'R$ 5.000',
+                        'form_type': 'inline'
+                    })
+                    if response.status_code != 201:
+                        errors.append(response.status_code)
+
+        workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        started = time.perf_counter()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+        app_module.stop_lead_writer()
+        app_module.close_db_pool()
+
+    created = per_thread * threads - len(errors)
+    return created / elapsed, len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--leads', type=int, default=4000)
+    parser.add_argument('--synchronous', default=None, help='NORMAL (default do app) ou FULL')
+    args = parser.parse_args()
+
+    if args.synchronous:
+        app_module.SQLITE_PRAGMAS = tuple(
+            f'PRAGMA synchronous={args.synchronous}' if p.startswith('PRAGMA synchronous') else p
+            for p in app_module.SQLITE_PRAGMAS
+        )
+
+    app_module.logger.setLevel('WARNING')
+    app_module.app.config['TESTING'] = True
+    app_module.RATE_LIMIT_ENABLED = False  # todo mundo vem do mesmo IP
+
+    results = {}
+    for mode in ('direct', 'batch'):
+        rate, errors = run(mode, args.threads, args.leads)
+        results[mode] = rate
+        print(f'{mode:>6}: {rate:8.0f} leads/s  ({errors} errors, {args.threads} threads)')
+    print(f'speedup: {results["batch"] / results["direct"]:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
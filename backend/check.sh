@@ -2,7 +2,7 @@
 # Script simples para verificar se tudo está OK - Grug-approved
 
 echo "🔍 Verificando sintaxe Python..."
-python3 -m py_compile app.py test_integration.py
+python3 -m py_compile app.py test_integration.py bench_ingest.py loadtest.py gunicorn.conf.py test_benchmark.py
 if [ $? -eq 0 ]; then
     echo "✅ Sintaxe OK"
 else
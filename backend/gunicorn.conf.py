@@ -0,0 +1,108 @@
+"""
+Configuração do gunicorn - modo produção (Grug usa prefork, não o dev server)
+Workers pré-forkados (processos) com um pool de threads cada (gthread).
+
+Uso: gunicorn -c gunicorn.conf.py 'app:create_app()'
+  HUP  -> reload gracioso (workers novos sobem, antigos terminam os requests)
+  TERM -> shutdown gracioso (até graceful_timeout segundos)
+
+SQLite: todos os workers usam o mesmo arquivo em WAL. Schema e migrações rodam
+uma vez no master, antes do fork (flask --app app init-db); worker só abre conexões.
+Backup online a cada BACKUP_INTERVAL segundos, também a partir do master (um só, não
+um por worker): flask --app app backup-db num subprocesso.
+"""
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+worker_class = 'gthread'
+
+# Uma conexão do pool por thread; streams SSE seguram threads, então no máximo metade
+os.environ.setdefault('DB_POOL_SIZE', str(threads))
+os.environ.setdefault('SSE_MAX_SUBSCRIBERS', str(max(1, threads // 2)))
+
+# Log de produção: fila + thread (request nunca espera o stderr), uma linha JSON por registro
+os.environ.setdefault('LOG_MODE', 'queue')
+os.environ.setdefault('LOG_FORMAT', 'json')
+
+# /metrics soma os snapshots que cada worker grava aqui
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'leads-metrics'))
+
+# Backup online agendado (0 desliga); rotação e destino: BACKUP_KEEP / BACKUP_DIR
+BACKUP_INTERVAL = float(os.environ.get('BACKUP_INTERVAL', '21600'))
+
+# Worker travado é reciclado; requests lentos (export, SSE) mandam bytes antes disso
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = 5
+
+# Recicla workers aos poucos para conter vazamento de memória
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '10000'))
+max_requests_jitter = max_requests // 10
+
+# Sem preload: HUP recarrega o código de verdade (cada worker importa o app)
+preload_app = False
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG')  # '-' para stdout; app já loga cada request
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def flask_command(*args, check=True):
+    """flask --app app <args> num subprocesso: o master não importa o app, então o HUP
+    continua carregando o código novo nos workers"""
+    return subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', *args],
+                          cwd=os.path.dirname(os.path.abspath(__file__)), check=check)
+
+
+def init_database():
+    """Schema + migrações antes de qualquer worker existir"""
+    flask_command('init-db')
+
+
+def backup_loop(server):
+    """Thread do master: backup a cada BACKUP_INTERVAL. Falha vai pro log e tenta de novo
+    no próximo intervalo - o backup nunca derruba o servidor."""
+    while True:
+        time.sleep(BACKUP_INTERVAL)
+        try:
+            result = flask_command('backup-db', check=False)
+        except OSError as e:
+            server.log.error(f'Scheduled backup failed to start: {e}')
+            continue
+        if result.returncode != 0:
+            server.log.error(f'Scheduled backup failed (exit code {result.returncode})')
+
+
+def on_starting(server):
+    """Master subindo: descarta métricas de uma execução anterior (contadores recomeçam do zero)
+    e prepara o DB"""
+    shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
+    os.makedirs(os.environ['METRICS_DIR'], exist_ok=True)
+    init_database()
+
+
+def when_ready(server):
+    """Master pronto: liga o agendador de backup (o primeiro sai depois de um intervalo)"""
+    if BACKUP_INTERVAL > 0:
+        threading.Thread(target=backup_loop, args=(server,), name='backup-scheduler', daemon=True).start()
+
+
+def on_reload(server):
+    """HUP: código novo pode trazer migração nova - aplica antes dos workers novos subirem"""
+    init_database()
+
+
+def worker_exit(server, worker):
+    """Drena a fila de ingestão, fecha conexões e arquiva as métricas antes do worker sair"""
+    app_module = sys.modules.get('app')
+    if app_module is not None:
+        app_module.shutdown_app()
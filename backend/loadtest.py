@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Load test do modo produção - Grug mede se mais workers = mais requests/s
+Sobe o gunicorn (gunicorn.conf.py) com 1, 2, 4... workers num DB temporário e
+martela POST /api/leads e GET /api/leads com vários processos cliente.
+
+Uso: python loadtest.py [--workers 1,2,4] [--clients 8] [--duration 10]
+
+Os clientes rodam em processos separados (sem disputar o GIL com o servidor),
+mas na mesma máquina: num host com poucos cores o teto é a CPU, não o gunicorn.
+"""
+import argparse
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_healthy(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/health')
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn did not become healthy')
+
+
+def login(conn):
+    conn.request('POST', '/api/login', body=json.dumps({'username': 'admin', 'password': 'admin123'}),
+                 headers={'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    response.read()
+    return response.getheader('Set-Cookie').split(';', 1)[0]
+
+
+def client_loop(port, scenario, duration):
+    """Um processo cliente: conexão keep-alive, requests em sequência até acabar o tempo"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    headers = {'Content-Type': 'application/json'}
+    if scenario == 'list':
+        headers['Cookie'] = login(conn)
+    ok = errors = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        try:
+            if scenario == 'create':
+                body = json.dumps({'name': f'Load {os.getpid()}-{ok}', 'budget': 'R$ 1.000', 'form_type': 'inline'})
+                conn.request('POST', '/api/leads', body=body, headers=headers)
+            else:
+                conn.request('GET', '/api/leads?limit=50', headers=headers)
+            response = conn.getresponse()
+            response.read()
+            if response.status < 400:
+                ok += 1
+            else:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    return ok, errors
+
+
+def run(workers, clients, duration, threads):
+    with tempfile.TemporaryDirectory() as tmp:
+        port = free_port()
+        env = dict(os.environ, DB_PATH=os.path.join(tmp, 'load.db'), BIND=f'127.0.0.1:{port}',
+                   WEB_CONCURRENCY=str(workers), GUNICORN_THREADS=str(threads),
+                   GUNICORN_LOG_LEVEL='warning', SECRET_KEY='loadtest',
+                   RATE_LIMIT_ENABLED='false')
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:create_app()'],
+            cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_healthy(port)
+            results = {}
+            for scenario in ('create', 'list'):
+                with ProcessPoolExecutor(clients) as pool:
+                    futures = [pool.submit(client_loop, port, scenario, duration) for _ in range(clients)]
+                    totals = [f.result() for f in futures]
+                ok = sum(t[0] for t in totals)
+                errors = sum(t[1] for t in totals)
+                results[scenario] = (ok / duration, errors)
+            return results
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', default='1,2,4', help='lista de contagens de workers')
+    parser.add_argument('--threads', type=int, default=8, help='threads por worker')
+    parser.add_argument('--clients', type=int, default=8, help='processos cliente concorrentes')
+    parser.add_argument('--duration', type=float, default=10, help='segundos por cenário')
+    args = parser.parse_args()
+
+    print(f'{"workers":>7}  {"POST /api/leads":>16}  {"GET /api/leads":>15}')
+    for workers in (int(w) for w in args.workers.split(',')):
+        results = run(workers, args.clients, args.duration, args.threads)
+        create_rps, create_err = results['create']
+        list_rps, list_err = results['list']
+        print(f'{workers:>7}  {create_rps:>10.0f} req/s  {list_rps:>9.0f} req/s'
+              f'  (errors: {create_err} / {list_err})')
+
+
+if __name__ == '__main__':
+    main()
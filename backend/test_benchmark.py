@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Benchmarks dos caminhos quentes - Grug mede, não chuta
+Só roda com BENCH=1 (fica fora do pytest normal):
+
+    BENCH=1 python -m pytest test_benchmark.py -q -s
+    BENCH=1 BENCH_SIZES=10000 BENCH_BASELINE=bench_baseline.json python -m pytest test_benchmark.py -s
+
+Cada cenário (insert, list, delete, login, export) roda com 1 e BENCH_THREADS
+threads sobre tabelas de 10k/100k/1M leads. Sai p50/p95/p99 e req/s por cenário
+em BENCH_OUTPUT (JSON). Com BENCH_BASELINE o resumo final mostra a variação.
+
+O dataset é semeado uma vez por tamanho via SQL puro (CTE recursiva) em
+BENCH_CACHE_DIR e copiado para cada teste - 1M leads não é gerado a cada cenário.
+"""
+import json
+import os
+import platform
+import shutil
+import statistics
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+import app as app_module
+from app import app, db_connection, init_db, close_db_pool, stop_lead_writer
+
+pytestmark = pytest.mark.skipif(os.environ.get('BENCH') != '1', reason='benchmarks: rode com BENCH=1')
+
+BENCH_SIZES = [int(n) for n in os.environ.get('BENCH_SIZES', '10000,100000,1000000').split(',')]
+BENCH_THREADS = int(os.environ.get('BENCH_THREADS', '8'))
+BENCH_REQUESTS = int(os.environ.get('BENCH_REQUESTS', '400'))
+BENCH_LOGIN_REQUESTS = int(os.environ.get('BENCH_LOGIN_REQUESTS', '40'))
+BENCH_EXPORT_REQUESTS = int(os.environ.get('BENCH_EXPORT_REQUESTS', '10'))
+BENCH_OUTPUT = os.environ.get('BENCH_OUTPUT', 'bench_results.json')
+BENCH_BASELINE = os.environ.get('BENCH_BASELINE')
+BENCH_CACHE_DIR = os.environ.get('BENCH_CACHE_DIR', '.bench_cache')
+BENCH_DB = 'bench_leads.db'
+
+SEED_SPAN_SECONDS = 365 * 24 * 3600
+RESULTS = {}
+
+# Um ano de leads, o mais novo com o maior id (igual produção). Orçamento, telefone e
+# form_type variam para os filtros terem o que filtrar. budget_cents/phone já vêm prontos.
+SEED_SQL = '''
+    WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < :total)
+    INSERT INTO leads (name, email, contact, message, budget, form_type, created_at, budget_cents, phone)
+    SELECT
+        'Lead ' || n,
+        'lead' || n || '@bench.test',
+        CASE WHEN n % 3 = 0 THEN '(11) 9' || printf('%04d-%04d', n / 10000 % 10000, n % 10000) ELSE '' END,
+        'Mensagem sintética ' || n,
+        'R$ ' || ((n % 50) * 1000),
+        CASE n % 4 WHEN 0 THEN 'modal' ELSE 'inline' END,
+        datetime('now', printf('-%d seconds', (:total - n) * :span / :total)),
+        (n % 50) * 100000,
+        CASE WHEN n % 3 = 0 THEN '119' || printf('%04d%04d', n / 10000 % 10000, n % 10000) END
+    FROM seq
+'''
+
+
+def seed_template(size):
+    """DB semeado com `size` leads (cacheado em disco entre execuções)"""
+    os.makedirs(BENCH_CACHE_DIR, exist_ok=True)
+    template = os.path.join(BENCH_CACHE_DIR, f'leads-{size}.db')
+    if os.path.exists(template):
+        return template
+
+    original_db = app_module.DB_PATH
+    app_module.DB_PATH = template + '.tmp'
+    try:
+        init_db()
+        started = time.perf_counter()
+        with db_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(SEED_SQL, {'total': size, 'span': SEED_SPAN_SECONDS})
+            app_module.backfill_lead_counters(conn)
+            conn.commit()
+            # Só leads, como run_migrations: stat1 das tabelas internas do FTS5 deixa o INSERT lento
+            conn.execute('ANALYZE leads')
+            conn.execute("DELETE FROM sqlite_stat1 WHERE tbl LIKE 'leads\\_fts\\_%' ESCAPE '\\'")
+            conn.commit()
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        print(f'\nseeded {size} leads in {time.perf_counter() - started:.1f}s')
+    finally:
+        close_db_pool()
+        app_module.DB_PATH = original_db
+    os.replace(template + '.tmp', template)
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(template + '.tmp' + suffix):
+            os.remove(template + '.tmp' + suffix)
+    return template
+
+
+def remove_bench_db():
+    stop_lead_writer()
+    close_db_pool()
+    for path in (BENCH_DB, BENCH_DB + '-wal', BENCH_DB + '-shm'):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+@pytest.fixture(scope='function', params=BENCH_SIZES, ids=lambda size: f'{size}')
+def client(request):
+    """Mesmo padrão do client de test_integration.py, mas sobre um DB já semeado"""
+    original_db = app_module.DB_PATH
+    remove_bench_db()
+    shutil.copyfile(seed_template(request.param), BENCH_DB)
+    app_module.DB_PATH = BENCH_DB
+    init_db()
+
+    app.config['TESTING'] = True
+    app.config['SECRET_KEY'] = 'bench-secret-key'
+    app_module.RATE_LIMIT_ENABLED = False
+    app_module._idempotency_caches.clear()
+    app_module.logger.setLevel('WARNING')
+
+    with app.test_client() as client:
+        client.size = request.param
+        yield client
+
+    remove_bench_db()
+    app_module.DB_PATH = original_db
+    app_module.RATE_LIMIT_ENABLED = True
+    app_module.logger.setLevel('INFO')
+
+
+def login_cookie(client):
+    response = client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+    assert response.status_code == 200
+
+
+def measure(name, size, threads, total, call, login=False):
+    """Roda `call(client, i)` total vezes repartido em `threads` threads.
+    Cada thread tem o próprio test client (e a própria sessão, se login=True)."""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    per_thread = max(1, total // threads)
+    ready = threading.Barrier(threads + 1)  # login fica fora do tempo medido
+
+    def worker(n):
+        local = []
+        with app.test_client() as c:
+            if login:
+                login_cookie(c)
+            ready.wait()
+            for i in range(per_thread):
+                started = time.perf_counter()
+                status = call(c, n * per_thread + i)
+                local.append(time.perf_counter() - started)
+                if status >= 400:
+                    errors.append(status)
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in workers:
+        t.start()
+    ready.wait()
+    started = time.perf_counter()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    result = {
+        'scenario': name,
+        'size': size,
+        'threads': threads,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'p50_ms': round(cuts[49] * 1000, 3),
+        'p95_ms': round(cuts[94] * 1000, 3),
+        'p99_ms': round(cuts[98] * 1000, 3),
+        'rps': round(len(latencies) / elapsed, 1),
+    }
+    RESULTS[f'{name}/{size}/t{threads}'] = result
+    assert not errors, f'{name}: {len(errors)} errors ({errors[:5]})'
+    return result
+
+
+@pytest.mark.parametrize('threads', [1, BENCH_THREADS])
+def test_bench_insert(client, threads):
+    """POST /api/leads (caminho direto, um commit por request)"""
+    def call(c, i):
+        return c.post('/api/leads', json={
+            'name': f'Bench {i}', 'email': f'bench{i}@test.com', 'contact': '(11) 98765-4321',
+            'budget': 'R$ 5.000', 'form_type': 'inline'
+        }).status_code
+    measure('insert', client.size, threads, BENCH_REQUESTS, call)
+
+
+@pytest.mark.parametrize('threads', [1, BENCH_THREADS])
+def test_bench_list(client, threads):
+    """GET /api/leads: primeira página, página funda (cursor) e filtro quentes"""
+    login_cookie(client)
+    deep = client.get('/api/leads?limit=200')
+    for _ in range(4):
+        deep = client.get(f'/api/leads?limit=200&cursor={deep.json["next_cursor"]}')
+    deep_cursor = deep.json['next_cursor']
+
+    urls = ['/api/leads?limit=50', f'/api/leads?limit=50&cursor={deep_cursor}', '/api/leads?limit=50&filter=quentes']
+    measure('list', client.size, threads, BENCH_REQUESTS,
+            lambda c, i: c.get(urls[i % len(urls)]).status_code, login=True)
+
+
+@pytest.mark.parametrize('threads', [1, BENCH_THREADS])
+def test_bench_delete(client, threads):
+    """DELETE /api/leads/<id> espalhado pela tabela toda"""
+    step = max(1, client.size // BENCH_REQUESTS)
+    measure('delete', client.size, threads, BENCH_REQUESTS,
+            lambda c, i: c.delete(f'/api/leads/{1 + i * step}').status_code, login=True)
+
+
+@pytest.mark.parametrize('threads', [1, BENCH_THREADS])
+def test_bench_login(client, threads):
+    """POST /api/login (PBKDF2 no pool de verificação)"""
+    measure('login', client.size, threads, BENCH_LOGIN_REQUESTS,
+            lambda c, i: c.post('/api/login', json={'username': 'admin', 'password': 'admin123'}).status_code)
+
+
+@pytest.mark.parametrize('threads', [1, BENCH_THREADS])
+def test_bench_export(client, threads):
+    """GET /api/leads/export do último mês, stream consumido até o fim"""
+    today = datetime.now().strftime('%Y-%m-%d')
+    month_ago = datetime.fromtimestamp(time.time() - 30 * 86400).strftime('%Y-%m-%d')
+
+    def call(c, i):
+        response = c.get(f'/api/leads/export?format=csv&from={month_ago}&to={today}')
+        for _ in response.response:
+            pass
+        response.close()
+        return response.status_code
+    measure('export', client.size, threads, BENCH_EXPORT_REQUESTS, call, login=True)
+
+
+def format_delta(current, baseline, key):
+    if not baseline or not baseline.get(key):
+        return ''
+    change = (current[key] - baseline[key]) / baseline[key] * 100
+    return f' ({change:+.0f}%)'
+
+
+@pytest.fixture(scope='session', autouse=True)
+def write_results():
+    """No fim da sessão: grava o JSON e imprime o resumo (com a baseline, se houver)"""
+    yield
+    if not RESULTS:
+        return
+    with open(BENCH_OUTPUT, 'w') as f:
+        json.dump({
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': app_module.sqlite3.sqlite_version,
+            'cpus': os.cpu_count(),
+            'results': RESULTS,
+        }, f, indent=2)
+
+    baseline = {}
+    if BENCH_BASELINE and os.path.exists(BENCH_BASELINE):
+        with open(BENCH_BASELINE) as f:
+            baseline = json.load(f)['results']
+
+    print(f'\n{"scenario":<24} {"p50 ms":>14} {"p95 ms":>14} {"p99 ms":>14} {"req/s":>16}')
+    for key, r in RESULTS.items():
+        base = baseline.get(key)
+        print(f'{key:<24} {r["p50_ms"]:>8.2f}{format_delta(r, base, "p50_ms"):>6} '
+              f'{r["p95_ms"]:>8.2f}{format_delta(r, base, "p95_ms"):>6} '
+              f'{r["p99_ms"]:>8.2f}{format_delta(r, base, "p99_ms"):>6} '
+              f'{r["rps"]:>9.0f}{format_delta(r, base, "rps"):>7}')
+    print(f'results written to {BENCH_OUTPUT}')
@@ -6,11 +6,19 @@ Integration tests, não unit tests isolados com mocking excessivo.
 import os
 import sqlite3
 import pytest
-from app import app, get_db_connection, init_db
+from app import app, get_db_connection, init_db, close_db_pool, stop_lead_writer
 
 # Usar DB de teste separado
 TEST_DB = 'test_leads.db'
 
+def remove_test_db():
+    """Remove DB de teste (e arquivos do WAL) depois de fechar o pool"""
+    stop_lead_writer()
+    close_db_pool()
+    for path in (TEST_DB, TEST_DB + '-wal', TEST_DB + '-shm'):
+        if os.path.exists(path):
+            os.remove(path)
+
 @pytest.fixture(scope='function')
 def client():
     """Setup cliente de teste e DB limpo"""
@@ -22,8 +30,7 @@ def client():
     app_module.DB_PATH = TEST_DB
     
     # Limpar DB de teste
-    if os.path.exists(TEST_DB):
-        os.remove(TEST_DB)
+    remove_test_db()
     
     # Inicializar DB de teste
     init_db()
@@ -31,16 +38,21 @@ def client():
     # Configurar app para testes
     app.config['TESTING'] = True
     app.config['SECRET_KEY'] = 'test-secret-key'
+    # Rate limit desligado: todos os testes vêm do mesmo IP
+    app_module.RATE_LIMIT_ENABLED = False
+    app_module._rate_limiters.clear()
+    app_module._idempotency_caches.clear()
+    app_module.invalidate_admin_cache()
     
     with app.test_client() as client:
         yield client
     
     # Limpar após teste
-    if os.path.exists(TEST_DB):
-        os.remove(TEST_DB)
+    remove_test_db()
     
     # Restaurar DB path original
     app_module.DB_PATH = original_db
+    app_module.RATE_LIMIT_ENABLED = True
 
 def test_health_check(client):
     """Teste básico: health check deve funcionar"""
@@ -167,6 +179,1115 @@ def test_logout(client):
     list_res = client.get('/api/leads')
     assert list_res.status_code == 401
 
+def test_list_leads_keyset_pagination(client):
+    """Teste: paginação por cursor percorre todos os leads sem repetir"""
+    client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+    for i in range(5):
+        client.post('/api/leads', json={'name': f'Lead {i}', 'form_type': 'inline'})
+
+    seen = []
+    cursor = None
+    while True:
+        url = '/api/leads?limit=2' + (f'&cursor={cursor}' if cursor else '')
+        response = client.get(url)
+        assert response.status_code == 200
+        assert len(response.json['leads']) <= 2
+        seen.extend(lead['id'] for lead in response.json['leads'])
+        cursor = response.json['next_cursor']
+        if not cursor:
+            break
+
+    assert len(seen) == 5
+    assert seen == sorted(seen, reverse=True)
+
+def test_list_leads_invalid_cursor(client):
+    """Teste: cursor ou limit inválido retorna 400"""
+    client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+    assert client.get('/api/leads?cursor=lixo').status_code == 400
+    assert client.get('/api/leads?limit=0').status_code == 400
+
+def test_list_leads_filter_by_form_type(client):
+    """Teste: filtro por form_type"""
+    client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+    client.post('/api/leads', json={'name': 'Modal', 'form_type': 'modal'})
+    client.post('/api/leads', json={'name': 'Inline', 'form_type': 'inline'})
+    response = client.get('/api/leads?form_type=modal')
+    assert [lead['name'] for lead in response.json['leads']] == ['Modal']
+
+def test_migrations_bring_db_to_latest_version(client):
+    """Teste: init_db deixa o schema na última versão, com índices"""
+    import app as app_module
+    conn = get_db_connection()
+    try:
+        assert app_module.get_schema_version(conn) == app_module.MIGRATIONS[-1][0]
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert 'idx_leads_created_at_id' in indexes
+        plan = ' '.join(row[3] for row in conn.execute(
+            'EXPLAIN QUERY PLAN SELECT * FROM leads ORDER BY created_at DESC, id DESC LIMIT 10'))
+        assert 'TEMP B-TREE' not in plan
+        # Rodar de novo não faz nada
+        assert app_module.run_migrations(conn) == 0
+        # Sem estatística nas tabelas internas do FTS5 (deixa o INSERT no índice quadrático)
+        assert conn.execute("SELECT COUNT(*) FROM sqlite_stat1 WHERE tbl LIKE 'leads_fts%'").fetchone()[0] == 0
+    finally:
+        conn.close()
+
+def test_migrations_upgrade_existing_db_in_place(client):
+    """Teste: DB antigo (versão 0, sem índices) é migrado sem perder dados"""
+    import app as app_module
+    remove_test_db()
+    conn = sqlite3.connect(TEST_DB)
+    conn.execute('''
+        CREATE TABLE leads (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, email TEXT,
+            contact TEXT, message TEXT, budget TEXT, form_type TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute("INSERT INTO leads (name, contact, budget) VALUES ('Antigo', '11 98888-7777', 'R$ 2.000')")
+    conn.commit()
+    conn.close()
+
+    init_db()
+    conn = get_db_connection()
+    try:
+        assert app_module.get_schema_version(conn) == app_module.MIGRATIONS[-1][0]
+        assert conn.execute('SELECT name FROM leads').fetchone()[0] == 'Antigo'
+        assert conn.execute("SELECT value FROM counters WHERE name = 'lead_count'").fetchone()[0] == 1
+        assert tuple(conn.execute('SELECT budget_cents, phone FROM leads').fetchone()) == (200000, '11988887777')
+        # Índice full-text preenchido com as linhas antigas
+        assert conn.execute("SELECT rowid FROM leads_fts WHERE leads_fts MATCH 'antigo'").fetchone()[0] == 1
+    finally:
+        conn.close()
+
+def test_create_lead_batch_mode(client, monkeypatch):
+    """Teste: modo batch grava leads concorrentes com ids distintos"""
+    import threading
+    import app as app_module
+    monkeypatch.setattr(app_module, 'LEAD_INGEST_MODE', 'batch')
+
+    ids = []
+    def post(i):
+        with app.test_client() as c:
+            response = c.post('/api/leads', json={'name': f'Batch {i}'})
+            assert response.status_code == 201
+            ids.append(response.json['id'])
+    threads = [threading.Thread(target=post, args=(i,)) for i in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(set(ids)) == 20
+    conn = get_db_connection()
+    try:
+        assert conn.execute('SELECT COUNT(*) FROM leads').fetchone()[0] == 20
+    finally:
+        conn.close()
+
+def test_lead_writer_drains_queue_on_stop(client):
+    """Teste: stop() confirma todo lead aceito antes de sair (nenhum fica perdido na fila)"""
+    import threading
+    import app as app_module
+    writer = app_module.LeadWriter(batch_size=4, batch_wait=0.05)
+    lead = {'name': 'Drain', 'email': '', 'contact': '', 'message': '', 'budget': '', 'form_type': 'inline'}
+    ids = []
+    def submit():
+        try:
+            ids.append(writer.submit(lead))
+        except sqlite3.OperationalError:
+            pass  # Chegou depois do stop: rejeitado, não perdido
+    threads = [threading.Thread(target=submit) for _ in range(10)]
+    for t in threads:
+        t.start()
+    writer.stop()
+    for t in threads:
+        t.join(timeout=5)
+        assert not t.is_alive()
+
+    assert writer.depth() == 0
+    with pytest.raises(sqlite3.OperationalError):
+        writer.submit(lead)
+    conn = get_db_connection()
+    try:
+        assert conn.execute('SELECT COUNT(*) FROM leads').fetchone()[0] == len(ids)
+    finally:
+        conn.close()
+
+def test_list_leads_etag_not_modified(client):
+    """Teste: If-None-Match com ETag atual retorna 304; muda depois de criar ou deletar"""
+    client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+    lead_id = client.post('/api/leads', json={'name': 'Primeiro'}).json['id']
+
+    first = client.get('/api/leads')
+    etag = first.headers['ETag']
+    again = client.get('/api/leads', headers={'If-None-Match': etag})
+    assert again.status_code == 304
+
+    client.delete(f'/api/leads/{lead_id}')
+    after_delete = client.get('/api/leads', headers={'If-None-Match': etag})
+    assert after_delete.status_code == 200
+    assert after_delete.json['changes'] == first.json['changes'] + 1
+
+def test_list_leads_since_id_delta(client):
+    """Teste: since_id devolve só os leads mais novos"""
+    client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+    client.post('/api/leads', json={'name': 'Velho'})
+    max_id = client.get('/api/leads').json['max_id']
+    client.post('/api/leads', json={'name': 'Novo'})
+
+    response = client.get(f'/api/leads?since_id={max_id}')
+    assert [lead['name'] for lead in response.json['leads']] == ['Novo']
+    assert response.json['max_id'] == max_id + 1
+
+    # Poller: o primeiro delta troca o ETag da carga pelo do delta; daí em diante 304
+    loaded = client.get('/api/leads?limit=50&view=summary')
+    delta_url = f'/api/leads?since_id={loaded.json["max_id"]}&limit=200&view=summary'
+    poll = client.get(delta_url, headers={'If-None-Match': loaded.headers['ETag']})
+    assert poll.status_code == 200 and poll.json['leads'] == []
+    assert client.get(delta_url.replace('limit=200', 'limit=100'),
+                      headers={'If-None-Match': poll.headers['ETag']}).status_code == 304
+    # Página normal: limit é parte da variante
+    one = client.get('/api/leads?limit=1')
+    assert client.get('/api/leads?limit=50', headers={'If-None-Match': one.headers['ETag']}).status_code == 200
+    # ETag enfraquecido pelo gzip do proxy ainda revalida
+    assert client.get('/api/leads?limit=1', headers={'If-None-Match': f'W/{one.headers["ETag"]}'}).status_code == 304
+    # Filtro diferente continua sendo outra variante
+    assert client.get('/api/leads?view=summary&filter=hoje',
+                      headers={'If-None-Match': loaded.headers['ETag']}).status_code == 200
+
+    # Delta pela chave primária, não varrendo o índice de created_at
+    conn = get_db_connection()
+    try:
+        plan = conn.execute('EXPLAIN QUERY PLAN SELECT id FROM leads WHERE id > ? ORDER BY id DESC LIMIT 201',
+                            (max_id,)).fetchall()
+        assert 'INTEGER PRIMARY KEY' in plan[0][3]
+    finally:
+        conn.close()
+    cursor = client.get('/api/leads?limit=1').json['next_cursor']
+    assert client.get(f'/api/leads?since_id={max_id}&cursor={cursor}').status_code == 400
+
+def test_parse_budget_cents():
+    """Teste: orçamento em texto livre vira centavos (mesma regra do dashboard)"""
+    from app import parse_budget_cents
+    assert parse_budget_cents('R$ 5.000') == 500000
+    assert parse_budget_cents('R$ 5.000,50') == 500050
+    assert parse_budget_cents('1500') == 150000
+    assert parse_budget_cents('a combinar') == 0
+    assert parse_budget_cents('') == 0
+    # Valores reais do <select> do site: piso da faixa
+    assert parse_budget_cents('10k-50k') == 1000000
+    assert parse_budget_cents('custom') == 5000000
+    # Texto livre com sufixo e faixa
+    assert parse_budget_cents('1,5k') == 150000
+    assert parse_budget_cents('R$ 20 mil') == 2000000
+    assert parse_budget_cents('2 a 3 mil') == 200000
+    assert parse_budget_cents('R$ 10.000 - 50.000') == 1000000
+
+def test_select_budget_values_in_kpis(client):
+    """Teste: lead do <select> entra no valor total e no filtro min_value pelo piso da faixa"""
+    client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+    client.post('/api/leads', json={'name': 'Faixa', 'budget': '10k-50k'})
+    client.post('/api/leads', json={'name': 'Especial', 'budget': 'custom'})
+    client.post('/api/leads', json={'name': 'Sem', 'budget': ''})
+
+    rich = client.get('/api/leads?min_value=20000').json['leads']
+    assert [lead['name'] for lead in rich] == ['Especial']
+    assert client.get('/api/leads/stats').json['total_value_cents'] == 6000000
+
+def test_normalize_phone():
+    """Teste: telefone sai só com dígitos, contato antes do email"""
+    from app import normalize_phone
+    assert normalize_phone('+55 (11) 99999-9999', '') == '5511999999999'
+    assert normalize_phone('', '11999999999@wa.me') == '11999999999'
+    assert normalize_phone('joao@test.com', None) is None
+
+def test_list_leads_server_side_filters(client):
+    """Teste: filtros whatsapp e min_value rodam no SQL"""
+    client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+    client.post('/api/leads', json={'name': 'Zap', 'contact': '(11) 99999-9999', 'budget': 'R$ 500'})
+    client.post('/api/leads', json={'name': 'Rico', 'email': 'rico@test.com', 'budget': 'R$ 10.000'})
+
+    whatsapp = client.get('/api/leads?filter=whatsapp').json['leads']
+    assert [(lead['name'], lead['phone']) for lead in whatsapp] == [('Zap', '11999999999')]
+
+    rich = client.get('/api/leads?min_value=1000').json['leads']
+    assert [(lead['name'], lead['budget_cents']) for lead in rich] == [('Rico', 1000000)]
+
+    assert len(client.get('/api/leads?filter=hoje').json['leads']) == 2
+    assert client.get('/api/leads?filter=nada').status_code == 400
+    assert client.get('/api/leads?min_value=abc').status_code == 400
+
+    stats = client.get('/api/leads/stats?filter=whatsapp').json
+    assert stats['total_leads'] == 1
+    assert stats['total_value_cents'] == 50000
+    assert stats['urgent_leads'] == 1
+    assert client.get('/api/leads/stats?min_value=1000').json['urgent_leads'] == 1
+    assert client.get('/api/leads/stats').json['urgent_leads'] == 2
+
+def test_lead_stats(client):
+    """Teste: KPIs acompanham criação e remoção de leads"""
+    assert client.get('/api/leads/stats').status_code == 401
+    client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+    client.post('/api/leads', json={'name': 'A', 'budget': 'R$ 1.000'})
+    lead_id = client.post('/api/leads', json={'name': 'B', 'budget': 'R$ 2.500,50'}).json['id']
+
+    stats = client.get('/api/leads/stats').json
+    assert stats['total_leads'] == 2
+    assert stats['total_value_cents'] == 350050
+    assert stats['urgent_leads'] == 2
+
+    client.delete(f'/api/leads/{lead_id}')
+    stats = client.get('/api/leads/stats').json
+    assert stats['total_leads'] == 1
+    assert stats['total_value'] == 1000.0
+
+def test_lead_stream_replays_events(client, monkeypatch):
+    """Teste: stream SSE manda criados e deletados depois do Last-Event-ID"""
+    import app as app_module
+    monkeypatch.setattr(app_module, 'SSE_MAX_DURATION', 0.2)
+    monkeypatch.setattr(app_module, 'SSE_POLL_INTERVAL', 0.05)
+    assert client.get('/api/leads/stream').status_code == 401
+
+    client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+    kept = client.post('/api/leads', json={'name': 'Fica'}).json['id']
+    gone = client.post('/api/leads', json={'name': 'Sai'}).json['id']
+    client.delete(f'/api/leads/{gone}')
+
+    response = client.get('/api/leads/stream', headers={'Last-Event-ID': '0'})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    body = response.get_data(as_text=True)
+    assert 'event: lead_created' in body
+    assert f'"id": {kept}' in body
+    assert f'event: lead_deleted\ndata: {{"id": {gone}}}' in body
+    response.close()  # Servidor WSGI fecha o iterável quando o cliente sai
+    assert app_module._sse_subscribers == 0
+
+    # Resume do último id: nada novo
+    last_id = max(int(line[4:]) for line in body.splitlines() if line.startswith('id: '))
+    resumed = client.get('/api/leads/stream', headers={'Last-Event-ID': str(last_id)})
+    assert 'event: lead_' not in resumed.get_data(as_text=True)
+    resumed.close()
+
+def test_lead_stream_subscriber_cap(client, monkeypatch):
+    """Teste: acima do teto de assinantes o stream responde 503"""
+    import app as app_module
+    monkeypatch.setattr(app_module, 'SSE_MAX_SUBSCRIBERS', 0)
+    client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+    response = client.get('/api/leads/stream')
+    assert response.status_code == 503
+    assert 'Retry-After' in response.headers
+
+def test_export_requires_auth(client):
+    """Teste: export requer autenticação"""
+    response = client.get('/api/leads/export')
+    assert response.status_code == 401
+
+def test_export_csv_streams_all_leads(client):
+    """Teste: export CSV traz cabeçalho e todos os leads, com escape de vírgula"""
+    import csv
+    import io
+    client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+    for i in range(3):
+        client.post('/api/leads', json={'name': f'Lead {i}', 'message': 'Oi, tudo bem?'})
+
+    response = client.get('/api/leads/export?format=csv')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    assert 'attachment' in response.headers['Content-Disposition']
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True).lstrip('\ufeff'))))
+    assert rows[0][0] == 'ID'
+    assert len(rows) == 4
+    assert rows[1][4] == 'Oi, tudo bem?'
+
+def test_export_ndjson_with_date_bounds(client):
+    """Teste: export NDJSON respeita from/to"""
+    import json
+    client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+    client.post('/api/leads', json={'name': 'Hoje'})
+    conn = get_db_connection()
+    try:
+        conn.execute("INSERT INTO leads (name, created_at) VALUES ('Antigo', '2020-01-15 10:00:00')")
+        conn.commit()
+    finally:
+        conn.close()
+
+    response = client.get('/api/leads/export?format=ndjson&from=2020-01-01&to=2020-01-31')
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [lead['name'] for lead in lines] == ['Antigo']
+
+    response = client.get('/api/leads/export?format=ndjson')
+    assert len(response.get_data(as_text=True).splitlines()) == 2
+
+    # Limite com fuso: 08:00-03:00 é 11:00 UTC, depois do Antigo (10:00 UTC); 07:00-03:00 pega
+    names = lambda url: [json.loads(line)['name'] for line in client.get(url).get_data(as_text=True).splitlines()]
+    assert names('/api/leads/export?format=ndjson&from=2020-01-15T08:00:00-03:00&to=2020-01-31') == []
+    assert names('/api/leads/export?format=ndjson&from=2020-01-15T07:00:00-03:00&to=2020-01-31') == ['Antigo']
+    from app import parse_date_bound
+    assert parse_date_bound('2020-01-15T22:30:00-03:00') == '2020-01-16 01:30:00'
+
+def test_export_invalid_params(client):
+    """Teste: formato ou data inválida retorna 400"""
+    client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+    assert client.get('/api/leads/export?format=xml').status_code == 400
+    assert client.get('/api/leads/export?from=ontem').status_code == 400
+
+def test_create_app_serves_requests(client):
+    """Teste: factory WSGI devolve o app pronto para o gunicorn"""
+    from app import create_app
+    wsgi_app = create_app()
+    with wsgi_app.test_client() as c:
+        assert c.get('/health').status_code == 200
+
+def test_init_db_concurrent_workers(client):
+    """Teste: vários workers inicializando o mesmo DB ao mesmo tempo não quebram"""
+    import threading
+    remove_test_db()
+    errors = []
+    def boot():
+        try:
+            init_db()
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=boot) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    conn = get_db_connection()
+    try:
+        assert conn.execute('SELECT COUNT(*) FROM admin_users').fetchone()[0] == 1
+    finally:
+        conn.close()
+
+def test_admin_page_cached_and_compressed(client):
+    """Teste: /admin sai da memória com ETag, gzip e 304 na revalidação"""
+    import gzip
+    login_page = client.get('/admin')
+    assert login_page.status_code == 200
+    assert b'Admin Login' in login_page.data
+    etag = login_page.headers['ETag']
+
+    assert client.get('/admin', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/admin', headers={'If-None-Match': f'W/{etag}'}).status_code == 304
+
+    compressed = client.get('/admin', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(compressed.data) == login_page.data
+    assert compressed.headers['ETag'] != etag
+
+    # Depois do login a mesma URL é o painel, com outro ETag
+    client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+    panel = client.get('/admin', headers={'If-None-Match': etag})
+    assert panel.status_code == 200
+    assert b'Leads Recentes' in panel.data
+
+def test_db_uses_wal_mode(client):
+    """Teste: conexões saem configuradas com WAL"""
+    conn = get_db_connection()
+    try:
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    finally:
+        conn.close()
+
+def test_pool_reuses_connections(client):
+    """Teste: pool devolve a mesma conexão em vez de abrir outra"""
+    import app as app_module
+    with app_module.db_connection() as first:
+        pass
+    with app_module.db_connection() as second:
+        assert second is first
+
+def test_pool_is_bounded(client):
+    """Teste: pool cheio falha rápido em vez de abrir conexões sem limite"""
+    import app as app_module
+    pool = app_module.ConnectionPool(TEST_DB, size=1, timeout=0.01)
+    conn = pool.acquire()
+    try:
+        with pytest.raises(sqlite3.OperationalError):
+            pool.acquire()
+    finally:
+        pool.release(conn)
+        pool.close()
+
+def test_rate_limit_per_ip(client, monkeypatch):
+    """Teste: estourou o balde do IP -> 429 com Retry-After, outro IP segue livre"""
+    import app as app_module
+    monkeypatch.setattr(app_module, 'RATE_LIMIT_ENABLED', True)
+    monkeypatch.setitem(app_module.RATE_LIMITS, 'create_lead', '2/60')
+
+    headers = {'X-Real-IP': '10.0.0.1'}
+    for _ in range(2):
+        assert client.post('/api/leads', json={'name': 'Flood'}, headers=headers).status_code == 201
+    response = client.post('/api/leads', json={'name': 'Flood'}, headers=headers)
+    assert response.status_code == 429
+    assert 1 <= int(response.headers['Retry-After']) <= 30
+
+    other = client.post('/api/leads', json={'name': 'Outro'}, headers={'X-Real-IP': '10.0.0.2'})
+    assert other.status_code == 201
+
+    # Login tem balde próprio
+    for _ in range(5):
+        client.post('/api/login', json={'username': 'admin', 'password': 'x'}, headers=headers)
+    response = client.post('/api/login', json={'username': 'admin', 'password': 'admin123'}, headers=headers)
+    assert response.status_code == 429
+
+def test_rate_limiter_refill_and_lru():
+    """Teste: balde reabastece com o tempo e o LRU não passa de max_keys"""
+    from app import RateLimiter
+    limiter = RateLimiter('1/10', max_keys=2)
+    assert limiter.hit('a', now=0) == 0
+    assert limiter.hit('a', now=1) == pytest.approx(9)
+    assert limiter.hit('a', now=11) == 0
+
+    limiter.hit('b', now=11)
+    limiter.hit('c', now=11)
+    assert len(limiter) == 2
+    # 'a' foi expulso e volta com balde cheio
+    assert limiter.hit('a', now=12) == 0
+
+def test_login_rejected_when_verifier_saturated(client, monkeypatch):
+    """Teste: sem vaga no pool de senha o login volta 503 na hora, sem hash inline"""
+    import app as app_module
+    monkeypatch.setattr(app_module, '_password_verifier',
+                        app_module.PasswordVerifier('thread', 1, 0))
+    response = client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    # Captura de lead segue normal
+    assert client.post('/api/leads', json={'name': 'Durante rajada'}).status_code == 201
+
+def test_set_password_invalidates_admin_cache(client):
+    """Teste: trocar senha (CLI) derruba o hash cacheado"""
+    assert client.post('/api/login', json={'username': 'admin', 'password': 'admin123'}).status_code == 200
+
+    result = app.test_cli_runner().invoke(args=['set-password', 'admin', '--password', 'nova-senha'])
+    assert result.exit_code == 0, result.output
+
+    assert client.post('/api/login', json={'username': 'admin', 'password': 'admin123'}).status_code == 401
+    assert client.post('/api/login', json={'username': 'admin', 'password': 'nova-senha'}).status_code == 200
+
+def test_admin_cache_ttl_bounds_password_change_from_other_process(client, monkeypatch):
+    """Teste: senha trocada por outra conexão (outro worker) vale depois de ADMIN_CACHE_TTL;
+    hash em cache não consulta admin_users"""
+    import sqlite3
+    import time
+    import app as app_module
+    from werkzeug.security import generate_password_hash
+    monkeypatch.setattr(app_module, 'ADMIN_CACHE_TTL', 0.5)
+    with app_module.db_connection() as conn:
+        old_hash = app_module.get_admin_password_hash(conn, 'admin')
+
+    # Sem passar por set_admin_password: nada invalida o cache deste processo
+    conn = sqlite3.connect(app_module.get_db_path())
+    conn.execute('UPDATE admin_users SET password_hash = ? WHERE username = ?',
+                 (generate_password_hash('de-outro-worker'), 'admin'))
+    conn.commit()
+    conn.close()
+    with app_module.db_connection() as conn:
+        assert app_module.get_admin_password_hash(conn, 'admin') == old_hash
+
+    time.sleep(0.6)
+    assert client.post('/api/login', json={'username': 'admin', 'password': 'admin123'}).status_code == 401
+    assert client.post('/api/login', json={'username': 'admin', 'password': 'de-outro-worker'}).status_code == 200
+
+def test_metrics_endpoint(client, monkeypatch):
+    """Teste: /metrics em formato Prometheus com contagem, histograma e tempo de DB por rota"""
+    import app as app_module
+    monkeypatch.setattr(app_module, '_metrics', app_module.Metrics())
+    assert client.post('/api/leads', json={'name': 'Métrica'}).status_code == 201
+    client.get('/api/leads')  # 401
+
+    body = client.get('/metrics').get_data(as_text=True)
+    assert '# TYPE http_requests_total counter' in body
+    assert 'http_requests_total{method="POST",route="/api/leads",status="201"} 1' in body
+    assert 'http_requests_total{method="GET",route="/api/leads",status="401"} 1' in body
+    assert 'http_request_duration_seconds_bucket{method="POST",route="/api/leads",le="+Inf"} 1' in body
+    assert 'http_request_db_seconds_count{route="/api/leads"} 2' in body
+    assert 'lead_ingest_queue_depth 0' in body
+
+def test_metrics_merge_worker_snapshots(client, monkeypatch, tmp_path):
+    """Teste: snapshots de outros workers e de workers encerrados entram na soma"""
+    import json
+    import app as app_module
+    monkeypatch.setattr(app_module, 'METRICS_DIR', str(tmp_path))
+    monkeypatch.setattr(app_module, '_metrics', app_module.Metrics())
+    app_module.get_metrics().inc('db_lock_retries_total', path='create_lead')
+
+    # Outro worker vivo (pid do pai, para passar no pid_alive) e um já encerrado
+    other = app_module.Metrics()
+    other.inc('db_lock_retries_total', 2, path='create_lead')
+    other.observe('db_pool_wait_seconds', 0.003)
+    (tmp_path / f'{os.getppid()}.json').write_text(json.dumps(
+        dict(other.snapshot(), pid=os.getppid(), gauges={'lead_ingest_queue_depth': 3})))
+    finished = app_module.Metrics()
+    finished.inc('db_lock_retries_total', 4, path='create_lead')
+    app_module.write_metrics_snapshot(finished, final=True)
+    assert (tmp_path / 'archive.json').exists()
+
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'db_lock_retries_total{path="create_lead"} 7' in body
+    assert 'db_pool_wait_seconds_bucket{le="0.005"} 1' in body
+    assert 'lead_ingest_queue_depth 3' in body
+
+def test_metrics_never_decrease_across_workers(client, monkeypatch, tmp_path):
+    """Teste: scrapes alternando entre workers nunca veem um contador diminuir"""
+    import re
+    import app as app_module
+    monkeypatch.setattr(app_module, 'METRICS_DIR', str(tmp_path))
+    worker_a = app_module.Metrics()
+    worker_b = app_module.Metrics()
+    worker_b.pid = os.getppid()  # outro worker vivo
+    current = {'metrics': worker_a}
+    monkeypatch.setattr(app_module, 'get_metrics', lambda: current['metrics'])
+
+    def scrape(worker):
+        current['metrics'] = worker
+        body = app_module.render_metrics(app_module.merge_metric_snapshots(app_module.collect_metric_snapshots()))
+        match = re.search(r'^db_lock_retries_total (\d+)', body, re.M)
+        return int(match.group(1)) if match else 0
+
+    # A tem snapshot velho no disco (flush periódico) e andou depois dele
+    worker_a.inc('db_lock_retries_total', 5)
+    app_module.write_metrics_snapshot(worker_a)
+    worker_a.inc('db_lock_retries_total', 5)
+    worker_b.inc('db_lock_retries_total', 1)
+
+    seen = []
+    for worker in (worker_a, worker_b, worker_a, worker_b):
+        seen.append(scrape(worker))
+        worker.inc('db_lock_retries_total')
+    assert seen == [10, 11, 12, 13]  # antes: A ao vivo (10), depois B + arquivo velho de A (6)
+
+def test_search_leads_full_text(client):
+    """Teste: busca sem acento, ranqueada (nome pesa mais), paginada e em sincronia com delete"""
+    for lead in ({'name': 'João Café', 'message': 'Site institucional'},
+                 {'name': 'Maria', 'message': 'Quero um site para o meu café'},
+                 {'name': 'Pedro', 'email': 'pedro@empresa.com', 'message': 'Landing page'}):
+        client.post('/api/leads', json=lead)
+    assert client.get('/api/leads/search?q=cafe').status_code == 401
+    client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+
+    response = client.get('/api/leads/search?q=cafe&limit=1')
+    assert response.status_code == 200
+    assert [l['name'] for l in response.json['leads']] == ['João Café']
+    page2 = client.get(f'/api/leads/search?q=cafe&limit=1&cursor={response.json["next_cursor"]}')
+    assert [l['name'] for l in page2.json['leads']] == ['Maria']
+    assert page2.json['next_cursor'] is None
+
+    # Prefixo, email e sintaxe do FTS5 tratada como texto
+    assert [l['name'] for l in client.get('/api/leads/search?q=empre').json['leads']] == ['Pedro']
+    assert client.get('/api/leads/search?q=pedro@empresa.com').json['leads'][0]['name'] == 'Pedro'
+    assert client.get('/api/leads/search', query_string={'q': 'NEAR("site'}).status_code == 200
+    assert client.get('/api/leads/search?q=').status_code == 400
+
+    lead_id = response.json['leads'][0]['id']
+    client.delete(f'/api/leads/{lead_id}')
+    assert [l['name'] for l in client.get('/api/leads/search?q=cafe').json['leads']] == ['Maria']
+
+def test_login_recovers_from_broken_password_pool(client, monkeypatch):
+    """Teste: processo do pool de senha morreu -> 503 uma vez, depois um pool novo atende"""
+    import os
+    import signal
+    import app as app_module
+    monkeypatch.setattr(app_module, 'PASSWORD_EXECUTOR', 'process')
+    app_module.stop_password_verifier()
+    credentials = {'username': 'admin', 'password': 'admin123'}
+    assert client.post('/api/login', json=credentials).status_code == 200
+
+    for pid in list(app_module.get_password_verifier()._executor._processes):
+        os.kill(pid, signal.SIGKILL)
+    # O primeiro login pode pegar o pool quebrado (503); os seguintes usam um pool novo
+    statuses = [client.post('/api/login', json=credentials).status_code for _ in range(3)]
+    assert set(statuses) <= {200, 503}
+    assert statuses[-1] == 200
+
+def test_bulk_import_ndjson_and_csv(client, monkeypatch):
+    """Teste: importação em massa com erros por linha, lotes, contadores, eventos e busca"""
+    import json
+    import app as app_module
+    monkeypatch.setattr(app_module, 'BULK_CHUNK_SIZE', 2)
+    body = '\n'.join([
+        json.dumps({'name': 'Importado 1', 'budget': 'R$ 1.000', 'contact': '(11) 98888-7777'}),
+        '{quebrado',
+        json.dumps({'name': '', 'email': 'sem-nome@x.com'}),
+        '',
+        json.dumps({'name': 'Importado 2', 'budget': 'R$ 500', 'created_at': '2024-01-15T10:00:00-03:00'}),
+        json.dumps({'name': 'Importado 3', 'message': 'x' * 2001}),
+        json.dumps({'name': 'Importado 4', 'form_type': 'planilha'}),
+    ])
+    assert client.post('/api/leads/bulk', data=body).status_code == 401
+    client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+
+    response = client.post('/api/leads/bulk', data=body, content_type='application/x-ndjson')
+    assert response.status_code == 200
+    assert response.json['imported'] == 3
+    assert response.json['failed'] == 3
+    assert [e['row'] for e in response.json['errors']] == [2, 3, 6]
+    assert response.json['errors'][0]['error'] == 'Invalid JSON'
+
+    stats = client.get('/api/leads/stats').json
+    assert stats['total_leads'] == 3
+    assert stats['total_value'] == 1500
+    conn = get_db_connection()
+    try:
+        rows = {row['name']: row for row in conn.execute('SELECT name, form_type, phone, created_at FROM leads')}
+        assert rows['Importado 1']['phone'] == '11988887777'
+        assert rows['Importado 1']['form_type'] == 'import'
+        assert rows['Importado 4']['form_type'] == 'planilha'
+        assert rows['Importado 2']['created_at'] == '2024-01-15 13:00:00'
+        # Um evento por lote (BULK_CHUNK_SIZE=2: 3 leads em 2 lotes), nenhum por linha
+        assert conn.execute("SELECT COUNT(*) FROM lead_events WHERE type = 'created'").fetchone()[0] == 0
+        assert conn.execute("SELECT COUNT(*) FROM lead_events WHERE type = 'bulk_import'").fetchone()[0] == 2
+    finally:
+        conn.close()
+    assert client.get('/api/leads/search?q=importado').json['leads']
+    _, chunks = app_module.read_lead_events(0)
+    assert [chunk.split('\n')[1] for chunk in chunks] == ['event: reset', 'event: reset']
+
+    # CSV com os cabeçalhos do próprio export volta pela importação
+    export = client.get('/api/leads/export?format=csv').get_data(as_text=True)
+    response = client.post('/api/leads/bulk?format=csv', data=export.encode('utf-8'))
+    assert response.json == {'imported': 3, 'failed': 0, 'errors': [], 'errors_truncated': False}
+    assert client.get('/api/leads/stats').json['total_leads'] == 6
+
+    # FTS, rollups e contador de mudanças feitos por lote batem com o que os triggers fariam
+    with app_module.db_connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM trigger_bypass').fetchone()[0] == 0
+        assert conn.execute("SELECT value FROM counters WHERE name = 'lead_changes'").fetchone()[0] == 6
+        rollups = conn.execute('SELECT * FROM lead_rollup_hourly ORDER BY 1, 2').fetchall()
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute("INSERT INTO leads_fts (leads_fts, rank) VALUES ('integrity-check', 1)")
+        app_module.rebuild_lead_rollups(conn)
+        assert conn.execute('SELECT * FROM lead_rollup_hourly ORDER BY 1, 2').fetchall() == rollups
+        conn.rollback()
+    # Importado 1 e 4, duas vezes cada (o de 2024 fica fora dos últimos 30 dias)
+    assert sum(p['total_leads'] for p in client.get('/api/leads/timeseries').json['series']) == 4
+
+def test_bulk_delete_by_ids_and_filter(client):
+    """Teste: bulk delete numa transação, por ids ou por filtro, contadores em dia"""
+    for name, form_type in (('Spam casino', 'inline'), ('Spam bet', 'modal'), ('Cliente', 'inline'),
+                            ('Outro spam casino', 'inline')):
+        client.post('/api/leads', json={'name': name, 'form_type': form_type, 'budget': 'R$ 100'})
+    assert client.post('/api/leads/bulk-delete', json={'ids': [1]}).status_code == 401
+    client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+
+    response = client.post('/api/leads/bulk-delete', json={'ids': [2, 2, 999]})
+    assert response.status_code == 200
+    assert response.json['deleted'] == 1
+
+    response = client.post('/api/leads/bulk-delete', json={'filter': {'q': 'casino', 'form_type': 'inline'}})
+    assert response.json['deleted'] == 2
+    assert [l['name'] for l in client.get('/api/leads?filter=all').json['leads']] == ['Cliente']
+    assert client.get('/api/leads/stats').json['total_leads'] == 1
+
+    assert client.post('/api/leads/bulk-delete', json={'filter': {'filter': 'all'}}).status_code == 400
+    assert client.post('/api/leads/bulk-delete', json={'ids': ['1']}).status_code == 400
+    assert client.post('/api/leads/bulk-delete', json={'ids': [1], 'filter': {'q': 'x'}}).status_code == 400
+
+    # Tipos errados no JSON: 400 com mensagem, nunca 500
+    for body in ([1, 2], {'filter': {'before': 20200101}}, {'filter': {'q': 7}},
+                 {'filter': {'filter': ['all']}}, {'filter': {'form_type': ['inline']}},
+                 {'filter': {'min_value': [1]}}):
+        response = client.post('/api/leads/bulk-delete', json=body)
+        assert response.status_code == 400, body
+        assert 'error' in response.json
+    assert [l['name'] for l in client.get('/api/leads?filter=all').json['leads']] == ['Cliente']
+
+def test_archive_old_leads_in_batches(client, tmp_path, monkeypatch):
+    """Teste: retenção move leads antigos para o arquivo em lotes, sem perder nenhum.
+    KPIs contam só o DB principal (com e sem filtro); rollups e SSE ficam como estavam."""
+    import app as app_module
+    client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+    old = '\n'.join(f'{{"name": "Antigo {i}", "budget": "R$ 10", "created_at": "2020-01-0{i + 1}"}}'
+                    for i in range(5))
+    client.post('/api/leads/bulk', data=old + '\n{"name": "Novo"}', content_type='application/x-ndjson')
+    rollups = lambda conn: [tuple(row) for row in conn.execute('SELECT * FROM lead_rollup_daily ORDER BY 1, 2')]
+    with app_module.db_connection() as conn:
+        rollups_before = rollups(conn)
+
+    archive_path = str(tmp_path / 'archive.db')
+    # Simula uma rodada interrompida: o lote já está no arquivo mas não saiu do principal
+    archive = app_module.open_archive_db(archive_path)
+    archive.execute("INSERT INTO archived_leads (id, name, budget, budget_cents, form_type, created_at) "
+                    "VALUES (1, 'Antigo 0', 'R$ 10', 1000, 'import', '2020-01-01')")
+    archive.commit()
+    archive.close()
+
+    moved = app_module.archive_old_leads(days=30, batch_size=2, pause=0, archive_path=archive_path)
+    assert moved == 5
+    assert [l['name'] for l in client.get('/api/leads?filter=all').json['leads']] == ['Novo']
+    stats = client.get('/api/leads/stats').json
+    assert (stats['total_leads'], stats['total_value_cents']) == (1, 0)
+    # Mesmo recorte pelo caminho filtrado (agrega leads) e pelos contadores: mesmos totais
+    filtered = client.get('/api/leads/stats?min_value=0').json
+    assert (filtered['total_leads'], filtered['total_value_cents']) == (1, 0)
+    with app_module.db_connection() as conn:
+        assert rollups(conn) == rollups_before
+        assert conn.execute("SELECT COUNT(*) FROM lead_events WHERE type = 'deleted'").fetchone()[0] == 0
+        assert conn.execute('SELECT COUNT(*) FROM trigger_bypass').fetchone()[0] == 0
+
+    archive = sqlite3.connect(archive_path)
+    try:
+        assert archive.execute('SELECT COUNT(*), SUM(budget_cents) FROM archived_leads').fetchone() == (5, 5000)
+    finally:
+        archive.close()
+    assert app_module.archive_old_leads(days=30, archive_path=archive_path) == 0
+
+    # Reparos somam o arquivo: recalculado bate com o mantido incrementalmente
+    monkeypatch.setattr(app_module, 'ARCHIVE_DB_PATH', archive_path)
+    with app_module.db_connection() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        app_module.rebuild_lead_rollups(conn)
+        app_module.backfill_lead_counters(conn)
+        conn.commit()
+        assert rollups(conn) == rollups_before
+    stats = client.get('/api/leads/stats').json
+    assert (stats['total_leads'], stats['total_value_cents']) == (1, 0)
+
+def test_structured_logging_pipeline(monkeypatch):
+    """Teste: JSON com campos extras, amostragem por evento e fila cheia descarta sem bloquear"""
+    import json
+    import logging
+    import queue
+    import app as app_module
+
+    record = logging.LogRecord('app', logging.INFO, __file__, 1, 'Lead created: ID=%s', (7,), None)
+    record.event = 'lead_created'
+    record.lead_id = 7
+    entry = json.loads(app_module.JsonFormatter().format(record))
+    assert entry['msg'] == 'Lead created: ID=7'
+    assert entry['level'] == 'INFO'
+    assert entry['event'] == 'lead_created' and entry['lead_id'] == 7
+
+    assert app_module.parse_sample_rates('lead_created=0, leads_listed=0.5') == {'lead_created': 0.0, 'leads_listed': 0.5}
+    sampling = app_module.SamplingFilter({'lead_created': 0.0})
+    assert not sampling.filter(record)
+    record.event = 'other'
+    assert sampling.filter(record)
+
+    monkeypatch.setattr(app_module, '_metrics', app_module.Metrics())
+    handler = app_module.DroppingQueueHandler(queue.Queue(1))
+    handler.handle(record)
+    handler.handle(record)  # Fila cheia: volta na hora
+    assert handler.queue.qsize() == 1
+    assert handler.queue.get_nowait().msg == 'Lead created: ID=7'
+    assert 'log_records_dropped_total 1' in app_module.render_metrics(
+        app_module.merge_metric_snapshots([app_module.get_metrics().snapshot()]))
+
+def test_create_lead_idempotency_key(client):
+    """Teste: mesmo Idempotency-Key devolve o lead original sem gravar outro"""
+    import app as app_module
+    lead = {'name': 'Clique duplo', 'email': 'duplo@test.com', 'form_type': 'modal'}
+    headers = {'Idempotency-Key': 'form-fill-1'}
+
+    first = client.post('/api/leads', json=lead, headers=headers)
+    assert first.status_code == 201
+    assert 'Idempotent-Replayed' not in first.headers
+    again = client.post('/api/leads', json=lead, headers=headers)
+    assert again.status_code == 201
+    assert again.json == first.json
+    assert again.headers['Idempotent-Replayed'] == 'true'
+
+    # Sem o cache (outro worker, restart) o índice único responde igual
+    app_module._idempotency_caches.clear()
+    from_db = client.post('/api/leads', json=lead, headers=headers)
+    assert from_db.json['id'] == first.json['id']
+
+    # Chave nova = preenchimento novo, mesmo com o mesmo conteúdo
+    other = client.post('/api/leads', json=lead, headers={'Idempotency-Key': 'form-fill-2'})
+    assert other.json['id'] != first.json['id']
+    assert client.post('/api/leads', json=lead, headers={'Idempotency-Key': 'com espaço'}).status_code == 400
+
+    conn = get_db_connection()
+    try:
+        assert conn.execute('SELECT COUNT(*) FROM leads').fetchone()[0] == 2
+        assert conn.execute("SELECT value FROM counters WHERE name = 'lead_count'").fetchone()[0] == 2
+    finally:
+        conn.close()
+
+def test_create_lead_content_hash_window(client, monkeypatch):
+    """Teste: sem header, mesmo name/contact/email dentro da janela é o mesmo envio"""
+    import threading
+    import app as app_module
+    monkeypatch.setattr(app_module, 'LEAD_INGEST_MODE', 'batch')
+
+    ids = []
+    def post():
+        with app.test_client() as c:
+            ids.append(c.post('/api/leads', json={'name': 'Rede  Lenta', 'contact': '(11) 9999-0000'}).json['id'])
+    threads = [threading.Thread(target=post) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(set(ids)) == 1
+
+    # Caixa e espaços não contam; contato diferente é outro lead
+    same = client.post('/api/leads', json={'name': 'rede lenta', 'contact': '(11) 9999-0000'})
+    assert same.json['id'] == ids[0]
+    assert client.post('/api/leads', json={'name': 'Rede Lenta', 'contact': 'outro'}).json['id'] != ids[0]
+
+    # Virada da janela ainda casa com a anterior; duas janelas depois é envio novo
+    key = app_module.idempotency_key(None, 'A', 'b', 'c', now=1000)
+    assert key in app_module.idempotency_lookup_keys(
+        app_module.idempotency_key(None, 'A', 'b', 'c', now=1000 + app_module.IDEMPOTENCY_WINDOW))
+    assert key not in app_module.idempotency_lookup_keys(
+        app_module.idempotency_key(None, 'A', 'b', 'c', now=1000 + 2 * app_module.IDEMPOTENCY_WINDOW))
+
+def test_idempotency_cache_expiry_and_lru():
+    """Teste: hash expira com a janela, chave explícita com IDEMPOTENCY_KEY_TTL, e LRU"""
+    from app import IdempotencyCache, IDEMPOTENCY_WINDOW, IDEMPOTENCY_KEY_TTL
+    cache = IdempotencyCache(max_keys=2)
+    cache.put('hash:abc:10', 1, now=0)
+    cache.put('key:x', 2, now=0)
+    assert cache.get('hash:abc:11', now=1) == 1
+    assert cache.get('hash:abc:10', now=IDEMPOTENCY_WINDOW + 1) is None
+    assert cache.get('key:x', now=IDEMPOTENCY_KEY_TTL - 1) == 2
+    assert cache.get('key:x', now=IDEMPOTENCY_KEY_TTL + 1) is None
+    cache.put('key:x', 2, now=0)
+
+    cache.put('key:y', 3, now=0)
+    cache.put('key:z', 4, now=0)
+    assert len(cache) == 2
+    assert cache.get('key:x') is None
+
+
+def test_list_leads_sparse_fields_and_detail(client):
+    """Teste: ?view=summary e ?fields= cortam colunas; GET /api/leads/<id> traz o lead inteiro"""
+    client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+    lead_id = client.post('/api/leads', json={
+        'name': 'Resumo', 'contact': '(11) 99999-0000', 'message': 'x' * 2000, 'budget': 'R$ 900'
+    }).json['id']
+
+    full = client.get('/api/leads').json['leads'][0]
+    assert full['message'] == 'x' * 2000
+    summary = client.get('/api/leads?view=summary').json['leads'][0]
+    assert set(summary) == {'id', 'name', 'form_type', 'budget', 'created_at', 'phone'}
+    assert summary['phone'] == '11999990000'
+    # id e created_at sempre vêm (cursor); busca aceita a mesma projeção
+    assert set(client.get('/api/leads?fields=name').json['leads'][0]) == {'id', 'name', 'created_at'}
+    found = client.get('/api/leads/search?q=resumo&view=summary').json['leads']
+    assert [set(lead) for lead in found] == [set(summary)]
+
+    assert client.get('/api/leads?fields=name,senha').status_code == 400
+    assert client.get('/api/leads?view=gigante').status_code == 400
+
+    detail = client.get(f'/api/leads/{lead_id}')
+    assert detail.status_code == 200
+    assert detail.json == full
+    assert client.get(f'/api/leads/{lead_id}?fields=message').json == {
+        'id': lead_id, 'message': 'x' * 2000, 'created_at': full['created_at']}
+    assert client.get('/api/leads/999999').status_code == 404
+
+    client.post('/api/logout')
+    assert client.get(f'/api/leads/{lead_id}').status_code == 401
+
+
+def test_create_app_isolated_instances(tmp_path):
+    """Teste: import sem I/O; cada create_app usa o próprio DB, preparado pelo init-db"""
+    import subprocess
+    import sys
+    from app import create_app, stop_lead_writer
+    db_path = tmp_path / 'import' / 'leads.db'
+    subprocess.run([sys.executable, '-c', 'import app'], check=True,
+                   cwd=os.path.dirname(os.path.abspath(__file__)), env=dict(os.environ, DB_PATH=str(db_path)))
+    assert not db_path.parent.exists()
+
+    apps = []
+    for name in ('a', 'b'):
+        instance = create_app({'TESTING': True, 'SECRET_KEY': 'x', 'DB_PATH': str(tmp_path / name / 'leads.db')})
+        result = instance.test_cli_runner().invoke(args=['init-db'])
+        assert result.exit_code == 0, result.output
+        assert 'Database ready' in result.output
+        apps.append(instance)
+    try:
+        with apps[0].test_client() as c:
+            assert c.post('/api/leads', json={'name': 'Só no A'}).status_code == 201
+        counts = []
+        for instance in apps:
+            with instance.test_client() as c:
+                c.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+                counts.append(len(c.get('/api/leads').json['leads']))
+        assert counts == [1, 0]
+    finally:
+        stop_lead_writer()
+        close_db_pool()
+
+
+def test_admin_reads_from_memory_snapshot(client, monkeypatch):
+    """Teste: com READ_SNAPSHOT_INTERVAL o admin lê a cópia em memória, com a idade no header"""
+    import time
+    import app as app_module
+    monkeypatch.setattr(app_module, 'READ_SNAPSHOT_INTERVAL', 3600.0)
+    client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+    client.post('/api/leads', json={'name': 'Antes', 'budget': 'R$ 100'})
+    snapshot = app_module.get_read_snapshot()
+    try:
+        deadline = time.monotonic() + 5
+        while snapshot.age() is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        response = client.get('/api/leads')
+        assert float(response.headers['X-Snapshot-Age']) < 5
+        assert [lead['name'] for lead in response.json['leads']] == ['Antes']
+
+        # Escrita pública não espera o snapshot: aparece só no próximo refresh
+        new_id = client.post('/api/leads', json={'name': 'Depois'}).json['id']
+        assert len(client.get('/api/leads').json['leads']) == 1
+        assert client.get('/api/leads/stats').json['total_leads'] == 1
+        assert 'X-Snapshot-Age' in client.get('/api/leads/export?format=ndjson').headers
+        # Drawer de lead novo (avisado pelo SSE) confere no DB
+        assert client.get(f'/api/leads/{new_id}').json['name'] == 'Depois'
+
+        assert snapshot.refresh() is True
+        assert snapshot.refresh() is False  # data_version igual: sem cópia nova
+        assert len(client.get('/api/leads').json['leads']) == 2
+        assert client.get('/api/leads/search?q=depois').json['leads'][0]['id'] == new_id
+
+        # Delete do admin acorda o refresh na hora
+        client.delete(f'/api/leads/{new_id}')
+        deadline = time.monotonic() + 5
+        while len(client.get('/api/leads').json['leads']) != 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(client.get('/api/leads').json['leads']) == 1
+
+        # Snapshot velho demais: leitura volta para o DB, sem o header
+        monkeypatch.setattr(app_module, 'READ_SNAPSHOT_MAX_AGE', -1)
+        assert 'X-Snapshot-Age' not in client.get('/api/leads').headers
+    finally:
+        app_module.stop_read_snapshots()
+
+
+def test_online_backup_rotation_and_restore(client, tmp_path, monkeypatch):
+    """Teste: backup em passos vira .db.gz com rotação; restore-db volta o conteúdo e guarda o atual"""
+    import app as app_module
+    monkeypatch.setattr(app_module, 'BACKUP_DIR', str(tmp_path / 'backups'))
+    monkeypatch.setattr(app_module, 'BACKUP_PAGES_PER_STEP', 1)
+    monkeypatch.setattr(app_module, 'BACKUP_STEP_PAUSE', 0)
+    assert client.post('/api/backups').status_code == 401
+
+    client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+    client.post('/api/leads', json={'name': 'Original', 'budget': 'R$ 100'})
+    response = client.post('/api/backups')
+    assert response.status_code == 201
+    assert response.json['steps'] > 1 and response.json['lock_held_max'] >= 0
+    first = response.json['name']
+
+    client.post('/api/leads', json={'name': 'Depois'})
+    app_module.backup_db(keep=2)
+    app_module.backup_db(keep=2)
+    names = [b['name'] for b in client.get('/api/backups').json['backups']]
+    assert len(names) == 2 and first not in names
+    oldest = names[-1]
+
+    # Backup/restore em andamento em outro processo: 409, sem esperar
+    with app_module.backup_dir_lock(app_module.get_backup_dir()):
+        assert client.post('/api/backups').status_code == 409
+
+    client.delete('/api/leads/1')
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['restore-db', oldest, '--yes'])
+    assert result.exit_code == 0, result.output
+    assert 'Restart the workers' in result.output
+    assert [l['name'] for l in client.get('/api/leads').json['leads']] == ['Depois', 'Original']
+    assert client.get('/api/leads/stats').json['total_leads'] == 2
+    # O estado de antes do restore virou backup e nenhum foi rodado fora
+    assert len(app_module.list_backups()) == 3
+    with app_module.db_connection() as conn:
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+    assert runner.invoke(args=['restore-db', 'nao-existe.db.gz', '--yes']).exit_code != 0
+
+
+def test_backup_includes_archive_db(client, tmp_path, monkeypatch):
+    """Teste: backup leva o arquivo de retenção junto; restore volta os leads arquivados"""
+    import app as app_module
+    monkeypatch.setattr(app_module, 'BACKUP_DIR', str(tmp_path / 'backups'))
+    monkeypatch.setattr(app_module, 'ARCHIVE_DB_PATH', str(tmp_path / 'archive.db'))
+    client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+    client.post('/api/leads/bulk', data='{"name": "Velho", "created_at": "2020-01-01"}\n{"name": "Novo"}',
+                content_type='application/x-ndjson')
+    assert app_module.archive_old_leads(days=30, pause=0) == 1
+
+    def archived():
+        conn = sqlite3.connect(app_module.get_archive_db_path())
+        try:
+            return conn.execute('SELECT name FROM archived_leads').fetchall()
+        finally:
+            conn.close()
+    backup = app_module.backup_db(keep=2)
+    assert backup['archive'] == backup['name'].replace('.db.gz', '.archive.db.gz')
+    assert app_module.list_backups()[0]['archive'] == backup['archive']
+
+    # Arquivo perdido/alterado depois do backup: restore traz de volta
+    conn = sqlite3.connect(app_module.get_archive_db_path())
+    conn.execute('DELETE FROM archived_leads')
+    conn.commit()
+    conn.close()
+    assert archived() == []
+    app_module.restore_db(backup['name'])
+    assert archived() == [('Velho',)]
+    assert [l['name'] for l in client.get('/api/leads?filter=all').json['leads']] == ['Novo']
+
+    # Rotação leva o par junto
+    app_module.backup_db(keep=1)
+    files = os.listdir(app_module.get_backup_dir())
+    assert sorted(f for f in files if not f.startswith('.')) == sorted(
+        [app_module.list_backups()[0]['name'], app_module.list_backups()[0]['archive']])
+
+def test_lead_timeseries_rollups(client):
+    """Teste: série temporal sai das rollups, que acompanham insert/delete e podem ser reconstruídas"""
+    import json
+    import app as app_module
+    client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+    rows = [
+        {'name': 'A', 'budget': 'R$ 10', 'form_type': 'modal', 'created_at': '2020-01-01 10:05:00'},
+        {'name': 'B', 'budget': 'R$ 20', 'form_type': 'inline', 'created_at': '2020-01-01 10:55:00'},
+        {'name': 'C', 'budget': 'R$ 30', 'form_type': 'inline', 'created_at': '2020-01-01 11:00:00'},
+        {'name': 'D', 'budget': 'R$ 40', 'form_type': 'inline', 'created_at': '2020-01-03 09:00:00'},
+    ]
+    client.post('/api/leads/bulk', data='\n'.join(json.dumps(r) for r in rows), content_type='application/x-ndjson')
+
+    def day_series():
+        response = client.get('/api/leads/timeseries?bucket=day&from=2020-01-01&to=2020-01-03')
+        assert response.status_code == 200
+        return [(p['bucket'], p['total_leads'], p['total_value_cents'], p['by_form_type']) for p in response.json['series']]
+
+    assert day_series() == [
+        ('2020-01-01', 3, 6000, {'inline': 2, 'modal': 1}),
+        ('2020-01-02', 0, 0, {}),
+        ('2020-01-03', 1, 4000, {'inline': 1}),
+    ]
+    hourly = client.get('/api/leads/timeseries?bucket=hour&from=2020-01-01T10:00&to=2020-01-01T12:00').json
+    assert [(p['bucket'], p['total_leads']) for p in hourly['series']] == [
+        ('2020-01-01 10:00:00', 2), ('2020-01-01 11:00:00', 1)]
+    assert hourly['form_types'] == ['inline', 'modal']
+
+    # Delete desconta do bucket; lead de agora cai no último bucket do default (30 dias)
+    lead_d = client.get('/api/leads/search?q=D').json['leads'][0]['id']
+    client.delete(f'/api/leads/{lead_d}')
+    assert day_series()[2] == ('2020-01-03', 0, 0, {})
+    client.post('/api/leads', json={'name': 'Hoje', 'budget': 'R$ 5', 'form_type': 'modal'})
+    recent = client.get('/api/leads/timeseries').json['series']
+    assert len(recent) == 30 and recent[-1]['by_form_type'] == {'modal': 1}
+
+    # Rollup corrompida: rebuild-rollups recalcula a partir das linhas
+    expected = day_series()
+    with app_module.db_connection() as conn:
+        conn.execute('DELETE FROM lead_rollup_daily')
+        conn.commit()
+    result = app.test_cli_runner().invoke(args=['rebuild-rollups'])
+    assert result.exit_code == 0, result.output
+    assert day_series() == expected
+
+    assert client.get('/api/leads/timeseries?bucket=week').status_code == 400
+    assert client.get('/api/leads/timeseries?bucket=hour&from=2019-01-01&to=2020-01-01').status_code == 400
+    assert client.get('/api/leads/timeseries?from=2020-01-03&to=2020-01-01').status_code == 400
+
+
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])
-